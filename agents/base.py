@@ -3,6 +3,14 @@ from typing import TypedDict, Annotated
 from langchain.schema import BaseMessage
 import operator
 
+# Терапевтические подходы, между которыми выбирает роутер
+APPROACHES = ("DBT", "IFS", "TRE")
+
+# Откуда взято решение роутера (messages.route_source): ответ LLM, локальный
+# классификатор, подход из недоразобранного потока или DBT по умолчанию.
+# Обучать классификатор и проверять промпты можно только на ROUTE_LLM
+ROUTE_LLM, ROUTE_CLASSIFIER, ROUTE_PARTIAL, ROUTE_DEFAULT = "llm", "classifier", "partial", "default"
+
 # Определяем состояние для LangGraph
 class TherapyState(TypedDict):
     messages: Annotated[List[BaseMessage], operator.add]
@@ -12,4 +20,9 @@ class TherapyState(TypedDict):
     insights: Dict
     session_id: Optional[int]
     user_message: str
-    specialist_response: str
\ No newline at end of file
+    specialist_response: str
+    # Скользящая сводка старой части беседы и число свернутых в нее сообщений
+    summary: str
+    summary_covered: int
+    # Источник решения роутера (ROUTE_*)
+    route_source: Optional[str]
\ No newline at end of file
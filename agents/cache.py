@@ -0,0 +1,206 @@
+"""Кеш ответов LLM: LRU в памяти поверх SQLite.
+
+Ключ - хеш содержимого запроса (системный промпт, контекст, сообщение,
+модель, температура, max_tokens и аргументы вызова вроде response_format),
+поэтому одинаковые запросы не уходят к провайдеру
+повторно, а смена промпта автоматически дает новые ключи.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from langchain.schema import BaseMessage
+
+
+class LLMResponseCache:
+    """Двухуровневый кеш ответов с вытеснением по размеру и TTL"""
+
+    def __init__(
+        self,
+        db_path: str = "llm_cache.db",
+        max_memory_items: int = 512,
+        max_disk_items: int = 10000,
+        ttl_seconds: float = 7 * 24 * 3600,
+    ):
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl_seconds = ttl_seconds
+
+        # key -> (response, agent, prompt_hash, created_at)
+        self._memory: "OrderedDict[str, Tuple[str, str, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._writes_since_trim = 0
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                agent TEXT,
+                prompt_hash TEXT,
+                response TEXT,
+                created_at REAL,
+                accessed_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_agent ON llm_cache(agent, prompt_hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+        self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # Ключи
+    # ------------------------------------------------------------------
+    @staticmethod
+    def prompt_hash(system_prompt: str) -> str:
+        return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def make_key(
+        messages: List[BaseMessage],
+        model: str,
+        temperature: Optional[float],
+        max_tokens: Optional[int] = None,
+        options: Optional[Dict] = None,
+    ) -> str:
+        """Хеш запроса: роли и тексты сообщений плюс параметры модели.
+
+        options - аргументы вызова (response_format и т.п.): от них зависит
+        форма ответа, поэтому запросы с разными options не делят запись.
+        """
+
+        payload = {
+            "messages": [(message.type, message.content) for message in messages],
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "options": options or {},
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # ------------------------------------------------------------------
+    # Чтение и запись
+    # ------------------------------------------------------------------
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[3] <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT response, agent, prompt_hash, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[3] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self._counters["misses"] += 1
+                return None
+
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._remember(key, (row[0], row[1], row[2], row[3]))
+            self._counters["disk_hits"] += 1
+            return row[0]
+
+    def set(self, key: str, response: str, agent: str, prompt_hash: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, (response, agent, prompt_hash, now))
+            self._conn.execute(
+                """INSERT OR REPLACE INTO llm_cache
+                (key, agent, prompt_hash, response, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (key, agent, prompt_hash, response, now, now),
+            )
+            self._counters["writes"] += 1
+            self._writes_since_trim += 1
+            # Обрезаем диск не на каждой записи, а пачками
+            if self._writes_since_trim >= 100:
+                self._trim_disk(now)
+            self._conn.commit()
+
+    def invalidate(self, agent: str, keep_prompt_hash: Optional[str] = None) -> None:
+        """Удалить записи агента, сделанные с другим системным промптом."""
+
+        with self._lock:
+            stale = [
+                key for key, entry in self._memory.items()
+                if entry[1] == agent and entry[2] != keep_prompt_hash
+            ]
+            for key in stale:
+                del self._memory[key]
+            cursor = self._conn.execute(
+                "DELETE FROM llm_cache WHERE agent = ? AND prompt_hash IS NOT ?", (agent, keep_prompt_hash)
+            )
+            self._counters["evictions"] += len(stale) + max(cursor.rowcount, 0)
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_items"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------
+    # Internal helpers (вызываются под self._lock)
+    # ------------------------------------------------------------------
+    def _remember(self, key: str, entry: Tuple[str, str, str, float]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _trim_disk(self, now: float) -> None:
+        self._writes_since_trim = 0
+        expired = self._conn.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        overflow = self._conn.execute(
+            """DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_disk_items,),
+        ).rowcount
+        self._counters["evictions"] += max(expired, 0) + max(overflow, 0)
+
+
+_shared_cache: Optional[LLMResponseCache] = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache(db_path: str, **kwargs) -> LLMResponseCache:
+    """Общий на процесс экземпляр кеша."""
+
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = LLMResponseCache(db_path, **kwargs)
+        return _shared_cache
+
+
+__all__ = ["LLMResponseCache", "shared_cache"]
@@ -0,0 +1,206 @@
+"""Локальный классификатор маршрутизации без обращения к LLM.
+
+Хешированные символьные n-граммы и линейная модель (мультиклассовая
+логистическая регрессия), обученная на истории маршрутизации LLM-роутера
+и ключевых признаках из ROUTER_PROMPT.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from agents.base import APPROACHES as LABELS
+from agents.prompts import ROUTER_PROMPT
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_SECTION_RE = re.compile(r"^- (DBT|IFS|TRE) \((.*?)\):(.*?)(?=^- |^Ответь)", re.M | re.S)
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def prompt_seed_examples(prompt: str = ROUTER_PROMPT) -> List[Tuple[str, str]]:
+    """Извлечь пары (фраза, подход) из описаний подходов в промпте роутера."""
+
+    examples: List[Tuple[str, str]] = []
+    for match in _SECTION_RE.finditer(prompt):
+        label, title, body = match.groups()
+        examples.append((title, label))
+        body = body.replace("Признаки:", ",").replace("Для ", "")
+        for phrase in re.split(r"[,.\n]", body):
+            phrase = phrase.strip(' "')
+            if len(phrase) > 3:
+                examples.append((phrase, label))
+    return examples
+
+
+class LocalRouterClassifier:
+    """Линейный классификатор DBT/IFS/TRE на хешированных n-граммах"""
+
+    def __init__(
+        self,
+        n_features: int = 2 ** 18,
+        ngram_range: Tuple[int, int] = (3, 5),
+        weights: Optional[Dict[int, List[float]]] = None,
+        bias: Optional[List[float]] = None,
+        prompt_hash: Optional[str] = None,
+    ):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.weights: Dict[int, List[float]] = weights or {}
+        self.bias: List[float] = bias or [0.0] * len(LABELS)
+        # Промпт роутера, под решения которого обучена модель
+        self.prompt_hash = prompt_hash
+
+    def matches(self, prompt: str) -> bool:
+        """Обучена ли модель под этот промпт роутера."""
+
+        return self.prompt_hash == prompt_hash(prompt)
+
+    # ------------------------------------------------------------------
+    # Признаки
+    # ------------------------------------------------------------------
+    def _features(self, text: str) -> Dict[int, float]:
+        counts: Dict[int, float] = {}
+        low, high = self.ngram_range
+        for word in _WORD_RE.findall(text.lower()):
+            tokens = [word]
+            padded = f" {word} "
+            for size in range(low, high + 1):
+                tokens.extend(padded[i:i + size] for i in range(len(padded) - size + 1))
+            for token in tokens:
+                # crc32 стабилен между процессами, в отличие от hash()
+                index = zlib.crc32(token.encode("utf-8")) % self.n_features
+                counts[index] = counts.get(index, 0.0) + 1.0
+
+        norm = math.sqrt(sum(value * value for value in counts.values())) or 1.0
+        return {index: value / norm for index, value in counts.items()}
+
+    def _scores(self, features: Dict[int, float]) -> List[float]:
+        scores = list(self.bias)
+        for index, value in features.items():
+            row = self.weights.get(index)
+            if row is not None:
+                for label in range(len(LABELS)):
+                    scores[label] += row[label] * value
+        return scores
+
+    @staticmethod
+    def _softmax(scores: Sequence[float]) -> List[float]:
+        top = max(scores)
+        exps = [math.exp(score - top) for score in scores]
+        total = sum(exps)
+        return [value / total for value in exps]
+
+    # ------------------------------------------------------------------
+    # Обучение и предсказание
+    # ------------------------------------------------------------------
+    def fit(
+        self,
+        texts: Sequence[str],
+        labels: Sequence[str],
+        epochs: int = 15,
+        learning_rate: float = 0.5,
+        l2: float = 1e-4,
+        seed: int = 13,
+    ) -> "LocalRouterClassifier":
+        """Обучить модель SGD по кросс-энтропии."""
+
+        samples = [
+            (self._features(text), LABELS.index(label))
+            for text, label in zip(texts, labels)
+            if label in LABELS
+        ]
+        rng = random.Random(seed)
+        self.weights = {}
+        self.bias = [0.0] * len(LABELS)
+
+        for epoch in range(epochs):
+            rng.shuffle(samples)
+            rate = learning_rate / (1 + epoch)
+            for features, target in samples:
+                probs = self._softmax(self._scores(features))
+                grads = [probs[label] - (1.0 if label == target else 0.0) for label in range(len(LABELS))]
+                for label in range(len(LABELS)):
+                    self.bias[label] -= rate * grads[label]
+                for index, value in features.items():
+                    row = self.weights.setdefault(index, [0.0] * len(LABELS))
+                    for label in range(len(LABELS)):
+                        row[label] -= rate * (grads[label] * value + l2 * row[label])
+        return self
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        probs = self._softmax(self._scores(self._features(text)))
+        return dict(zip(LABELS, probs))
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Вернуть (подход, уверенность)."""
+
+        probs = self.predict_proba(text)
+        label = max(probs, key=probs.get)
+        return label, probs[label]
+
+    # ------------------------------------------------------------------
+    # Сохранение
+    # ------------------------------------------------------------------
+    def save(self, path: str) -> None:
+        payload = {
+            "labels": list(LABELS),
+            "n_features": self.n_features,
+            "ngram_range": list(self.ngram_range),
+            "bias": self.bias,
+            "prompt_hash": self.prompt_hash,
+            "weights": {str(index): row for index, row in self.weights.items()},
+        }
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle)
+
+    @classmethod
+    def load(cls, path: str) -> "LocalRouterClassifier":
+        with open(path, encoding="utf-8") as handle:
+            payload = json.load(handle)
+        return cls(
+            n_features=payload["n_features"],
+            ngram_range=tuple(payload["ngram_range"]),
+            weights={int(index): row for index, row in payload["weights"].items()},
+            bias=payload["bias"],
+            # Модели без отметки обучались под промпт по умолчанию
+            prompt_hash=payload.get("prompt_hash") or prompt_hash(ROUTER_PROMPT),
+        )
+
+    @classmethod
+    def load_if_exists(cls, path: Optional[str]) -> Optional["LocalRouterClassifier"]:
+        """Загрузить модель, если файл есть; иначе None."""
+
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            return cls.load(path)
+        except Exception as e:
+            print(f"Не удалось загрузить классификатор роутера {path}: {e}")
+            return None
+
+
+def train_classifier(
+    examples: Iterable[Tuple[str, str]],
+    prompt: str = ROUTER_PROMPT,
+    **fit_kwargs,
+) -> LocalRouterClassifier:
+    """Обучить классификатор на истории и признаках из промпта роутера."""
+
+    data = list(examples) + prompt_seed_examples(prompt)
+    texts = [text for text, _ in data]
+    labels = [label for _, label in data]
+    model = LocalRouterClassifier(prompt_hash=prompt_hash(prompt))
+    return model.fit(texts, labels, **fit_kwargs)
+
+
+__all__ = ["LABELS", "LocalRouterClassifier", "prompt_hash", "prompt_seed_examples", "train_classifier"]
@@ -0,0 +1,102 @@
+"""Сборка контекста агента в пределах бюджета токенов.
+
+Токены оцениваются локально по длине текста, без токенизатора модели:
+оценка грубая, но быстрая и с запасом для кириллицы.
+"""
+
+import math
+from typing import List, Optional
+
+from langchain.schema import BaseMessage
+
+# Служебные токены роли и разметки на каждое сообщение
+MESSAGE_OVERHEAD = 4
+# Сообщение короче этого остатка бюджета не обрезаем, а отбрасываем
+MIN_TRUNCATED_TOKENS = 32
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов: ~4 символа ASCII или ~3 прочих на токен."""
+
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 3)
+
+
+def message_tokens(message: BaseMessage) -> int:
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return estimate_tokens(content) + MESSAGE_OVERHEAD
+
+
+def history_tokens(messages: List[BaseMessage]) -> int:
+    return sum(message_tokens(message) for message in messages)
+
+
+def pack_context(messages: List[BaseMessage], budget: int) -> List[BaseMessage]:
+    """Самые свежие сообщения, суммарно укладывающиеся в budget токенов.
+
+    Сообщения берутся с конца истории; первое не влезшее обрезается до
+    остатка бюджета (если остаток заметный), более старые отбрасываются.
+    """
+
+    packed: List[BaseMessage] = []
+    remaining = budget
+    for message in reversed(messages):
+        cost = message_tokens(message)
+        if cost <= remaining:
+            packed.append(message)
+            remaining -= cost
+            continue
+        truncated = _truncate(message, remaining - MESSAGE_OVERHEAD)
+        if truncated is not None:
+            packed.append(truncated)
+        break
+    packed.reverse()
+    return packed
+
+
+def _truncate(message: BaseMessage, tokens: int) -> Optional[BaseMessage]:
+    if tokens < MIN_TRUNCATED_TOKENS or not isinstance(message.content, str):
+        return None
+    content = message.content
+    # Пропорционально оценке; начало реплики обычно содержательнее хвоста
+    chars = int(len(content) * tokens / max(estimate_tokens(content), 1)) - 1
+    return message.model_copy(update={"content": content[:max(chars, 0)] + "…"})
+
+
+class RollingSummary:
+    """Сводка старой части беседы.
+
+    covered - сколько первых сообщений истории уже свернуто в text.
+    Объект неизменяемый: новая сводка - новый экземпляр, поэтому читатели
+    всегда видят согласованную пару (text, covered).
+    """
+
+    __slots__ = ("text", "covered")
+
+    def __init__(self, text: str = "", covered: int = 0):
+        self.text = text
+        self.covered = covered
+
+    def next_turn(self, messages: List[BaseMessage], budget: int) -> Optional[List[BaseMessage]]:
+        """Самый старый несвернутый ход, если сводка и хвост не влезают в budget."""
+
+        tail = messages[self.covered:]
+        if len(tail) < 2:
+            return None
+        if estimate_tokens(self.text) + history_tokens(tail) <= budget:
+            return None
+        return tail[:2]
+
+    def folded(self, text: str, turn_size: int) -> "RollingSummary":
+        return RollingSummary(text, self.covered + turn_size)
+
+
+__all__ = [
+    "RollingSummary",
+    "estimate_tokens",
+    "history_tokens",
+    "message_tokens",
+    "pack_context",
+]
@@ -0,0 +1,195 @@
+"""Параметры LLM по агентам и общий реестр клиентов ChatLiteLLM.
+
+Агенты с одинаковыми итоговыми параметрами получают один и тот же клиент,
+поэтому HTTP-соединения LiteLLM переиспользуются между агентами
+и оркестраторами в пределах процесса. Каждый запрос проходит через общий
+планировщик (agents/scheduler.py): приоритеты, лимиты и повторы.
+"""
+
+import functools
+import json
+import threading
+from typing import Callable, Dict, Optional
+
+from langchain_litellm import ChatLiteLLM
+
+from agents.scheduler import LLMScheduler
+from config import (
+    AGENT_LLM_CONFIG, LITELLM_CONFIG, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES, LLM_QUEUE_TIMEOUT, LLM_RATE_LIMITS, LLM_RPM, LLM_TPM, STRUCTURED_OUTPUT,
+)
+
+AGENT_KEYS = ("router", "dbt", "ifs", "tre", "memory", "summary")
+
+_clients: Dict[str, ChatLiteLLM] = {}
+_lock = threading.Lock()
+_factory: Callable[..., ChatLiteLLM] = ChatLiteLLM
+_scheduler = LLMScheduler(
+    rate_limits=LLM_RATE_LIMITS,
+    default_limits=(LLM_RPM, LLM_TPM),
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    max_retries=LLM_MAX_RETRIES,
+    backoff_base=LLM_BACKOFF_BASE,
+    backoff_max=LLM_BACKOFF_MAX,
+    queue_timeout=LLM_QUEUE_TIMEOUT,
+)
+
+
+class ScheduledLLM:
+    """Клиент агента, запросы которого идут через планировщик.
+
+    Сам клиент общий (см. get_llm), а приоритет свой у каждого агента:
+    по умолчанию из AGENT_PRIORITY по ключу агента. Остальные атрибуты
+    (model, temperature, ...) берутся у исходного клиента.
+    """
+
+    def __init__(self, client, scheduler: LLMScheduler, agent_key: Optional[str], priority: Optional[int] = None):
+        self.client = client
+        self.scheduler = scheduler
+        self.agent_key = agent_key or "default"
+        self.priority = priority
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def invoke(self, messages, **kwargs):
+        return self.scheduler.call(
+            self.agent_key, getattr(self.client, "model", None), messages,
+            lambda: self.client.invoke(messages, **kwargs), self.priority,
+        )
+
+    async def ainvoke(self, messages, **kwargs):
+        return await self.scheduler.acall(
+            self.agent_key, getattr(self.client, "model", None), messages,
+            lambda: self.client.ainvoke(messages, **kwargs), self.priority,
+        )
+
+    def stream(self, messages, **kwargs):
+        return self.scheduler.stream(
+            self.agent_key, getattr(self.client, "model", None), messages,
+            lambda: self.client.stream(messages, **kwargs), self.priority,
+        )
+
+    def astream(self, messages, **kwargs):
+        return self.scheduler.astream(
+            self.agent_key, getattr(self.client, "model", None), messages,
+            lambda: self.client.astream(messages, **kwargs), self.priority,
+        )
+
+
+def resolve_llm_config(agent_key: Optional[str] = None) -> Dict:
+    """Общий LITELLM_CONFIG, перекрытый настройками агента."""
+
+    params = dict(LITELLM_CONFIG)
+    overrides = AGENT_LLM_CONFIG.get(agent_key, {}) if agent_key else {}
+    params.update({name: value for name, value in overrides.items() if value is not None})
+    return params
+
+
+def get_llm(agent_key: Optional[str] = None, priority: Optional[int] = None) -> ScheduledLLM:
+    """Клиент для агента из общего реестра.
+
+    priority перекрывает приоритет агента в планировщике (например,
+    BACKGROUND для офлайн-прогонов роутера).
+    """
+
+    params = resolve_llm_config(agent_key)
+    signature = json.dumps(params, sort_keys=True, default=str)
+    with _lock:
+        client = _clients.get(signature)
+        if client is None:
+            client = _factory(**params)
+            _clients[signature] = client
+    return ScheduledLLM(client, _scheduler, agent_key, priority)
+
+
+def get_scheduler() -> LLMScheduler:
+    return _scheduler
+
+
+def scheduler_stats() -> Dict:
+    """Глубина очереди к LLM, запросы в работе, повторы и отказы."""
+
+    return _scheduler.stats()
+
+
+@functools.lru_cache(maxsize=None)
+def _structured_mode(model: str) -> Optional[str]:
+    """Что модель умеет по данным LiteLLM: schema, json или None."""
+
+    try:
+        import litellm
+
+        if litellm.supports_response_schema(model=model):
+            return "schema"
+        if "response_format" in (litellm.get_supported_openai_params(model=model) or []):
+            return "json"
+    except Exception as e:
+        print(f"Не удалось определить поддержку JSON для {model}: {e}")
+    return None
+
+
+def response_format_for(agent_key: str, name: str, schema: Dict) -> Optional[Dict]:
+    """response_format для JSON-ответа агента или None (разбор текста).
+
+    Режим задает STRUCTURED_OUTPUT; в режиме auto - по возможностям модели
+    агента: JSON schema, иначе JSON mode.
+    """
+
+    mode = STRUCTURED_OUTPUT
+    if mode == "auto":
+        mode = _structured_mode(resolve_llm_config(agent_key).get("model") or "")
+    if mode == "schema":
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+    if mode == "json":
+        return {"type": "json_object"}
+    return None
+
+
+def describe_llm_settings() -> Dict[str, Dict]:
+    """Итоговые параметры модели для каждого агента."""
+
+    return {key: resolve_llm_config(key) for key in AGENT_KEYS}
+
+
+def clear_llm_clients() -> None:
+    """Сбросить реестр (например, после изменения окружения)."""
+
+    with _lock:
+        _clients.clear()
+
+
+def set_llm_factory(factory: Optional[Callable[..., ChatLiteLLM]] = None) -> None:
+    """Подменить конструктор клиентов (например, заглушкой в бенчмарках).
+
+    None возвращает ChatLiteLLM. Уже созданные агенты сохраняют свои клиенты.
+    """
+
+    global _factory
+    with _lock:
+        _factory = factory or ChatLiteLLM
+        _clients.clear()
+
+
+def set_llm_concurrency(limit: Optional[int] = None) -> None:
+    """Ограничить число одновременных запросов к LLM во всем процессе.
+
+    Действует сразу, в том числе на уже созданные агенты. None снимает лимит.
+    """
+
+    _scheduler.set_concurrency(limit)
+
+
+__all__ = [
+    "AGENT_KEYS",
+    "ScheduledLLM",
+    "clear_llm_clients",
+    "describe_llm_settings",
+    "get_llm",
+    "get_scheduler",
+    "resolve_llm_config",
+    "response_format_for",
+    "scheduler_stats",
+    "set_llm_concurrency",
+    "set_llm_factory",
+]
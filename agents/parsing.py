@@ -0,0 +1,144 @@
+"""Разбор JSON-ответов агентов."""
+
+import json
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class IncrementalJSONFields:
+    """Достает значения полей верхнего уровня из JSON, пока он еще генерируется.
+
+    Поле считается готовым, когда его строковое значение закрыто кавычкой
+    или за числом последовал разделитель.
+    """
+
+    def __init__(self, fields: Iterable[str]):
+        self._patterns = {
+            field: re.compile(
+                r'"%s"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?=\s*[,}\n]))' % re.escape(field)
+            )
+            for field in fields
+        }
+        self._buffer = ""
+        self.values: Dict[str, Any] = {}
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        """Добавить чанк и вернуть поля, которые завершились в нем."""
+
+        self._buffer += chunk
+        found: Dict[str, Any] = {}
+        for field, pattern in self._patterns.items():
+            if field in self.values:
+                continue
+            match = pattern.search(self._buffer)
+            if match:
+                try:
+                    value = json.loads(match.group(1))
+                except ValueError:
+                    continue
+                self.values[field] = value
+                found[field] = value
+        return found
+
+
+def extract_json(text: str) -> Tuple[Optional[Any], bool]:
+    """Первый разбираемый JSON-объект в ответе модели: (значение, достроен ли).
+
+    Текст до объекта (пояснения, ```json) и после него пропускается.
+    Если кандидат от очередной "{" не разбирается (фигурные скобки
+    в пояснении, невалидный JSON), поиск продолжается с первой "{" после
+    него: вложенный объект неразобранного кандидата не возвращается, и
+    каждый символ просматривается один раз. Оборванный объект
+    достраивается: незакрытая строка и скобки закрываются, а если так он
+    не разбирается - отбрасывается хвост после последнего завершенного
+    элемента. None, если объекта нет.
+    """
+
+    start = text.find("{")
+    while start >= 0:
+        value, truncated, end = _extract_from(text, start)
+        if value is not None:
+            return value, truncated
+        start = text.find("{", end)
+    return None, False
+
+
+def _extract_from(text: str, start: int) -> Tuple[Optional[Any], bool, int]:
+    # Объект, начинающийся в text[start], и позиция, с которой искать
+    # следующего кандидата, если отсюда объект не разбирается
+    stack: List[str] = []
+    # (позиция, открытые скобки) после каждого завершенного элемента
+    safe: List[Tuple[int, Tuple[str, ...]]] = []
+    in_string = escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(char)
+        elif char in "}]":
+            if not stack or _CLOSERS[stack.pop()] != char:
+                return None, False, index + 1
+            if not stack:
+                try:
+                    return json.loads(text[start:index + 1]), False, index + 1
+                except ValueError:
+                    return None, False, index + 1
+            safe.append((index + 1, tuple(stack)))
+        elif char == ",":
+            safe.append((index, tuple(stack)))
+
+    # Ответ оборвался внутри объекта
+    tail = text[start:]
+    if escaped:
+        tail = tail[:-1]
+    if in_string:
+        tail += '"'
+    candidates = [tail.rstrip().rstrip(",") + _close(stack)]
+    candidates.extend(text[start:position] + _close(opened) for position, opened in reversed(safe[-3:]))
+    for candidate in candidates:
+        try:
+            return json.loads(candidate), True, len(text)
+        except ValueError:
+            continue
+    return None, False, len(text)
+
+
+def _close(opened: Iterable[str]) -> str:
+    return "".join(_CLOSERS[char] for char in reversed(tuple(opened)))
+
+
+class ParseCounter:
+    """Исходы разбора JSON-ответов агента.
+
+    ok - разобран сразу, truncated - достроен оборванный объект,
+    repaired - исправлен повторным запросом, failed - не разобран.
+    """
+
+    OUTCOMES = ("ok", "truncated", "repaired", "failed")
+
+    def __init__(self):
+        self._counts = dict.fromkeys(self.OUTCOMES, 0)
+        self._lock = threading.Lock()
+
+    def add(self, outcome: str) -> None:
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+__all__ = ["IncrementalJSONFields", "ParseCounter", "extract_json"]
@@ -130,4 +130,28 @@ MEMORY_PROMPT = """Ты - агент памяти, который извлека
     "triggers": ["триггер1"],
     "resources": ["ресурс1"],
     "keywords": ["ключевое_слово1", "ключевое_слово2"]
-}}"""
\ No newline at end of file
+}}"""
+
+SUMMARY_PROMPT = """Ты - агент сводки терапевтической беседы.
+Тебе дают текущее краткое содержание беседы и один новый ход (сообщение
+пользователя и ответ специалиста). Обнови краткое содержание так, чтобы
+оно учитывало новый ход.
+
+- Сохраняй важные факты, чувства, темы и договоренности
+- Не теряй сведения из прежнего содержания без причины
+- Пиши от третьего лица, без оценок и советов
+- Не длиннее 200 слов
+
+Ответь ТОЛЬКО текстом обновленного краткого содержания."""
+JSON_REPAIR_PROMPT = """Ты исправляешь ответы других агентов.
+Тебе дают ответ, который должен был быть JSON-объектом по схеме ниже, но
+не разбирается: лишний текст, оборванная строка, ошибки синтаксиса.
+Верни тот же ответ одним корректным JSON-объектом по схеме, без пояснений.
+Не меняй смысл; недостающие поля заполни по смыслу ответа.
+
+Схема:
+{schema}"""
+
+# Ответ специалиста, когда LLM недоступна даже после повторов
+SPECIALIST_FALLBACK = """Извините, сейчас я не могу ответить полноценно: сервис перегружен.
+Ваше сообщение сохранено. Пожалуйста, повторите его через минуту - я продолжу с этого места."""
@@ -0,0 +1,446 @@
+"""Общий на процесс планировщик запросов к LLM.
+
+Каждый запрос агента ждет своей очереди у LLMScheduler. Порядок внутри
+провайдера задает приоритет: специалисты (ответ пользователю), затем
+роутер, затем фоновые память и сводка. Кроме очереди запрос ждет
+свободного слота (общий лимит одновременных запросов) и токенов в ведрах
+провайдера (запросы и токены в минуту). Ошибки 429/5xx повторяются с
+экспоненциальной задержкой и случайным джиттером; запрос, не дождавшийся
+очереди за queue_timeout, получает LLMOverloaded.
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from agents.context import estimate_tokens
+from core import metrics
+
+INTERACTIVE, ROUTING, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", ROUTING: "routing", BACKGROUND: "background"}
+AGENT_PRIORITY = {
+    "dbt": INTERACTIVE,
+    "ifs": INTERACTIVE,
+    "tre": INTERACTIVE,
+    "router": ROUTING,
+    "memory": BACKGROUND,
+    "summary": BACKGROUND,
+}
+
+# Временные отказы провайдера: перегрузка, лимиты, сбои шлюза
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+# То же для исключений без HTTP-статуса (названия классов LiteLLM/OpenAI/httpx)
+RETRY_ERRORS = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "ConnectError",
+    "InternalServerError",
+    "RateLimitError",
+    "ReadTimeout",
+    "ServiceUnavailableError",
+    "Timeout",
+    "TimeoutError",
+}
+
+_PROVIDER_PREFIXES = (("gpt", "openai"), ("o1", "openai"), ("o3", "openai"), ("claude", "anthropic"), ("gemini", "gemini"))
+
+Limits = Tuple[int, int]
+
+
+class LLMOverloaded(Exception):
+    """Запрос не дождался своей очереди к провайдеру"""
+
+
+def provider_of(model: Optional[str]) -> str:
+    """Провайдер модели в терминах LiteLLM ("openai/gpt-4o" -> "openai")."""
+
+    model = model or ""
+    if "/" in model:
+        return model.split("/", 1)[0]
+    for prefix, provider in _PROVIDER_PREFIXES:
+        if model.startswith(prefix):
+            return provider
+    return "default"
+
+
+def estimate_messages(messages) -> int:
+    return sum(estimate_tokens(str(getattr(message, "content", message))) for message in messages)
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    for owner in (error, getattr(error, "response", None)):
+        for name in ("status_code", "status", "http_status"):
+            value = getattr(owner, name, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def retryable(error: BaseException) -> bool:
+    status = error_status(error)
+    if status is not None:
+        return status in RETRY_STATUS
+    return type(error).__name__ in RETRY_ERRORS
+
+
+def _retry_after(error: BaseException) -> float:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TokenBucket:
+    """Ведро на per_minute единиц в минуту; емкость - минутный лимит.
+
+    Уровень может уйти в минус: фактические токены ответа списываются
+    после запроса, и следующие запросы ждут, пока долг восполнится.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Секунд до того, как в ведре наберется amount."""
+
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.capacity, self.level - amount)
+
+
+@dataclass(order=True)
+class _Ticket:
+    priority: int
+    seq: int
+    provider: str = field(compare=False)
+    tokens: int = field(compare=False)
+    enqueued: float = field(compare=False)
+
+
+class LLMScheduler:
+    """Очередь с приоритетами, лимитами провайдеров и повторами.
+
+    rate_limits сопоставляет провайдеру (запросов, токенов) в минуту,
+    остальные провайдеры получают default_limits; 0 - без лимита.
+    Синхронные и асинхронные вызовы делят одно состояние под общим
+    замком, поэтому корутины ждут опросом и не блокируют цикл событий.
+    """
+
+    # Шаг опроса, пока ждем освобождения слота или очереди
+    POLL = 0.01
+
+    def __init__(
+        self,
+        rate_limits: Optional[Dict[str, Limits]] = None,
+        default_limits: Limits = (0, 0),
+        max_concurrency: Optional[int] = None,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+        queue_timeout: float = 60.0,
+    ):
+        self.rate_limits = dict(rate_limits or {})
+        self.default_limits = default_limits
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._queues: Dict[str, List[_Ticket]] = {}
+        self._buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._counts = dict.fromkeys(("admitted", "retries", "failed", "overloaded"), 0)
+        self._max_waiting = 0
+        self._wait_ms = 0.0
+
+    def set_concurrency(self, limit: Optional[int]) -> None:
+        """Общий лимит одновременных запросов; None - без лимита."""
+
+        with self._cond:
+            self.max_concurrency = limit or None
+            self._cond.notify_all()
+
+    # Очередь
+
+    def _bucket_pair(self, provider: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        pair = self._buckets.get(provider)
+        if pair is None:
+            rpm, tpm = self.rate_limits.get(provider, self.default_limits)
+            pair = (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+            self._buckets[provider] = pair
+        return pair
+
+    def _enqueue(self, provider: str, priority: int, tokens: int) -> _Ticket:
+        ticket = _Ticket(priority, next(self._seq), provider, tokens, time.monotonic())
+        with self._cond:
+            heapq.heappush(self._queues.setdefault(provider, []), ticket)
+            self._max_waiting = max(self._max_waiting, self._waiting())
+        return ticket
+
+    def _waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _admit(self, ticket: _Ticket) -> Optional[float]:
+        """Под замком: None, если запрос допущен, иначе сколько подождать."""
+
+        queue = self._queues[ticket.provider]
+        if queue[0] is not ticket:
+            return self.POLL
+        now = time.monotonic()
+        if self.max_concurrency:
+            # Свободные слоты общего лимита сначала достаются более
+            # приоритетным запросам из очередей других провайдеров;
+            # упершиеся в свой лимит провайдера слот не занимают
+            free = self.max_concurrency - self._in_flight
+            if free <= 0 or free <= self._ready_ahead(ticket, now):
+                return self.POLL
+        wait = self._rate_wait(ticket, now)
+        if wait > 0:
+            return wait
+        requests, tokens = self._bucket_pair(ticket.provider)
+        if requests:
+            requests.take(1, now)
+        if tokens:
+            tokens.take(ticket.tokens, now)
+        heapq.heappop(queue)
+        self._in_flight += 1
+        self._counts["admitted"] += 1
+        self._wait_ms += (now - ticket.enqueued) * 1000
+        # Следующий в очереди становится первым
+        self._cond.notify_all()
+        return None
+
+    def _rate_wait(self, ticket: _Ticket, now: float) -> float:
+        requests, tokens = self._bucket_pair(ticket.provider)
+        return max(
+            requests.wait_time(1, now) if requests else 0.0,
+            tokens.wait_time(ticket.tokens, now) if tokens else 0.0,
+        )
+
+    def _ready_ahead(self, ticket: _Ticket, now: float) -> int:
+        """Сколько первых в очередях других провайдеров важнее ticket и готовы к запуску."""
+
+        return sum(
+            1
+            for provider, queue in self._queues.items()
+            if provider != ticket.provider and queue
+            and queue[0].priority < ticket.priority
+            and self._rate_wait(queue[0], now) <= 0
+        )
+
+    def _drop(self, ticket: _Ticket, overloaded: bool) -> None:
+        with self._cond:
+            queue = self._queues[ticket.provider]
+            if ticket in queue:
+                queue.remove(ticket)
+                heapq.heapify(queue)
+            if overloaded:
+                self._counts["overloaded"] += 1
+            self._cond.notify_all()
+
+    def _overloaded(self, ticket: _Ticket) -> LLMOverloaded:
+        self._drop(ticket, overloaded=True)
+        return LLMOverloaded(
+            f"Очередь к {ticket.provider} не подошла за {self.queue_timeout:g} с "
+            f"(приоритет {PRIORITY_NAMES.get(ticket.priority, ticket.priority)})"
+        )
+
+    def acquire(self, provider: str, priority: int, tokens: int, node: str) -> None:
+        ticket = self._enqueue(provider, priority, tokens)
+        deadline = ticket.enqueued + self.queue_timeout
+        with self._cond:
+            while True:
+                wait = self._admit(ticket)
+                if wait is None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._overloaded(ticket)
+                self._cond.wait(min(wait, remaining))
+        self._record_wait(node, ticket)
+
+    async def aacquire(self, provider: str, priority: int, tokens: int, node: str) -> None:
+        ticket = self._enqueue(provider, priority, tokens)
+        deadline = ticket.enqueued + self.queue_timeout
+        try:
+            while True:
+                with self._cond:
+                    wait = self._admit(ticket)
+                if wait is None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._overloaded(ticket)
+                await asyncio.sleep(min(wait, self.POLL, remaining))
+        except asyncio.CancelledError:
+            self._drop(ticket, overloaded=False)
+            raise
+        self._record_wait(node, ticket)
+
+    def release(self, provider: str, estimated: int, usage: metrics.Usage) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            _, tokens = self._bucket_pair(provider)
+            if tokens and usage[0] is not None:
+                # До запроса списали оценку промпта - доплачиваем фактические токены
+                tokens.take((usage[0] or 0) + (usage[1] or 0) - estimated, time.monotonic())
+            self._cond.notify_all()
+
+    @staticmethod
+    def _record_wait(node: str, ticket: _Ticket) -> None:
+        waited = (time.monotonic() - ticket.enqueued) * 1000
+        if waited >= 1:
+            metrics.record_wait(node, waited)
+
+    # Повторы
+
+    def _retry_delay(self, attempt: int, error: BaseException) -> Optional[float]:
+        """Задержка перед повтором или None, если повторять не нужно."""
+
+        if attempt >= self.max_retries or not retryable(error):
+            with self._cond:
+                self._counts["failed"] += 1
+            return None
+        with self._cond:
+            self._counts["retries"] += 1
+        # Полный джиттер: одновременные отказы не повторяются синхронно
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, min(_retry_after(error), self.backoff_max))
+
+    def _plan(self, node: str, model: Optional[str], messages, priority: Optional[int]):
+        if priority is None:
+            priority = AGENT_PRIORITY.get(node, ROUTING)
+        return provider_of(model), priority, estimate_messages(messages)
+
+    def call(self, node: str, model: Optional[str], messages, fn: Callable[[], Any], priority: Optional[int] = None):
+        provider, priority, tokens = self._plan(node, model, messages, priority)
+        for attempt in itertools.count():
+            self.acquire(provider, priority, tokens, node)
+            usage: metrics.Usage = (None, None)
+            try:
+                result = fn()
+                usage = metrics.usage_from(result)
+                return result
+            except Exception as e:
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                print(f"LLM {provider}: {e}; повтор через {delay:.1f} с")
+            finally:
+                self.release(provider, tokens, usage)
+            time.sleep(delay)
+
+    async def acall(self, node: str, model: Optional[str], messages, fn: Callable, priority: Optional[int] = None):
+        provider, priority, tokens = self._plan(node, model, messages, priority)
+        for attempt in itertools.count():
+            await self.aacquire(provider, priority, tokens, node)
+            usage: metrics.Usage = (None, None)
+            try:
+                result = await fn()
+                usage = metrics.usage_from(result)
+                return result
+            except Exception as e:
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                print(f"LLM {provider}: {e}; повтор через {delay:.1f} с")
+            finally:
+                self.release(provider, tokens, usage)
+            await asyncio.sleep(delay)
+
+    def stream(self, node: str, model: Optional[str], messages, fn: Callable[[], Iterator], priority: Optional[int] = None):
+        """Поток ответа; повтор возможен, только пока не отдан ни один чанк."""
+
+        provider, priority, tokens = self._plan(node, model, messages, priority)
+        for attempt in itertools.count():
+            self.acquire(provider, priority, tokens, node)
+            usage: metrics.Usage = (None, None)
+            started = False
+            try:
+                for chunk in fn():
+                    usage = metrics.add_usage(usage, chunk)
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                print(f"LLM {provider}: {e}; повтор через {delay:.1f} с")
+            finally:
+                self.release(provider, tokens, usage)
+            time.sleep(delay)
+
+    async def astream(
+        self, node: str, model: Optional[str], messages, fn: Callable[[], AsyncIterator], priority: Optional[int] = None
+    ):
+        provider, priority, tokens = self._plan(node, model, messages, priority)
+        for attempt in itertools.count():
+            await self.aacquire(provider, priority, tokens, node)
+            usage: metrics.Usage = (None, None)
+            started = False
+            try:
+                async for chunk in fn():
+                    usage = metrics.add_usage(usage, chunk)
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                print(f"LLM {provider}: {e}; повтор через {delay:.1f} с")
+            finally:
+                self.release(provider, tokens, usage)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict:
+        """Глубина очереди по приоритетам, запросы в работе и счетчики."""
+
+        with self._cond:
+            by_priority = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+            for queue in self._queues.values():
+                for ticket in queue:
+                    by_priority[PRIORITY_NAMES.get(ticket.priority, str(ticket.priority))] += 1
+            admitted = self._counts["admitted"]
+            return {
+                "waiting": sum(by_priority.values()),
+                "by_priority": by_priority,
+                "in_flight": self._in_flight,
+                "max_waiting": self._max_waiting,
+                "mean_wait_ms": self._wait_ms / admitted if admitted else 0.0,
+                **self._counts,
+            }
+
+
+__all__ = [
+    "AGENT_PRIORITY",
+    "BACKGROUND",
+    "INTERACTIVE",
+    "LLMOverloaded",
+    "LLMScheduler",
+    "PRIORITY_NAMES",
+    "ROUTING",
+    "TokenBucket",
+    "provider_of",
+    "retryable",
+]
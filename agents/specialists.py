@@ -1,26 +1,47 @@
-from typing import List
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 from langchain.schema import HumanMessage, SystemMessage, BaseMessage
-from langchain_litellm import ChatLiteLLM
 from agents.prompts import (
     ROUTER_PROMPT, DBT_PROMPT, IFS_PROMPT, 
-    TRE_PROMPT, MEMORY_PROMPT
+    TRE_PROMPT, MEMORY_PROMPT, SUMMARY_PROMPT, JSON_REPAIR_PROMPT, SPECIALIST_FALLBACK
 )
-from agents.base import TherapyState
-from config import LITELLM_CONFIG
+from agents.base import APPROACHES, ROUTE_CLASSIFIER, ROUTE_DEFAULT, ROUTE_LLM, ROUTE_PARTIAL, TherapyState
+from agents.context import estimate_tokens, pack_context
+from agents.llm import get_llm, response_format_for
+from agents.parsing import IncrementalJSONFields, ParseCounter, extract_json
+from config import AGENT_CONTEXT_TOKENS, CONTEXT_TOKENS, JSON_REPAIR_RETRIES
+from core import metrics
 import json
+import time
 
 class BaseAgent:
     """Базовый класс агента с LiteLLM"""
     
-    def __init__(self, system_prompt: str, name: str):
-        self.llm = ChatLiteLLM(**LITELLM_CONFIG)
+    def __init__(self, system_prompt: str, name: str, llm_key: Optional[str] = None):
+        # llm_key выбирает поагентные параметры модели (см. AGENT_LLM_CONFIG);
+        # клиенты с одинаковыми параметрами общие для всего процесса
+        self.llm_key = llm_key
+        self.llm = get_llm(llm_key)
         self.system_prompt = system_prompt
         self.name = name
+        # Бюджет токенов на сводку и историю в одном запросе
+        self.context_tokens = AGENT_CONTEXT_TOKENS.get(llm_key, CONTEXT_TOKENS)
+        # Кеш ответов (LLMResponseCache) включается для агента явно
+        self.cache = None
+        # Дополнительные параметры каждого запроса (например, response_format)
+        self.llm_kwargs: Dict = {}
 
     def set_system_prompt(self, prompt: str) -> None:
         """Update the system prompt used by the agent."""
 
         self.system_prompt = prompt
+        if self.cache is not None:
+            # Ответы, полученные со старым промптом, больше не нужны
+            self.cache.invalidate(self.name, keep_prompt_hash=self.cache.prompt_hash(prompt))
+
+    def enable_cache(self, cache) -> None:
+        """Кешировать ответы этого агента в переданном LLMResponseCache."""
+
+        self.cache = cache
     
     @staticmethod
     def _normalize_content(raw_content) -> str:
@@ -64,115 +85,562 @@ class BaseAgent:
 
         return "".join(collected)
     
-    def process(self, user_message: str, context: List[BaseMessage] = None) -> str:
+    def _build_messages(
+        self, user_message: str, context: List[BaseMessage] = None, summary: str = ""
+    ) -> List[BaseMessage]:
         messages = [SystemMessage(content=self.system_prompt)]
-        
+        budget = self.context_tokens
+
+        if summary:
+            messages.append(SystemMessage(content=f"Краткое содержание предыдущей беседы:\n{summary}"))
+            budget -= estimate_tokens(summary)
+
         if context:
-            # Добавляем последние 5 сообщений для контекста
-            messages.extend(context[-5:])
+            # Свежие сообщения, сколько влезает в бюджет агента
+            messages.extend(pack_context(context, budget))
         
         messages.append(HumanMessage(content=user_message))
+        return messages
+
+    @staticmethod
+    def _state_context(state: TherapyState):
+        """Несвернутая часть истории и сводка из состояния графа."""
+
+        messages = state.get("messages", [])
+        return messages[state.get("summary_covered", 0):], state.get("summary", "")
+
+    def _extract_text(self, response) -> str:
+        """Достает текст из ответа модели, логируя пустые ответы."""
+
+        normalized = self._normalize_content(response.content)
+        if not normalized.strip():
+            extra = getattr(response, "additional_kwargs", {})
+            print(f"[DEBUG {self.name}] Empty normalized content. Raw: {response.content!r}")
+            print(f"[DEBUG {self.name}] Full response repr: {response!r}")
+            if extra:
+                print(f"[DEBUG {self.name}] additional_kwargs: {extra}")
+                normalized = self._normalize_content(extra.get("content"))
+            meta = getattr(response, "response_metadata", None)
+            if (not normalized.strip()) and meta:
+                print(f"[DEBUG {self.name}] response_metadata: {meta}")
+        return normalized
+
+    def _cache_key(self, messages: List[BaseMessage]) -> Optional[str]:
+        if self.cache is None:
+            return None
+        return self.cache.make_key(
+            messages,
+            getattr(self.llm, "model", ""),
+            getattr(self.llm, "temperature", None),
+            getattr(self.llm, "max_tokens", None),
+            self.llm_kwargs,
+        )
+
+    def _cache_store(self, key: Optional[str], text: str) -> None:
+        # Ошибки вызова сюда не доходят
+        if key and self._cacheable(text):
+            self.cache.set(key, text, self.name, self.cache.prompt_hash(self.system_prompt))
+
+    def _cacheable(self, text: str) -> bool:
+        """Можно ли отдавать этот ответ из кеша вместо нового запроса."""
+
+        return bool(text.strip())
+
+    @property
+    def metric_node(self) -> str:
+        return self.llm_key or self.name
+
+    def _record_llm(self, started: float, usage: metrics.Usage = (None, None)) -> None:
+        metrics.record_llm(self.metric_node, getattr(self.llm, "model", None), started, usage)
+
+    def _failure_reply(self, error: Exception) -> str:
+        """Ответ вместо упавшего запроса (после всех повторов планировщика)."""
+
+        return f"Ошибка обработки: {str(error)}"
+
+    def process(self, user_message: str, context: List[BaseMessage] = None, summary: str = "") -> str:
+        messages = self._build_messages(user_message, context, summary)
+        started = time.perf_counter()
+        key = self._cache_key(messages)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.record_cache_hit(self.metric_node, started)
+                return cached
         
+        started = time.perf_counter()
+        try:
+            response = self.llm.invoke(messages, **self.llm_kwargs)
+            text = self._extract_text(response)
+        except Exception as e:
+            self._record_llm(started)
+            print(f"Ошибка в {self.name}: {e}")
+            return self._failure_reply(e)
+        self._record_llm(started, metrics.usage_from(response))
+        self._cache_store(key, text)
+        return text
+
+    async def aprocess(self, user_message: str, context: List[BaseMessage] = None, summary: str = "") -> str:
+        """Асинхронная версия process на базе ainvoke."""
+
+        messages = self._build_messages(user_message, context, summary)
+        started = time.perf_counter()
+        key = self._cache_key(messages)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.record_cache_hit(self.metric_node, started)
+                return cached
+
+        started = time.perf_counter()
+        try:
+            response = await self.llm.ainvoke(messages, **self.llm_kwargs)
+            text = self._extract_text(response)
+        except Exception as e:
+            self._record_llm(started)
+            print(f"Ошибка в {self.name}: {e}")
+            return self._failure_reply(e)
+        self._record_llm(started, metrics.usage_from(response))
+        self._cache_store(key, text)
+        return text
+
+    def stream(self, user_message: str, context: List[BaseMessage] = None, summary: str = "") -> Iterator[str]:
+        """Потоковая версия process: отдает нормализованные чанки ответа."""
+
+        messages = self._build_messages(user_message, context, summary)
+        started = time.perf_counter()
+        key = self._cache_key(messages)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.record_cache_hit(self.metric_node, started)
+                yield cached
+                return
+
+        chunks = []
+        usage: metrics.Usage = (None, None)
+        started = time.perf_counter()
+        try:
+            for chunk in self.llm.stream(messages, **self.llm_kwargs):
+                # Токены провайдер обычно присылает в последнем чанке
+                usage = metrics.add_usage(usage, chunk)
+                text = self._normalize_content(chunk.content)
+                if text:
+                    chunks.append(text)
+                    yield text
+        except Exception as e:
+            self._record_llm(started, usage)
+            print(f"Ошибка в {self.name}: {e}")
+            # Начатый ответ не дополняем текстом ошибки
+            if not chunks:
+                yield self._failure_reply(e)
+            return
+        self._record_llm(started, usage)
+        self._cache_store(key, "".join(chunks))
+
+    async def astream(
+        self, user_message: str, context: List[BaseMessage] = None, summary: str = ""
+    ) -> AsyncIterator[str]:
+        """Асинхронная версия stream"""
+
+        messages = self._build_messages(user_message, context, summary)
+        started = time.perf_counter()
+        key = self._cache_key(messages)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.record_cache_hit(self.metric_node, started)
+                yield cached
+                return
+
+        chunks = []
+        usage: metrics.Usage = (None, None)
+        started = time.perf_counter()
         try:
-            response = self.llm.invoke(messages)
-            normalized = self._normalize_content(response.content)
-            if not normalized.strip():
-                extra = getattr(response, "additional_kwargs", {})
-                print(f"[DEBUG {self.name}] Empty normalized content. Raw: {response.content!r}")
-                print(f"[DEBUG {self.name}] Full response repr: {response!r}")
-                if extra:
-                    print(f"[DEBUG {self.name}] additional_kwargs: {extra}")
-                    normalized = self._normalize_content(extra.get("content"))
-                meta = getattr(response, "response_metadata", None)
-                if (not normalized.strip()) and meta:
-                    print(f"[DEBUG {self.name}] response_metadata: {meta}")
-            return normalized
+            async for chunk in self.llm.astream(messages, **self.llm_kwargs):
+                # Токены провайдер обычно присылает в последнем чанке
+                usage = metrics.add_usage(usage, chunk)
+                text = self._normalize_content(chunk.content)
+                if text:
+                    chunks.append(text)
+                    yield text
         except Exception as e:
+            self._record_llm(started, usage)
             print(f"Ошибка в {self.name}: {e}")
-            return f"Ошибка обработки: {str(e)}"
+            # Начатый ответ не дополняем текстом ошибки
+            if not chunks:
+                yield self._failure_reply(e)
+            return
+        self._record_llm(started, usage)
+        self._cache_store(key, "".join(chunks))
+
+class StructuredAgent(BaseAgent):
+    """Агент, отвечающий JSON-объектом по схеме SCHEMA.
+
+    Если модель поддерживает structured output, запрос уходит с
+    response_format. Ответ в любом случае разбирается терпимо
+    (extract_json), а неразобранный исправляется повторным запросом,
+    не более JSON_REPAIR_RETRIES раз. Исходы считает parse_counter.
+    """
+
+    SCHEMA: Dict = {}
 
-class RouterAgent(BaseAgent):
+    def __init__(self, system_prompt: str, name: str, llm_key: str):
+        super().__init__(system_prompt, name, llm_key)
+        self.response_format = response_format_for(llm_key, llm_key, self.SCHEMA)
+        if self.response_format:
+            self.llm_kwargs["response_format"] = self.response_format
+        self.parse_counter = ParseCounter()
+
+    def _validate(self, data) -> Optional[Dict]:
+        """Привести разобранный JSON к ожидаемому виду; None, если не подходит."""
+
+        return data if isinstance(data, dict) else None
+
+    def _cacheable(self, text: str) -> bool:
+        # Неразобранный или оборванный ответ из кеша снова потребовал бы
+        # исправления - кешируем только целый JSON, прошедший _validate
+        data, truncated = extract_json(text)
+        return not truncated and self._validate(data) is not None
+
+    def _parse_json(self, response: str) -> Optional[Dict]:
+        """Разбор без повторных запросов; неудача здесь не считается."""
+
+        data, truncated = extract_json(response)
+        data = self._validate(data)
+        if data is not None:
+            self.parse_counter.add("truncated" if truncated else "ok")
+        return data
+
+    def _parse_or_repair(self, response: str) -> Optional[Dict]:
+        data = self._parse_json(response)
+        if data is not None or self._failed_call(response):
+            return data
+        for _ in range(JSON_REPAIR_RETRIES):
+            data = self._validate(extract_json(self._repair(response))[0])
+            if data is not None:
+                self.parse_counter.add("repaired")
+                return data
+        self._parse_failed(response)
+        return None
+
+    async def _aparse_or_repair(self, response: str) -> Optional[Dict]:
+        data = self._parse_json(response)
+        if data is not None or self._failed_call(response):
+            return data
+        for _ in range(JSON_REPAIR_RETRIES):
+            data = self._validate(extract_json(await self._arepair(response))[0])
+            if data is not None:
+                self.parse_counter.add("repaired")
+                return data
+        self._parse_failed(response)
+        return None
+
+    @staticmethod
+    def _failed_call(response: str) -> bool:
+        # Ошибка вызова LLM, а не разбора: исправлять нечего
+        return not response.strip() or response.startswith("Ошибка обработки")
+
+    def _parse_failed(self, response: str) -> None:
+        self.parse_counter.add("failed")
+        print(f"Ошибка разбора JSON в {self.name}: {response[:200]!r}")
+
+    def _repair_messages(self, response: str) -> List[BaseMessage]:
+        schema = json.dumps(self.SCHEMA, ensure_ascii=False)
+        return [SystemMessage(content=JSON_REPAIR_PROMPT.format(schema=schema)), HumanMessage(content=response)]
+
+    def _repair(self, response: str) -> str:
+        started = time.perf_counter()
+        try:
+            result = self.llm.invoke(self._repair_messages(response), **self.llm_kwargs)
+        except Exception as e:
+            self._record_llm(started)
+            print(f"Ошибка исправления JSON в {self.name}: {e}")
+            return ""
+        self._record_llm(started, metrics.usage_from(result))
+        return self._extract_text(result)
+
+    async def _arepair(self, response: str) -> str:
+        started = time.perf_counter()
+        try:
+            result = await self.llm.ainvoke(self._repair_messages(response), **self.llm_kwargs)
+        except Exception as e:
+            self._record_llm(started)
+            print(f"Ошибка исправления JSON в {self.name}: {e}")
+            return ""
+        self._record_llm(started, metrics.usage_from(result))
+        return self._extract_text(result)
+
+class RouterAgent(StructuredAgent):
     """Агент маршрутизации"""
+
+    SCHEMA = {
+        "type": "object",
+        "properties": {
+            "approach": {"type": "string", "enum": list(APPROACHES)},
+            "confidence": {"type": "number"},
+            "reasoning": {"type": "string"},
+            "keywords": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["approach", "confidence", "reasoning", "keywords"],
+        "additionalProperties": False,
+    }
     
-    def __init__(self, system_prompt: str = ROUTER_PROMPT):
-        super().__init__(system_prompt, "Router")
+    def __init__(self, system_prompt: str = ROUTER_PROMPT, classifier=None, threshold: float = 0.8):
+        super().__init__(system_prompt, "Router", "router")
+        # Локальный классификатор (LocalRouterClassifier); LLM вызывается,
+        # только если его уверенность ниже threshold. Работает, только пока
+        # промпт роутера тот же, под который модель обучена
+        self.trained_classifier = classifier
+        self.classifier = None
+        self.threshold = threshold
+        self._sync_classifier(initial=True)
+
+    def set_system_prompt(self, prompt: str) -> None:
+        super().set_system_prompt(prompt)
+        self._sync_classifier()
+
+    def _sync_classifier(self, initial: bool = False) -> None:
+        model = self.trained_classifier
+        enabled = model if model is not None and model.matches(self.system_prompt) else None
+        if model is not None and enabled is None and (initial or self.classifier is not None):
+            print("Локальный классификатор обучен под другой промпт роутера и отключен до переобучения (tools.train_router)")
+        self.classifier = enabled
     
-    def route(self, state: TherapyState) -> TherapyState:
+    # Узлы графа возвращают только изменившиеся ключи состояния: messages
+    # объявлен с редьюсером operator.add, и возврат всего состояния
+    # дописывал бы историю заново на каждом узле.
+
+    def route(self, state: TherapyState) -> Dict:
         """Определяет подходящий терапевтический подход"""
         user_message = state["user_message"]
         
-        response = self.process(user_message, state.get("messages", []))
+        local = self._classify(user_message)
+        if local:
+            return local
         
+        response = self.process(user_message, *self._state_context(state))
+        return self._fill_route(self._parse_or_repair(response))
+
+    async def aroute(self, state: TherapyState) -> Dict:
+        """Асинхронная версия route"""
+        local = self._classify(state["user_message"])
+        if local:
+            return local
+
+        response = await self.aprocess(state["user_message"], *self._state_context(state))
+        return self._fill_route(await self._aparse_or_repair(response))
+
+    def _classify(self, user_message: str) -> Optional[Dict]:
+        if self.classifier is None:
+            return None
+        approach, confidence = self.classifier.predict(user_message)
+        if confidence < self.threshold:
+            return None
+        return {
+            "current_approach": approach,
+            "confidence": confidence,
+            "reasoning": "Локальный классификатор",
+            "route_source": ROUTE_CLASSIFIER,
+        }
+
+    def stream_route(
+        self, user_message: str, context: List[BaseMessage] = None, summary: str = ""
+    ) -> Iterator[Dict]:
+        """Разбирает ответ роутера по мере генерации.
+
+        Выдает частичные обновления состояния, как только очередное поле JSON
+        готово; последнее обновление - полный результат маршрутизации.
+        """
+        local = self._classify(user_message)
+        if local:
+            yield local
+            return
+
+        parser = IncrementalJSONFields(("approach", "confidence", "reasoning"))
+        chunks = []
+        for chunk in self.stream(user_message, context, summary):
+            chunks.append(chunk)
+            update = self._route_update(parser.feed(chunk))
+            if update:
+                yield update
+        yield self._final_route(parser, "".join(chunks))
+
+    async def astream_route(
+        self, user_message: str, context: List[BaseMessage] = None, summary: str = ""
+    ) -> AsyncIterator[Dict]:
+        """Асинхронная версия stream_route"""
+        local = self._classify(user_message)
+        if local:
+            yield local
+            return
+
+        parser = IncrementalJSONFields(("approach", "confidence", "reasoning"))
+        chunks = []
+        async for chunk in self.astream(user_message, context, summary):
+            chunks.append(chunk)
+            update = self._route_update(parser.feed(chunk))
+            if update:
+                yield update
+        yield self._final_route(parser, "".join(chunks))
+
+    @staticmethod
+    def _fill_route(data: Optional[Dict]) -> Dict:
+        if data is None:
+            return {
+                "current_approach": "DBT",
+                "confidence": 0.5,
+                "reasoning": "Использую DBT по умолчанию",
+                "route_source": ROUTE_DEFAULT,
+            }
+        return {
+            "current_approach": data.get("approach", "DBT"),
+            "confidence": data.get("confidence", 0.5),
+            "reasoning": data.get("reasoning", ""),
+            "route_source": ROUTE_LLM,
+        }
+
+    def _validate(self, data) -> Optional[Dict]:
+        if not isinstance(data, dict):
+            return None
+        approach = self._approach(data.get("approach"))
+        if approach is None:
+            return None
+        data = dict(data, approach=approach)
         try:
-            # Парсим JSON ответ
-            if "```json" in response:
-                response = response.split("```json")[1].split("```")[0]
-            
-            data = json.loads(response.strip())
-            
-            state["current_approach"] = data.get("approach", "DBT")
-            state["confidence"] = data.get("confidence", 0.5)
-            state["reasoning"] = data.get("reasoning", "")
-            
-        except Exception as e:
-            print(f"Ошибка парсинга роутера: {e}")
-            state["current_approach"] = "DBT"
-            state["confidence"] = 0.5
-            state["reasoning"] = "Использую DBT по умолчанию"
-        
-        return state
+            data["confidence"] = float(data["confidence"])
+        except (KeyError, TypeError, ValueError):
+            data.pop("confidence", None)
+        return data
+
+    @staticmethod
+    def _approach(value) -> Optional[str]:
+        # Один и тот же разбор для потока и для итогового JSON: " cbt" == "CBT"
+        approach = str(value or "").strip().upper()
+        return approach if approach in APPROACHES else None
+
+    @classmethod
+    def _route_update(cls, fields: Dict) -> Dict:
+        update = {}
+        approach = cls._approach(fields.get("approach"))
+        if approach is not None:
+            update["current_approach"] = approach
+        if isinstance(fields.get("confidence"), (int, float)):
+            update["confidence"] = fields["confidence"]
+        if isinstance(fields.get("reasoning"), str):
+            update["reasoning"] = fields["reasoning"]
+        return update
+
+    def _final_route(self, parser: IncrementalJSONFields, response: str) -> Dict:
+        # Без повторного запроса: специалист под разобранный подход уже запущен
+        data = self._parse_json(response)
+        route = self._fill_route(data)
+        # JSON не разобрался, но подход уже успели разобрать - доверяем ему
+        if data is None:
+            if not self._failed_call(response):
+                self._parse_failed(response)
+            partial = self._route_update(parser.values)
+            route.update(partial)
+            if "current_approach" in partial:
+                route["route_source"] = ROUTE_PARTIAL
+        if route["current_approach"] not in APPROACHES:
+            route["current_approach"] = "DBT"
+        return route
 
-class DBTAgent(BaseAgent):
+class SpecialistAgent(BaseAgent):
+    """Общая логика специалистов: ответ пользователю в specialist_response"""
+
+    def _failure_reply(self, error: Exception) -> str:
+        # Пользователь видит бережный ответ, а не текст исключения
+        return SPECIALIST_FALLBACK
+
+    def respond(self, state: TherapyState) -> Dict:
+        response = self.process(state["user_message"], *self._state_context(state))
+        return {"specialist_response": response}
+
+    async def arespond(self, state: TherapyState) -> Dict:
+        response = await self.aprocess(state["user_message"], *self._state_context(state))
+        return {"specialist_response": response}
+
+class DBTAgent(SpecialistAgent):
     def __init__(self, system_prompt: str = DBT_PROMPT):
-        super().__init__(system_prompt, "DBT Specialist")
-    
-    def respond(self, state: TherapyState) -> TherapyState:
-        response = self.process(state["user_message"], state.get("messages", []))
-        state["specialist_response"] = response
-        return state
+        super().__init__(system_prompt, "DBT Specialist", "dbt")
 
-class IFSAgent(BaseAgent):
+class IFSAgent(SpecialistAgent):
     def __init__(self, system_prompt: str = IFS_PROMPT):
-        super().__init__(system_prompt, "IFS Specialist")
-    
-    def respond(self, state: TherapyState) -> TherapyState:
-        response = self.process(state["user_message"], state.get("messages", []))
-        state["specialist_response"] = response
-        return state
+        super().__init__(system_prompt, "IFS Specialist", "ifs")
 
-class TREAgent(BaseAgent):
+class TREAgent(SpecialistAgent):
     def __init__(self, system_prompt: str = TRE_PROMPT):
-        super().__init__(system_prompt, "TRE Specialist")
-    
-    def respond(self, state: TherapyState) -> TherapyState:
-        response = self.process(state["user_message"], state.get("messages", []))
-        state["specialist_response"] = response
-        return state
+        super().__init__(system_prompt, "TRE Specialist", "tre")
+
+class SummaryAgent(BaseAgent):
+    """Сворачивает очередной ход беседы в скользящую сводку"""
+
+    def __init__(self, system_prompt: str = SUMMARY_PROMPT):
+        super().__init__(system_prompt, "Summary", "summary")
+
+    def fold(self, summary: str, turn: List[BaseMessage]) -> Optional[str]:
+        """Новая сводка с учетом хода turn; None, если модель не ответила."""
+
+        return self._accept(self.process(self._fold_request(summary, turn)))
+
+    async def afold(self, summary: str, turn: List[BaseMessage]) -> Optional[str]:
+        return self._accept(await self.aprocess(self._fold_request(summary, turn)))
+
+    @staticmethod
+    def _fold_request(summary: str, turn: List[BaseMessage]) -> str:
+        lines = [f"Текущее краткое содержание:\n{summary or '(пока пусто)'}", "", "Новый ход:"]
+        for message in turn:
+            role = "Пользователь" if message.type == "human" else "Специалист"
+            lines.append(f"{role}: {BaseAgent._normalize_content(message.content)}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _accept(response: str) -> Optional[str]:
+        # Ошибка или пустой ответ: прежняя сводка остается, ход свернем позже
+        if not response.strip() or response.startswith("Ошибка обработки"):
+            return None
+        return response.strip()
+
+class MemoryAgent(StructuredAgent):
+    FIELDS = ("insights", "patterns", "triggers", "resources", "keywords")
+    SCHEMA = {
+        "type": "object",
+        "properties": {field: {"type": "array", "items": {"type": "string"}} for field in FIELDS},
+        "required": list(FIELDS),
+        "additionalProperties": False,
+    }
 
-class MemoryAgent(BaseAgent):
     def __init__(self, system_prompt: str = MEMORY_PROMPT):
-        super().__init__(system_prompt, "Memory")
+        super().__init__(system_prompt, "Memory", "memory")
     
-    def extract(self, state: TherapyState) -> TherapyState:
+    def extract(self, state: TherapyState) -> Dict:
+        response = self.process(self._build_context(state))
+        return {"insights": self._parse_or_repair(response) or self._empty()}
+
+    async def aextract(self, state: TherapyState) -> Dict:
+        response = await self.aprocess(self._build_context(state))
+        return {"insights": await self._aparse_or_repair(response) or self._empty()}
+
+    @staticmethod
+    def _build_context(state: TherapyState) -> str:
         # Создаем контекст для анализа
-        context = f"""
+        return f"""
         Сообщение пользователя: {state['user_message']}
         Подход: {state['current_approach']}
         Ответ специалиста: {state['specialist_response']}
         """
-        
-        response = self.process(context)
-        
-        try:
-            if "```json" in response:
-                response = response.split("```json")[1].split("```")[0]
-            
-            state["insights"] = json.loads(response.strip())
-        except:
-            state["insights"] = {
-                "insights": [],
-                "patterns": [],
-                "keywords": []
-            }
-        
-        return state
+
+    def _validate(self, data) -> Optional[Dict]:
+        if not isinstance(data, dict) or not any(field in data for field in self.FIELDS):
+            return None
+        data = dict(data)
+        for field in self.FIELDS:
+            value = data.get(field) or []
+            data[field] = [value] if isinstance(value, str) else list(value)
+        return data
+
+    @classmethod
+    def _empty(cls) -> Dict:
+        return {field: [] for field in cls.FIELDS}
@@ -1,8 +1,10 @@
-import json
+import os
+import tempfile
 
 import streamlit as st
 
 import agents.prompts as prompt_defaults
+from agents.llm import scheduler_stats
 from core.orchestrator import TherapyOrchestrator
 from services.prompt_store import PROMPT_KEYS, PromptStore
 
@@ -29,17 +31,33 @@ st.set_page_config(
     layout="wide"
 )
 
-# Инициализация состояния сессии
-if 'prompt_store' not in st.session_state:
-    st.session_state.prompt_store = PromptStore()
+@st.cache_resource(show_spinner=False)
+def load_engine() -> TherapyOrchestrator:
+    """Граф, агенты, хранилище и хранилище промптов - один раз на процесс"""
+    return TherapyOrchestrator(use_memory=True, prompt_store=PromptStore())
+
+
+# Инициализация состояния сессии: своя только беседа, остальное общее
+engine = load_engine()
+st.session_state.prompt_store = engine.prompt_store
 
 if 'orchestrator' not in st.session_state:
-    st.session_state.orchestrator = TherapyOrchestrator(
-        use_memory=True,
-        prompt_store=st.session_state.prompt_store,
-    )
-    st.session_state.session_id = st.session_state.orchestrator.start_session()
+    st.session_state.orchestrator = engine.fork()
     st.session_state.messages = []
+    # ?resume=<токен> в адресе продолжает сохраненную сессию после перезапуска.
+    # Только секретный токен: по подбираемому id можно открыть чужую беседу
+    resumed_id = None
+    if st.query_params.get("resume"):
+        resumed_id = st.session_state.orchestrator.resume_by_token(st.query_params["resume"])
+    if resumed_id:
+        st.session_state.session_id = resumed_id
+        st.session_state.messages = [
+            {"role": "user" if message.type == "human" else "assistant", "content": message.content}
+            for message in st.session_state.orchestrator.messages
+        ]
+    else:
+        st.session_state.session_id = st.session_state.orchestrator.start_session()
+    st.query_params["resume"] = st.session_state.orchestrator.resume_token or ""
 
 # Заголовок
 st.title("🧠 Мультиагентная Терапевтическая Система")
@@ -47,10 +65,33 @@ st.warning("⚠️ Образовательная демонстрация - н
 
 # Боковая панель: управление промптами и экспорт
 prompt_store = st.session_state.prompt_store
+router_regression = st.session_state.orchestrator.router_regression
+
+
+def show_regression(report):
+    """Согласие, сдвиг распределения и матрица ошибок промпта роутера."""
+
+    st.caption(
+        f"Промпт {report.prompt_hash}: {report.samples} сообщений за {report.elapsed:.1f} с, "
+        f"согласие {report.agreement:.0%}, сдвиг {report.distribution_shift:.2f}, "
+        f"уверенность {report.baseline_confidence:.2f} → {report.candidate_confidence:.2f}, "
+        f"ошибок {report.errors}"
+    )
+    st.dataframe(
+        [
+            {"было → стало": label, **row, "доля было": round(report.baseline_distribution[label], 2),
+             "доля стало": round(report.candidate_distribution[label], 2)}
+            for label, row in report.matrix.items()
+        ],
+        hide_index=True,
+    )
+    if not report.passed:
+        st.error("Регрессия: " + "; ".join(report.reasons))
+
 
 with st.sidebar:
     st.subheader("⚙️ Настройки")
-    st.caption(f"Google Sheets: {prompt_store.status()}")
+    st.caption(f"Промпты: {prompt_store.status()}")
 
     if prompt_store.enabled:
         overrides = prompt_store.load_all()
@@ -72,37 +113,145 @@ with st.sidebar:
 
             default_name = st.session_state.get("prompt_editor_name", "")
             editor_name = st.text_input("Имя редактора (необязательно)", value=default_name)
+            force_router = st.checkbox("Сохранить промпт роутера даже при регрессии") if router_regression else False
             submitted = st.form_submit_button("💾 Сохранить промпты")
 
+        # Версии промптов на момент показа формы - для проверки конфликтов при сохранении
+        loaded_versions = {key: record.updated_at for key, record in overrides.items()}
+        baseline = st.session_state.get("prompt_editor_baseline", loaded_versions)
+        st.session_state["prompt_editor_baseline"] = loaded_versions
+
         if submitted:
             st.session_state["prompt_editor_name"] = editor_name
             normalized_name = editor_name.strip() or None
-            changes_made = False
-            errors = []
 
+            changed = {}
             for key, new_value in edited_prompts.items():
                 existing_record = overrides.get(key)
                 existing_value = (
                     existing_record.prompt if existing_record and existing_record.prompt else DEFAULT_PROMPTS[key]
                 )
                 if new_value != existing_value:
-                    success = prompt_store.update_prompt(key, new_value, updated_by=normalized_name)
-                    if not success:
-                        errors.append(key)
-                        break
-                    changes_made = True
-
-            if errors:
-                readable = ", ".join(PROMPT_LABELS.get(key, key) for key in errors)
-                st.error(f"Не удалось обновить промпт(ы): {readable}")
-            elif changes_made:
-                st.session_state.orchestrator.refresh_prompts()
-                st.success("Промпты обновлены")
-                st.rerun()
+                    changed[key] = new_value
+
+            if "router" in changed and router_regression:
+                # Кандидат прогоняется по сохраненным решениям до записи
+                with st.spinner("Проверка промпта роутера на истории..."):
+                    regression = router_regression.run(changed["router"])
+                show_regression(regression)
+                if not regression.passed and not force_router:
+                    st.warning("Промпт роутера не сохранен")
+                    changed.pop("router")
+
+            if changed:
+                # Одно чтение и одна запись таблицы; отказ, если кто-то успел
+                # сохранить эти промпты после того, как мы их загрузили
+                result = prompt_store.update_prompts(
+                    changed,
+                    updated_by=normalized_name,
+                    expected_updated_at={key: baseline.get(key) for key in changed},
+                )
+                if result.conflicts:
+                    readable = ", ".join(PROMPT_LABELS.get(key, key) for key in result.conflicts)
+                    st.warning(f"Промпт(ы) уже изменил другой пользователь: {readable}. Форма обновлена.")
+                elif not result.saved:
+                    readable = ", ".join(PROMPT_LABELS.get(key, key) for key in changed)
+                    st.error(f"Не удалось обновить промпт(ы): {readable}")
+                else:
+                    # Агенты уже получили новые промпты: граф подписан на снимок
+                    st.success("Промпты обновлены")
+                    st.rerun()
             else:
                 st.info("Изменений не обнаружено")
     else:
-        st.info("Редактирование промптов отключено. Проверьте настройки Google Sheets в secrets.toml.")
+        st.info("Редактирование промптов отключено. Проверьте настройки Google Sheets в secrets.toml или задайте PROMPT_BACKEND=local.")
+
+    memory_queue = st.session_state.orchestrator.memory_queue_stats()
+    if memory_queue:
+        st.caption(
+            f"Фоновые инсайты: в очереди {memory_queue['pending']}/{memory_queue['capacity']}, "
+            f"готово {memory_queue['completed']}, ошибок {memory_queue['failed']}"
+        )
+    summary_queue = st.session_state.orchestrator.summary_queue_stats()
+    if summary_queue.get("rejected"):
+        st.caption(
+            f"Сводка: в очереди {summary_queue['pending']}/{summary_queue['capacity']}, "
+            f"свернуто в ходе при полной очереди {summary_queue['rejected']}"
+        )
+
+    llm_queue = scheduler_stats()
+    if llm_queue["max_waiting"] or llm_queue["retries"] or llm_queue["failed"]:
+        by_priority = llm_queue["by_priority"]
+        st.caption(
+            f"Очередь LLM: ждут {llm_queue['waiting']} (ответы {by_priority['interactive']}, "
+            f"роутер {by_priority['routing']}, фон {by_priority['background']}), в работе {llm_queue['in_flight']}, "
+            f"повторов {llm_queue['retries']}, отказов {llm_queue['failed'] + llm_queue['overloaded']}"
+        )
+
+    with st.expander("🧩 Модели агентов"):
+        for key, settings in st.session_state.orchestrator.graph.llm_settings().items():
+            st.caption(
+                f"**{PROMPT_LABELS.get(key, key)}**: {settings['model']}, "
+                f"t={settings['temperature']}, max_tokens={settings['max_tokens']}"
+            )
+
+    cache_stats = st.session_state.orchestrator.graph.cache_stats()
+    if cache_stats:
+        st.caption(
+            f"Кеш LLM: попаданий {cache_stats['memory_hits'] + cache_stats['disk_hits']}, "
+            f"промахов {cache_stats['misses']} ({cache_stats['hit_rate']:.0%})"
+        )
+
+    if router_regression:
+        with st.expander("🧪 Регрессия роутера"):
+            reports = router_regression.reports()
+            for report in reversed(reports):
+                show_regression(report)
+            if not reports:
+                st.caption("Промпт роутера еще не проверялся")
+
+    parse_stats = st.session_state.orchestrator.graph.parse_stats()
+    if any(counts["truncated"] or counts["repaired"] or counts["failed"] for counts in parse_stats.values()):
+        st.caption(
+            "Разбор JSON: "
+            + ", ".join(
+                f"{PROMPT_LABELS.get(key, key)} достроено {counts['truncated']}, "
+                f"исправлено {counts['repaired']}, не разобрано {counts['failed']}"
+                for key, counts in parse_stats.items()
+            )
+        )
+
+    with st.expander("⏱️ Метрики"):
+        scope = st.radio("Замеры", ["Эта сессия", "Все сессии"], horizontal=True)
+        scope_id = st.session_state.session_id if scope == "Эта сессия" else None
+        report = st.session_state.orchestrator.metrics_report(scope_id, limit=5000)
+        if report["nodes"]:
+            st.dataframe(
+                [
+                    {
+                        "узел": f"{row['kind']}:{row['node']}",
+                        "n": row["count"],
+                        "p50, мс": round(row["p50_ms"], 1),
+                        "p95, мс": round(row["p95_ms"], 1),
+                    }
+                    for row in report["nodes"]
+                ],
+                hide_index=True,
+            )
+            st.dataframe(
+                [
+                    {
+                        "сессия": row["session_id"],
+                        "ходов": row["turns"],
+                        "токены": row["prompt_tokens"] + row["completion_tokens"],
+                        "$": round(row["cost"], 4),
+                    }
+                    for row in report["sessions"]
+                ],
+                hide_index=True,
+            )
+        else:
+            st.caption("Пока нет замеров")
 
     st.divider()
 
@@ -170,9 +319,17 @@ with col1:
             with st.chat_message("user"):
                 st.write(prompt)
         
-        # Обрабатываем через агентов
-        with st.spinner("Анализ и выбор подхода..."):
-            result = st.session_state.orchestrator.process_message(prompt)
+        # Обрабатываем через агентов, показывая ответ по мере генерации
+        with messages_container:
+            with st.chat_message("assistant"):
+                stream = st.session_state.orchestrator.stream_message(prompt)
+                st.write_stream(stream)
+                result = stream.result
+                st.caption(
+                    f"🔍 {result['approach']} "
+                    f"({result['confidence']:.0%}) - "
+                    f"{result['reasoning']}"
+                )
         
         # Добавляем ответ
         st.session_state.messages.append({
@@ -185,16 +342,6 @@ with col1:
             }
         })
         
-        # Показываем ответ
-        with messages_container:
-            with st.chat_message("assistant"):
-                st.write(result["response"])
-                st.caption(
-                    f"🔍 {result['approach']} "
-                    f"({result['confidence']:.0%}) - "
-                    f"{result['reasoning']}"
-                )
-        
         # Перезагружаем для обновления
         st.rerun()
 
@@ -240,10 +387,19 @@ with col2:
 
 # Кнопка экспорта истории
 if st.sidebar.button("📥 Экспортировать историю"):
-    history = st.session_state.orchestrator.get_session_history()
-    st.sidebar.download_button(
-        "Скачать JSON",
-        data=json.dumps(history, ensure_ascii=False, indent=2),
-        file_name=f"session_{st.session_state.session_id}.json",
-        mime="application/json"
-    )
+    # NDJSON собирается постранично во временный файл. download_button все
+    # равно читает файл в память целиком, поэтому большие выгрузки -
+    # через python -m tools.export_history
+    with tempfile.NamedTemporaryFile("wb", suffix=".ndjson", delete=False) as export_file:
+        for chunk in st.session_state.orchestrator.export_history():
+            export_file.write(chunk.encode("utf-8"))
+    try:
+        with open(export_file.name, "rb") as handle:
+            st.sidebar.download_button(
+                "Скачать NDJSON",
+                data=handle,
+                file_name=f"session_{st.session_state.session_id}.ndjson",
+                mime="application/x-ndjson"
+            )
+    finally:
+        os.remove(export_file.name)
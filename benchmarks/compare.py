@@ -0,0 +1,67 @@
+"""Сравнение двух JSON-результатов benchmarks.suite.
+
+    python -m benchmarks.compare baseline.json current.json [--threshold 10]
+
+Метрики *_per_s считаются тем лучше, чем больше; остальные (время) - чем
+меньше. Код выхода 1, если хоть одна метрика ухудшилась больше порога (%).
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict
+
+
+def flatten(data: Dict, prefix: str = "") -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+def regression(name: str, old: float, new: float) -> float:
+    """Ухудшение в процентах (отрицательное - улучшение)."""
+
+    if not old:
+        return 0.0
+    change = (new - old) / old * 100
+    return -change if name.endswith("_per_s") else change
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимое ухудшение, %%")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as handle:
+        baseline = json.load(handle)
+    with open(args.current, encoding="utf-8") as handle:
+        current = json.load(handle)
+
+    old, new = flatten(baseline["results"]), flatten(current["results"])
+    print(f"{baseline['meta'].get('commit')} -> {current['meta'].get('commit')}")
+    failed = []
+    for name in sorted(old.keys() & new.keys()):
+        # Счетчики (count, turns) не метрики производительности
+        if name.endswith((".count", ".turns", ".concurrency")) or name in ("orchestrator.turns", "nodes.turns"):
+            continue
+        worse = regression(name, old[name], new[name])
+        mark = ""
+        if worse > args.threshold:
+            mark = "  <- регрессия"
+            failed.append(name)
+        print(f"{name:<45} {old[name]:>12.3f} {new[name]:>12.3f} {worse:>+8.1f}%{mark}")
+
+    if failed:
+        print(f"\nУхудшились больше чем на {args.threshold:.0f}%: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
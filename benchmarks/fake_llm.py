@@ -0,0 +1,172 @@
+"""Детерминированная заглушка ChatLiteLLM для бенчмарков.
+
+Задержка задается строкой распределения (см. parse_latency) отдельно для
+роутера, специалистов и агента памяти; генератор случайных чисел с
+фиксированным seed, поэтому прогоны воспроизводимы.
+"""
+
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Optional, Union
+
+from langchain.schema import AIMessage
+from langchain_core.messages import AIMessageChunk
+
+ROUTER_RESPONSE = json.dumps(
+    {
+        "approach": "DBT",
+        "confidence": 0.8,
+        "reasoning": "Сильные эмоции",
+        "keywords": ["эмоции"],
+    },
+    ensure_ascii=False,
+)
+
+MEMORY_RESPONSE = json.dumps(
+    {
+        "insights": ["Пользователь замечает свои эмоции"],
+        "patterns": ["Избегание"],
+        "triggers": ["Конфликт"],
+        "resources": [],
+        "keywords": ["эмоции"],
+    },
+    ensure_ascii=False,
+)
+
+SPECIALIST_RESPONSE = "Похоже, сейчас вам непросто. Давайте попробуем заметить, что происходит в теле."
+
+Latency = Union[float, Callable[[], float]]
+
+
+def parse_latency(spec: str, seed: int = 0) -> Callable[[], float]:
+    """Распределение задержки в секундах из строки.
+
+    "0.05" или "const:0.05" - постоянная; "uniform:0.02:0.2" - равномерная;
+    "lognormal:0.3:0.5" - логнормальная с медианой 0.3 и sigma 0.5
+    (похоже на реальные ответы провайдеров с длинным хвостом).
+    """
+
+    kind, _, args = spec.partition(":")
+    if not args:
+        kind, args = "const", spec
+    values = [float(value) for value in args.split(":")]
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def sample(draw):
+        def inner() -> float:
+            with lock:
+                return max(draw(), 0.0)
+        return inner
+
+    if kind == "const":
+        return lambda: values[0]
+    if kind == "uniform":
+        return sample(lambda: rng.uniform(values[0], values[1]))
+    if kind == "lognormal":
+        return sample(lambda: rng.lognormvariate(math.log(values[0]), values[1]))
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+
+def route_for(text: str) -> str:
+    """Детерминированный выбор подхода по тексту сообщения."""
+
+    return ("DBT", "IFS", "TRE")[zlib.crc32(text.encode("utf-8")) % 3]
+
+
+class FakeChatModel:
+    """Отвечает заготовками по системному промпту, без сети.
+
+    latency - число секунд или функция, возвращающая задержку очередного
+    вызова; rotate_routes=True раздает сообщения по всем специалистам.
+    Поток отдается по словам, задержка делится между чанками.
+    """
+
+    def __init__(self, latency: Latency = 0.0, rotate_routes: bool = False, **params):
+        self.latency = latency
+        self.rotate_routes = rotate_routes
+        self.model = params.get("model", "fake")
+        self.temperature = params.get("temperature")
+        self.max_tokens = params.get("max_tokens")
+        self.calls = 0
+
+    def _delay(self) -> float:
+        self.calls += 1
+        return self.latency() if callable(self.latency) else self.latency
+
+    def _respond(self, messages) -> str:
+        system_prompt = messages[0].content if messages else ""
+        if "маршрутизирующий" in system_prompt:
+            if self.rotate_routes:
+                route = json.loads(ROUTER_RESPONSE)
+                route["approach"] = route_for(messages[-1].content)
+                return json.dumps(route, ensure_ascii=False)
+            return ROUTER_RESPONSE
+        if "агент памяти" in system_prompt:
+            return MEMORY_RESPONSE
+        return SPECIALIST_RESPONSE
+
+    def invoke(self, messages, **kwargs):
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        return AIMessage(content=self._respond(messages))
+
+    async def ainvoke(self, messages, **kwargs):
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return AIMessage(content=self._respond(messages))
+
+    def stream(self, messages, **kwargs):
+        delay = self._delay()
+        chunks = self._chunks(self._respond(messages))
+        for chunk in chunks:
+            if delay:
+                time.sleep(delay / len(chunks))
+            yield AIMessageChunk(content=chunk)
+
+    async def astream(self, messages, **kwargs):
+        delay = self._delay()
+        chunks = self._chunks(self._respond(messages))
+        for chunk in chunks:
+            if delay:
+                await asyncio.sleep(delay / len(chunks))
+            yield AIMessageChunk(content=chunk)
+
+    @staticmethod
+    def _chunks(text: str):
+        words = text.split(" ")
+        return [word + " " for word in words[:-1]] + [words[-1]]
+
+
+def fake_factory(
+    latencies: Optional[Dict[str, str]] = None,
+    default: str = "0",
+    rotate_routes: bool = True,
+    seed: int = 0,
+) -> Callable[..., FakeChatModel]:
+    """Фабрика для set_llm_factory с задержками по модели агента.
+
+    latencies сопоставляет имя модели (ROUTER_MODEL, DBT_MODEL, ...) со
+    строкой распределения; остальные модели получают default. Каждый
+    клиент получает свой генератор, зависящий от seed и имени модели.
+    """
+
+    latencies = latencies or {}
+
+    def factory(**params) -> FakeChatModel:
+        model = params.get("model", "fake")
+        spec = latencies.get(model, default)
+        return FakeChatModel(
+            latency=parse_latency(spec, seed + zlib.crc32(model.encode("utf-8"))),
+            rotate_routes=rotate_routes,
+            **params,
+        )
+
+    return factory
@@ -0,0 +1,363 @@
+"""Нагрузочный тест: много одновременных бесед в одном процессе.
+
+    python -m benchmarks.load_test --sessions 50 --turns 10 --mode threads \\
+        --latency lognormal:0.8:0.4 --router-latency 0.15 --think uniform:0:2
+
+Каждая беседа - fork() общего TherapyOrchestrator (или отдельный
+оркестратор с --isolated), который проигрывает сценарий из нескольких
+реплик через process_message / aprocess_message. LLM заменена заглушкой
+с задержками, а MemoryStorage пишет в настоящий файл на диске (--db,
+по умолчанию во временном каталоге), поэтому блокировки SQLite
+настоящие.
+
+Отчет: пропускная способность, p50/p99 времени хода, ожидание блокировки
+записи SQLite (время BEGIN IMMEDIATE) и рост RSS на одну беседу.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Модели по ролям - чтобы задать задержку роутера отдельно от специалистов
+AGENT_MODELS = {
+    "router": "fake-router",
+    "dbt": "fake-specialist",
+    "ifs": "fake-specialist",
+    "tre": "fake-specialist",
+    "memory": "fake-memory",
+    "summary": "fake-summary",
+}
+for _key, _model in AGENT_MODELS.items():
+    os.environ.setdefault(f"{_key.upper()}_MODEL", _model)
+os.environ.setdefault("LLM_CACHE_AGENTS", "")
+os.environ.setdefault("PROMPT_LOCAL_MIRROR", "false")
+# Заглушка принимает response_format; поддержку моделей в LiteLLM не ищем
+os.environ.setdefault("STRUCTURED_OUTPUT", "json")
+
+from agents.llm import scheduler_stats, set_llm_concurrency, set_llm_factory  # noqa: E402
+from benchmarks.fake_llm import fake_factory, parse_latency  # noqa: E402
+from benchmarks.stats import summarize  # noqa: E402
+from config import (  # noqa: E402
+    STORAGE_BATCH_SIZE, STORAGE_FLUSH_MS, STORAGE_QUEUE_SIZE, STORAGE_WRITE_BEHIND,
+)
+from core.orchestrator import TherapyOrchestrator  # noqa: E402
+from core.storage import MemoryStorage  # noqa: E402
+
+# Сценарии по умолчанию: реплики повторяются по кругу, если ходов больше
+SCRIPTS = [
+    [
+        "Мне тревожно перед завтрашней встречей",
+        "Сердце колотится, не могу уснуть",
+        "Я боюсь, что меня уволят",
+        "Наверное, я слишком много об этом думаю",
+    ],
+    [
+        "Часть меня хочет все бросить",
+        "А другая часть требует продолжать любой ценой",
+        "Кажется, они обе пытаются меня защитить",
+    ],
+    [
+        "Плечи постоянно напряжены",
+        "После работы болит спина",
+        "Я даже не замечаю, когда сжимаю челюсть",
+        "Хочу научиться расслабляться",
+        "Дыхательные упражнения пока не помогают",
+    ],
+]
+
+
+class LockTimedStorage(MemoryStorage):
+    """MemoryStorage, который замеряет ожидание блокировки записи.
+
+    Транзакции те же, что в MemoryStorage: они начинаются с BEGIN IMMEDIATE,
+    который сразу берет блокировку записи. Время его выполнения - это
+    ожидание других писателей (busy_timeout), а не работа запроса.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._lock_stats_guard = threading.Lock()
+        self.lock_waits: List[float] = []
+        self.busy_errors = 0
+        super().__init__(*args, **kwargs)
+
+    def _begin(self, conn: sqlite3.Connection) -> None:
+        started = time.perf_counter()
+        try:
+            super()._begin(conn)
+        except sqlite3.OperationalError:
+            with self._lock_stats_guard:
+                self.busy_errors += 1
+            raise
+        waited = time.perf_counter() - started
+        with self._lock_stats_guard:
+            self.lock_waits.append(waited)
+
+
+class RSSSampler:
+    """Фоновый опрос RSS процесса: начальное, конечное и пиковое значение"""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.start = self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self) -> int:
+        self._stop.set()
+        self._thread.join()
+        end = rss_bytes()
+        self.peak = max(self.peak, end)
+        return end
+
+
+def rss_bytes() -> int:
+    """Текущий RSS; без /proc (macOS) - пиковый из getrusage."""
+
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def load_scripts(path: Optional[str]) -> List[List[str]]:
+    """Сценарии из JSONL ({"messages": [...]} в строке) или встроенные."""
+
+    if not path:
+        return SCRIPTS
+    scripts = []
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            if line.strip():
+                scripts.append(json.loads(line)["messages"])
+    return scripts
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, db_path: str):
+        self.args = args
+        self.scripts = load_scripts(args.script)
+        self.think = parse_latency(args.think, args.seed + 1)
+        self.storage = self._storage(db_path)
+        self.engine = TherapyOrchestrator(use_memory=True, storage=self.storage)
+        self.isolated: List[TherapyOrchestrator] = []
+        self.durations: List[float] = []
+        self.errors = 0
+        self._guard = threading.Lock()
+
+    def _storage(self, db_path: str) -> LockTimedStorage:
+        return LockTimedStorage(
+            db_path,
+            write_behind=STORAGE_WRITE_BEHIND,
+            batch_size=STORAGE_BATCH_SIZE,
+            flush_interval_ms=STORAGE_FLUSH_MS,
+            max_queue=STORAGE_QUEUE_SIZE,
+        )
+
+    def conversation(self, index: int) -> TherapyOrchestrator:
+        if not self.args.isolated:
+            return self.engine.fork()
+        # Отдельный граф, клиенты и соединения на беседу - как при
+        # оркестраторе на каждого пользователя; база общая
+        orchestrator = TherapyOrchestrator(use_memory=True, storage=self._storage(self.storage.db_path))
+        with self._guard:
+            self.isolated.append(orchestrator)
+        return orchestrator
+
+    def messages(self, index: int) -> List[str]:
+        script = self.scripts[index % len(self.scripts)]
+        return [script[turn % len(script)] for turn in range(self.args.turns)]
+
+    def _record(self, duration: Optional[float]) -> None:
+        with self._guard:
+            if duration is None:
+                self.errors += 1
+            else:
+                self.durations.append(duration)
+
+    def run_thread(self, index: int) -> None:
+        orchestrator = self.conversation(index)
+        orchestrator.start_session(f"load-{index}")
+        for message in self.messages(index):
+            time.sleep(self.think())
+            started = time.perf_counter()
+            try:
+                orchestrator.process_message(message)
+            except Exception as e:
+                print(f"Ошибка хода в беседе {index}: {e}")
+                self._record(None)
+                continue
+            self._record(time.perf_counter() - started)
+
+    async def run_task(self, index: int) -> None:
+        orchestrator = self.conversation(index)
+        await orchestrator.astart_session(f"load-{index}")
+        for message in self.messages(index):
+            await asyncio.sleep(self.think())
+            started = time.perf_counter()
+            try:
+                await orchestrator.aprocess_message(message)
+            except Exception as e:
+                print(f"Ошибка хода в беседе {index}: {e}")
+                self._record(None)
+                continue
+            self._record(time.perf_counter() - started)
+
+    def run(self) -> Dict:
+        sessions = self.args.sessions
+        sampler = RSSSampler()
+        started = time.perf_counter()
+        if self.args.mode == "threads":
+            threads = [threading.Thread(target=self.run_thread, args=(index,)) for index in range(sessions)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            async def run_all():
+                await asyncio.gather(*(self.run_task(index) for index in range(sessions)))
+            asyncio.run(run_all())
+        elapsed = time.perf_counter() - started
+
+        # Фоновые инсайты и отложенная запись тоже часть нагрузки:
+        # drained_s - время до полной записи всего в базу
+        orchestrators = [self.engine] + self.isolated
+        memory_queue: Dict[str, int] = {}
+        summary_queue: Dict[str, int] = {}
+        write_stats: Dict[str, int] = {}
+        for orchestrator in orchestrators:
+            if orchestrator.memory_worker:
+                orchestrator.memory_worker.join()
+            if orchestrator.summary_worker:
+                orchestrator.summary_worker.join()
+            orchestrator.storage.flush()
+            for totals, stats in ((memory_queue, orchestrator.memory_queue_stats()),
+                                  (summary_queue, orchestrator.summary_queue_stats()),
+                                  (write_stats, orchestrator.storage.write_stats())):
+                for name, value in stats.items():
+                    totals[name] = totals.get(name, 0) + value
+        drained = time.perf_counter() - started
+        rss_end = sampler.stop()
+
+        storages = [orchestrator.storage for orchestrator in orchestrators]
+        lock_waits = [wait for storage in storages for wait in storage.lock_waits]
+        busy_errors = sum(storage.busy_errors for storage in storages)
+
+        for orchestrator in self.isolated:
+            orchestrator.close()
+        self.engine.close()
+
+        turns = len(self.durations)
+        return {
+            "sessions": sessions,
+            "mode": self.args.mode,
+            "isolated": self.args.isolated,
+            "turns": turns,
+            "errors": self.errors,
+            "elapsed_s": elapsed,
+            "drained_s": drained,
+            "turns_per_s": turns / elapsed if elapsed else 0.0,
+            "turn_latency_ms": summarize(self.durations),
+            "sqlite": {
+                "transactions": len(lock_waits),
+                "busy_errors": busy_errors,
+                "lock_wait_ms": summarize(lock_waits),
+                "lock_wait_total_s": sum(lock_waits),
+                "write_behind": write_stats,
+            },
+            "memory_queue": memory_queue,
+            "summary_queue": summary_queue,
+            "llm_queue": scheduler_stats(),
+            "rss_mb": {
+                "start": sampler.start / 2 ** 20,
+                "end": rss_end / 2 ** 20,
+                "peak": sampler.peak / 2 ** 20,
+                "growth_per_session_kb": (rss_end - sampler.start) / 1024 / sessions,
+            },
+        }
+
+
+def print_report(report: Dict) -> None:
+    latency = report["turn_latency_ms"]
+    sqlite = report["sqlite"]
+    rss = report["rss_mb"]
+    print(
+        f"{report['sessions']} бесед ({report['mode']}{', isolated' if report['isolated'] else ''}): "
+        f"{report['turns']} ходов за {report['elapsed_s']:.1f} с, {report['turns_per_s']:.1f} ходов/с, "
+        f"ошибок {report['errors']}"
+    )
+    if latency.get("count"):
+        print(f"Ход: p50 {latency['p50']:.0f} мс, p99 {latency['p99']:.0f} мс, max {latency['max']:.0f} мс")
+    waits = sqlite["lock_wait_ms"]
+    if waits.get("count"):
+        print(
+            f"SQLite: {sqlite['transactions']} транзакций, ожидание блокировки p50 {waits['p50']:.2f} мс, "
+            f"p99 {waits['p99']:.2f} мс, всего {sqlite['lock_wait_total_s']:.2f} с, busy-ошибок {sqlite['busy_errors']}"
+        )
+    summary_queue = report["summary_queue"]
+    if summary_queue.get("rejected"):
+        print(f"Сводка: очередь была полна {summary_queue['rejected']} раз, ход сворачивал сам")
+    queue = report["llm_queue"]
+    print(
+        f"Очередь LLM: макс. глубина {queue['max_waiting']}, среднее ожидание {queue['mean_wait_ms']:.1f} мс, "
+        f"повторов {queue['retries']}, отказов {queue['failed']}, не дождались {queue['overloaded']}"
+    )
+    print(
+        f"RSS: {rss['start']:.0f} -> {rss['end']:.0f} МБ (пик {rss['peak']:.0f}), "
+        f"{rss['growth_per_session_kb']:.0f} КБ на беседу"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="одновременных бесед")
+    parser.add_argument("--turns", type=int, default=5, help="ходов в каждой беседе")
+    parser.add_argument("--mode", choices=["threads", "async"], default="threads")
+    parser.add_argument("--isolated", action="store_true", help="отдельный оркестратор на беседу вместо fork()")
+    parser.add_argument("--script", help="JSONL со сценариями: {\"messages\": [...]} в строке")
+    parser.add_argument("--latency", default="0.5", help="задержка LLM по умолчанию (см. parse_latency)")
+    parser.add_argument("--router-latency", help="задержка роутера")
+    parser.add_argument("--specialist-latency", help="задержка специалистов")
+    parser.add_argument("--memory-latency", help="задержка агента памяти")
+    parser.add_argument("--max-llm-calls", type=int, help="одновременных запросов к LLM")
+    parser.add_argument("--think", default="0", help="пауза пользователя между репликами")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="файл базы (по умолчанию - во временном каталоге)")
+    parser.add_argument("--out", help="сохранить отчет в JSON")
+    args = parser.parse_args()
+
+    latencies = {model: args.latency for model in AGENT_MODELS.values()}
+    for role, spec in (("router", args.router_latency), ("dbt", args.specialist_latency),
+                       ("memory", args.memory_latency)):
+        if spec:
+            latencies[AGENT_MODELS[role]] = spec
+    set_llm_factory(fake_factory(latencies, seed=args.seed))
+    set_llm_concurrency(args.max_llm_calls)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.abspath(args.db) if args.db else os.path.join(directory, "load.db")
+        report = LoadTest(args, db_path).run()
+
+    report["args"] = vars(args)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Регрессионный бенчмарк: история сообщений растет линейно по числу ходов.
+
+    python -m benchmarks.state_growth --turns 500
+
+Раньше узлы графа возвращали все состояние целиком, и редьюсер
+operator.add дописывал историю заново на каждом узле.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Кеш ответов не нужен: заглушка и так отвечает мгновенно
+os.environ.setdefault("LLM_CACHE_AGENTS", "")
+# Заглушка принимает response_format; поддержку моделей в LiteLLM не ищем
+os.environ.setdefault("STRUCTURED_OUTPUT", "json")
+
+from agents.llm import set_llm_factory  # noqa: E402
+from benchmarks.fake_llm import FakeChatModel  # noqa: E402
+from core.orchestrator import TherapyOrchestrator  # noqa: E402
+
+
+def run(turns: int) -> int:
+    set_llm_factory(FakeChatModel)
+    orchestrator = TherapyOrchestrator(use_memory=False)
+    orchestrator.start_session()
+
+    started = time.perf_counter()
+    for turn in range(1, turns + 1):
+        orchestrator.process_message(f"Сообщение {turn}: мне тревожно")
+        expected = 2 * turn
+        if len(orchestrator.messages) != expected:
+            print(f"FAIL: после хода {turn} в истории {len(orchestrator.messages)} сообщений, ожидалось {expected}")
+            return 1
+    elapsed = time.perf_counter() - started
+
+    print(f"OK: {turns} ходов, {len(orchestrator.messages)} сообщений, {elapsed / turns * 1000:.2f} мс/ход")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=500)
+    args = parser.parse_args()
+    sys.exit(run(args.turns))
+
+
+if __name__ == "__main__":
+    main()
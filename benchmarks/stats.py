@@ -0,0 +1,33 @@
+"""Сводная статистика для результатов бенчмарков."""
+
+import math
+from typing import Dict, Sequence
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Перцентиль q (0..100) с линейной интерполяцией."""
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low, high = math.floor(position), math.ceil(position)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def summarize(values: Sequence[float], scale: float = 1000.0) -> Dict[str, float]:
+    """count, mean, p50, p90, p99 и max; по умолчанию секунды переводятся в мс."""
+
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) * scale,
+        "p50": percentile(values, 50) * scale,
+        "p90": percentile(values, 90) * scale,
+        "p99": percentile(values, 99) * scale,
+        "max": max(values) * scale,
+    }
+
+
+__all__ = ["percentile", "summarize"]
@@ -0,0 +1,97 @@
+"""Задержка чтения истории сессии в зависимости от размера базы.
+
+    python -m benchmarks.storage_lookup --sizes 10000 100000 1000000 [--no-index]
+
+База заполняется синтетическими сообщениями (по --per-session на сессию),
+затем замеряется get_session_history и get_session_insights для случайных
+сессий. С индексами миграции 2 время должно оставаться почти постоянным;
+--no-index удаляет их и показывает прежнее поведение (полный скан).
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+from core.storage import MemoryStorage
+
+INDEXES = ("idx_messages_session_created", "idx_insights_session_created", "idx_sessions_user_created")
+
+
+def fill(storage: MemoryStorage, rows: int, per_session: int, chunk: int = 50000) -> int:
+    """Вставить rows сообщений (и по инсайту на ход) напрямую, минуя буферы."""
+
+    sessions = max(1, rows // per_session)
+    with storage._transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO sessions (id, user_id) VALUES (?, ?)",
+            ((session_id, f"user{session_id % 1000}") for session_id in range(1, sessions + 1)),
+        )
+
+    # Сообщения сессий перемешаны во времени, как при живом трафике
+    for start in range(0, rows, chunk):
+        batch = range(start, min(start + chunk, rows))
+        with storage._transaction() as cursor:
+            cursor.executemany(
+                "INSERT INTO messages (session_id, role, content, approach) VALUES (?, ?, ?, ?)",
+                ((index % sessions + 1, "user" if index % 2 else "assistant", f"сообщение {index}", "DBT")
+                 for index in batch),
+            )
+            cursor.executemany(
+                "INSERT INTO insights (session_id, insight, type, approach) VALUES (?, ?, ?, ?)",
+                ((index % sessions + 1, f"инсайт {index}", "insight", "DBT") for index in batch if index % 2),
+            )
+    return sessions
+
+
+def measure(rows: int, per_session: int, lookups: int, db_path: str, use_index: bool = True) -> Dict[str, float]:
+    storage = MemoryStorage(db_path)
+    if not use_index:
+        for index in INDEXES:
+            storage._connection().execute(f"DROP INDEX IF EXISTS {index}")
+
+    started = time.perf_counter()
+    sessions = fill(storage, rows, per_session)
+    fill_seconds = time.perf_counter() - started
+
+    rng = random.Random(7)
+    history: List[float] = []
+    insights: List[float] = []
+    for _ in range(lookups):
+        session_id = rng.randint(1, sessions)
+        started = time.perf_counter()
+        storage.get_session_history(session_id)
+        history.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        storage.get_session_insights(session_id)
+        insights.append(time.perf_counter() - started)
+
+    storage.close()
+    return {
+        "fill_seconds": fill_seconds,
+        "history_us": statistics.median(history) * 1e6,
+        "insights_us": statistics.median(insights) * 1e6,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--per-session", type=int, default=40, help="сообщений на сессию")
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--no-index", action="store_true", help="удалить индексы перед замером")
+    args = parser.parse_args()
+
+    print(f"{'сообщений':>10} {'заполнение, с':>14} {'история, мкс':>13} {'инсайты, мкс':>13}")
+    for rows in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            result = measure(rows, args.per_session, args.lookups, os.path.join(directory, "bench.db"),
+                             use_index=not args.no_index)
+        print(f"{rows:>10} {result['fill_seconds']:>14.1f} {result['history_us']:>13.0f} {result['insights_us']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Пропускная способность записи MemoryStorage.
+
+    python -m benchmarks.storage_write --interactions 2000 --threads 4 [--write-behind]
+
+Каждый поток создает свою сессию и сохраняет взаимодействия с тремя
+инсайтами, как после обычного хода беседы.
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from core.storage import MemoryStorage
+
+STATE = {
+    "user_message": "Мне тревожно перед встречей",
+    "specialist_response": "Давайте попробуем заметить, где тревога ощущается в теле.",
+    "current_approach": "DBT",
+    "confidence": 0.8,
+    "reasoning": "Сильные эмоции",
+    "insights": {
+        "insights": ["Замечает тревогу"],
+        "patterns": ["Избегание"],
+        "triggers": ["Встречи"],
+    },
+}
+
+
+def run(interactions: int, threads: int, db_path: str, write_behind: bool = False) -> float:
+    storage = MemoryStorage(db_path, write_behind=write_behind)
+    per_thread = interactions // threads
+
+    def writer():
+        session_id = storage.create_session("bench")
+        for _ in range(per_thread):
+            storage.save_interaction(session_id, STATE)
+
+    workers = [threading.Thread(target=writer) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    # В режиме write_behind время включает дозапись очереди
+    storage.close()
+    elapsed = time.perf_counter() - started
+
+    return per_thread * threads / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interactions", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--write-behind", action="store_true", help="писать через буфер отложенной записи")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        rate = run(args.interactions, args.threads, os.path.join(directory, "bench.db"), args.write_behind)
+    mode = "write-behind" if args.write_behind else "синхронно"
+    print(f"{rate:.0f} взаимодействий/с ({args.threads} потоков, {mode})")
+
+
+if __name__ == "__main__":
+    main()
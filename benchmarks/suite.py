@@ -0,0 +1,240 @@
+"""Полный ход беседы на заглушке LLM; результаты сохраняются в JSON.
+
+    python -m benchmarks.suite --turns 200 --latency lognormal:0.05:0.5 --out bench.json
+    python -m benchmarks.compare baseline.json bench.json
+
+Разделы:
+- orchestrator: пропускная способность и перцентили process_message
+  (MemoryStorage на диске, задержки LLM по --router-latency и т.д.);
+- nodes: время каждого узла скомпилированного графа при нулевой задержке
+  LLM, то есть собственные накладные расходы графа и агентов;
+- storage: скорость записи взаимодействий и чтения истории;
+- normalize: стоимость BaseAgent._normalize_content на типичных ответах.
+
+Прогон идет во временном каталоге, поэтому локальные prompts.db,
+router_classifier.json и база сессий не влияют на результат.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List
+
+# Отдельное имя модели для каждой роли - по нему заглушка выбирает задержку
+AGENT_MODELS = {
+    "router": "fake-router",
+    "dbt": "fake-specialist",
+    "ifs": "fake-specialist",
+    "tre": "fake-specialist",
+    "memory": "fake-memory",
+    "summary": "fake-summary",
+}
+for _key, _model in AGENT_MODELS.items():
+    os.environ.setdefault(f"{_key.upper()}_MODEL", _model)
+os.environ.setdefault("LLM_CACHE_AGENTS", "")
+os.environ.setdefault("PROMPT_LOCAL_MIRROR", "false")
+# Заглушка принимает response_format; поддержку моделей в LiteLLM не ищем
+os.environ.setdefault("STRUCTURED_OUTPUT", "json")
+
+from agents.llm import set_llm_factory  # noqa: E402
+from agents.specialists import BaseAgent  # noqa: E402
+from benchmarks import storage_write  # noqa: E402
+from benchmarks.fake_llm import fake_factory  # noqa: E402
+from benchmarks.stats import summarize  # noqa: E402
+from core.graph import TherapyGraph  # noqa: E402
+from core.orchestrator import TherapyOrchestrator  # noqa: E402
+from core.storage import MemoryStorage  # noqa: E402
+
+MESSAGES = [
+    "Мне тревожно перед завтрашней встречей",
+    "Часть меня хочет все бросить, а другая требует продолжать",
+    "Плечи постоянно напряжены, не могу расслабиться",
+    "Я снова накричал на близкого человека и жалею",
+    "Не понимаю, что я сейчас чувствую",
+]
+
+
+def bench_orchestrator(turns: int, concurrency: int, latencies: Dict[str, str], seed: int) -> Dict:
+    set_llm_factory(fake_factory(latencies, seed=seed))
+    engine = TherapyOrchestrator(use_memory=True)
+    per_worker = max(turns // concurrency, 1)
+    durations: List[float] = []
+    lock = threading.Lock()
+
+    def worker(index: int):
+        orchestrator = engine.fork()
+        orchestrator.start_session(f"bench-{index}")
+        local = []
+        for turn in range(per_worker):
+            message = MESSAGES[(turn + index) % len(MESSAGES)]
+            started = time.perf_counter()
+            orchestrator.process_message(message)
+            local.append(time.perf_counter() - started)
+        with lock:
+            durations.extend(local)
+
+    # Прогрев: импорт и компиляция уже позади, но первые вызовы дороже
+    warmup = engine.fork()
+    warmup.start_session("warmup")
+    warmup.process_message(MESSAGES[0])
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    engine.close()
+
+    return {
+        "turns": len(durations),
+        "concurrency": concurrency,
+        "turns_per_s": len(durations) / elapsed,
+        "latency_ms": summarize(durations),
+    }
+
+
+def bench_nodes(turns: int) -> Dict:
+    set_llm_factory(fake_factory())
+    graph = TherapyGraph(inline_memory=True)
+    per_node: Dict[str, List[float]] = defaultdict(list)
+    totals: List[float] = []
+
+    for turn in range(turns):
+        state = graph._initial_state(MESSAGES[turn % len(MESSAGES)], [])
+        started = last = time.perf_counter()
+        for update in graph.app.stream(state, stream_mode="updates"):
+            now = time.perf_counter()
+            for node in update:
+                per_node[node].append(now - last)
+            last = now
+        totals.append(time.perf_counter() - started)
+
+    return {
+        "turns": turns,
+        "total_ms": summarize(totals),
+        "nodes_ms": {node: summarize(values) for node, values in sorted(per_node.items())},
+    }
+
+
+def bench_storage(interactions: int, reads: int, directory: str) -> Dict:
+    results = {
+        "write_per_s": storage_write.run(interactions, 1, os.path.join(directory, "sync.db")),
+        "write_behind_per_s": storage_write.run(
+            interactions, 1, os.path.join(directory, "wb.db"), write_behind=True
+        ),
+    }
+
+    storage = MemoryStorage(os.path.join(directory, "read.db"))
+    session_id = storage.create_session("bench")
+    for _ in range(100):
+        storage.save_interaction(session_id, storage_write.STATE)
+    started = time.perf_counter()
+    for _ in range(reads):
+        storage.get_session_history(session_id)
+    results["history_reads_per_s"] = reads / (time.perf_counter() - started)
+    started = time.perf_counter()
+    for _ in range(reads):
+        storage.get_history_page(session_id, 0, 50)
+    results["page_reads_per_s"] = reads / (time.perf_counter() - started)
+    storage.close()
+    return results
+
+
+def bench_normalize(iterations: int) -> Dict:
+    text = "Похоже, сейчас вам непросто. " * 20
+    shapes = {
+        "str": text,
+        "parts": [{"type": "text", "text": text}, {"type": "text", "text": text}],
+        "nested": {"content": [{"text": text}, {"output_text": text}, {"value": 42}]},
+    }
+    results = {}
+    for name, value in shapes.items():
+        started = time.perf_counter()
+        for _ in range(iterations):
+            BaseAgent._normalize_content(value)
+        results[f"{name}_us"] = (time.perf_counter() - started) / iterations * 1e6
+    return results
+
+
+def metadata(args: argparse.Namespace) -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": vars(args),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200, help="ходов в разделе orchestrator")
+    parser.add_argument("--concurrency", type=int, default=1, help="параллельных бесед")
+    parser.add_argument("--latency", default="0", help="задержка LLM по умолчанию (см. parse_latency)")
+    parser.add_argument("--router-latency", help="задержка роутера")
+    parser.add_argument("--specialist-latency", help="задержка специалистов")
+    parser.add_argument("--memory-latency", help="задержка агента памяти")
+    parser.add_argument("--node-turns", type=int, default=200)
+    parser.add_argument("--interactions", type=int, default=2000, help="записей в разделе storage")
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--normalize-iterations", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=["orchestrator", "nodes", "storage", "normalize"])
+    parser.add_argument("--out", help="куда сохранить JSON (по умолчанию - только вывод)")
+    args = parser.parse_args()
+
+    latencies = {model: args.latency for model in AGENT_MODELS.values()}
+    for role, spec in (("router", args.router_latency), ("dbt", args.specialist_latency),
+                       ("memory", args.memory_latency)):
+        if spec:
+            latencies[AGENT_MODELS[role]] = spec
+
+    sections = set(args.only or ["orchestrator", "nodes", "storage", "normalize"])
+    out_path = os.path.abspath(args.out) if args.out else None
+    report = {"meta": metadata(args), "results": {}}
+    results = report["results"]
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            if "orchestrator" in sections:
+                results["orchestrator"] = bench_orchestrator(args.turns, args.concurrency, latencies, args.seed)
+            if "nodes" in sections:
+                results["nodes"] = bench_nodes(args.node_turns)
+            if "storage" in sections:
+                results["storage"] = bench_storage(args.interactions, args.reads, directory)
+            if "normalize" in sections:
+                results["normalize"] = bench_normalize(args.normalize_iterations)
+        finally:
+            os.chdir(cwd)
+            set_llm_factory()
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as handle:
+            handle.write(payload)
+        print(f"Результаты сохранены в {out_path}", file=sys.stderr)
+    print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,65 @@ LITELLM_CONFIG = {
     "max_tokens": 5000,
 }
 
+def _optional_float(name: str):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+def _optional_int(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+# Поагентные переопределения LITELLM_CONFIG: <AGENT>_MODEL, <AGENT>_TEMPERATURE,
+# <AGENT>_MAX_TOKENS (например, ROUTER_MODEL=gpt-4o-mini, ROUTER_MAX_TOKENS=300).
+# Незаданные значения наследуются из LITELLM_CONFIG.
+AGENT_LLM_CONFIG = {
+    key: {
+        "model": os.getenv(f"{key.upper()}_MODEL") or None,
+        "temperature": _optional_float(f"{key.upper()}_TEMPERATURE"),
+        "max_tokens": _optional_int(f"{key.upper()}_MAX_TOKENS"),
+    }
+    for key in ("router", "dbt", "ifs", "tre", "memory", "summary")
+}
+
+# Планировщик запросов к LLM (agents/scheduler.py): лимиты провайдера в минуту
+# (LLM_RPM запросов, LLM_TPM токенов; 0 - без лимита) и поставщикам отдельно
+# в LLM_RATE_LIMITS="openai:500:200000,anthropic:50:40000"; общий лимит
+# одновременных запросов; повторы 429/5xx с экспоненциальной задержкой;
+# запрос, простоявший в очереди LLM_QUEUE_TIMEOUT секунд, отклоняется
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+LLM_RATE_LIMITS = {
+    provider.strip(): (int(rpm), int(tpm))
+    for provider, rpm, tpm in (
+        item.split(":") for item in os.getenv("LLM_RATE_LIMITS", "").split(",") if item.strip()
+    )
+}
+LLM_MAX_CONCURRENCY = _optional_int("LLM_MAX_CONCURRENCY")
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+
+# JSON-ответы роутера и агента памяти: auto - JSON schema или JSON mode, если
+# модель их поддерживает (по данным LiteLLM); schema/json - принудительно;
+# off - только разбор текста. Неразобранный ответ исправляется повторным
+# запросом не более JSON_REPAIR_RETRIES раз
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "auto").lower()
+JSON_REPAIR_RETRIES = int(os.getenv("JSON_REPAIR_RETRIES", "1"))
+
+# Бюджет токенов на историю беседы (сводка + последние сообщения) в запросе
+# агента: CONTEXT_TOKENS для всех, <AGENT>_CONTEXT_TOKENS - поагентно
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "3000"))
+AGENT_CONTEXT_TOKENS = {
+    key: _optional_int(f"{key.upper()}_CONTEXT_TOKENS") or CONTEXT_TOKENS
+    for key in ("router", "dbt", "ifs", "tre", "memory")
+}
+# Скользящая сводка: ходы, не влезающие в бюджет специалистов, по одному
+# сворачиваются в краткое содержание (агент summary); выключено - отбрасываются
+CONTEXT_SUMMARY = os.getenv("CONTEXT_SUMMARY", "true").lower() in ("1", "true", "yes")
+
 # Примеры моделей:
 # - OpenAI: "gpt-4", "gpt-3.5-turbo"
 # - Anthropic: "claude-3-haiku-20240307", "claude-3-sonnet-20240229"  
@@ -17,4 +76,68 @@ LITELLM_CONFIG = {
 # - Ollama: "ollama/llama2", "ollama/mistral"
 # - YandexGPT: "yandexgpt/latest"
 
-DATABASE_PATH = "therapy_sessions.db"
\ No newline at end of file
+DATABASE_PATH = "therapy_sessions.db"
+
+# Извлечение инсайтов в фоне: ответ возвращается сразу после специалиста,
+# а MemoryAgent и запись инсайтов выполняются в ограниченной очереди
+BACKGROUND_MEMORY = os.getenv("BACKGROUND_MEMORY", "false").lower() in ("1", "true", "yes")
+MEMORY_QUEUE_SIZE = int(os.getenv("MEMORY_QUEUE_SIZE", "100"))
+MEMORY_WORKERS = int(os.getenv("MEMORY_WORKERS", "2"))
+
+# Спекулятивная маршрутизация: специалист стартует, как только роутер
+# выдал поле "approach", параллельно с генерацией остального JSON
+SPECULATIVE_ROUTING = os.getenv("SPECULATIVE_ROUTING", "false").lower() in ("1", "true", "yes")
+# Потоки для роутера и специалиста: по два на ход, лишние ходы ждут в очереди
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "16"))
+
+# Локальный классификатор роутера: если модель обучена (python -m tools.train_router),
+# LLM-роутер вызывается только при уверенности ниже порога
+ROUTER_CLASSIFIER_PATH = os.getenv("ROUTER_CLASSIFIER_PATH", "router_classifier.json")
+ROUTER_CLASSIFIER_THRESHOLD = float(os.getenv("ROUTER_CLASSIFIER_THRESHOLD", "0.8"))
+
+# Кеш ответов LLM (LRU в памяти + SQLite). Включается поагентно:
+# ключи из router, dbt, ifs, tre, memory через запятую; пусто - выключен
+LLM_CACHE_AGENTS = [key.strip() for key in os.getenv("LLM_CACHE_AGENTS", "router,memory").split(",") if key.strip()]
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ITEMS = int(os.getenv("LLM_CACHE_MAX_ITEMS", "10000"))
+
+# Отложенная запись в SQLite: взаимодействия копятся в очереди и пишутся
+# пачками (каждые STORAGE_BATCH_SIZE записей или STORAGE_FLUSH_MS мс)
+STORAGE_WRITE_BEHIND = os.getenv("STORAGE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+STORAGE_BATCH_SIZE = int(os.getenv("STORAGE_BATCH_SIZE", "200"))
+STORAGE_FLUSH_MS = int(os.getenv("STORAGE_FLUSH_MS", "50"))
+STORAGE_QUEUE_SIZE = int(os.getenv("STORAGE_QUEUE_SIZE", "10000"))
+
+# Проверка нового промпта роутера в редакторе перед сохранением: последние
+# ROUTER_GATE_SAMPLES решений LLM-роутера из базы прогоняются через кандидата;
+# при согласии ниже ROUTER_GATE_MIN_AGREEMENT или сдвиге распределения подходов
+# больше ROUTER_GATE_MAX_SHIFT промпт не сохраняется
+ROUTER_GATE = os.getenv("ROUTER_GATE", "true").lower() in ("1", "true", "yes")
+ROUTER_GATE_SAMPLES = int(os.getenv("ROUTER_GATE_SAMPLES", "200"))
+ROUTER_GATE_WORKERS = int(os.getenv("ROUTER_GATE_WORKERS", "16"))
+ROUTER_GATE_MIN_AGREEMENT = float(os.getenv("ROUTER_GATE_MIN_AGREEMENT", "0.7"))
+ROUTER_GATE_MAX_SHIFT = float(os.getenv("ROUTER_GATE_MAX_SHIFT", "0.2"))
+
+# Замеры каждого хода (время узлов графа, вызовов LLM и хранилища, токены
+# и стоимость) в таблице metrics; отчет - python -m tools.metrics_report
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Где хранятся промпты: "sheets" - Google Sheets (в Streamlit) с односторонним
+# зеркалом в PROMPT_DB_PATH для процессов без Streamlit; "local" - только файл
+PROMPT_BACKEND = os.getenv("PROMPT_BACKEND", "sheets").lower()
+PROMPT_DB_PATH = os.getenv("PROMPT_DB_PATH", "prompts.db")
+PROMPT_LOCAL_MIRROR = os.getenv("PROMPT_LOCAL_MIRROR", "true").lower() in ("1", "true", "yes")
+# Как часто проверять версию локального файла промптов
+PROMPT_CHECK_SECONDS = float(os.getenv("PROMPT_CHECK_SECONDS", "1"))
+
+# Промпты из Google Sheets: снимок в памяти процесса обновляется в фоне раз
+# в PROMPT_REFRESH_SECONDS; после PROMPT_BREAKER_FAILURES ошибок (или ответов
+# дольше PROMPT_SLOW_SECONDS) обновления паузятся на PROMPT_BREAKER_COOLDOWN.
+# Чтение дольше PROMPT_READ_TIMEOUT считается зависшим: это ошибка, и следующее
+# обновление идет без него
+PROMPT_REFRESH_SECONDS = float(os.getenv("PROMPT_REFRESH_SECONDS", "300"))
+PROMPT_SLOW_SECONDS = float(os.getenv("PROMPT_SLOW_SECONDS", "5"))
+PROMPT_READ_TIMEOUT = float(os.getenv("PROMPT_READ_TIMEOUT", "30"))
+PROMPT_BREAKER_FAILURES = int(os.getenv("PROMPT_BREAKER_FAILURES", "3"))
+PROMPT_BREAKER_COOLDOWN = float(os.getenv("PROMPT_BREAKER_COOLDOWN", "60"))
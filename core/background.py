@@ -0,0 +1,90 @@
+"""Ограниченная фоновая очередь задач вне критического пути ответа."""
+
+import atexit
+import queue
+import threading
+from typing import Callable, Dict, List
+
+_STOP = object()
+
+
+class BackgroundWorker:
+    """Пул потоков с ограниченной очередью, счетчиками и корректной остановкой"""
+
+    def __init__(self, name: str = "background", maxsize: int = 100, workers: int = 1):
+        self.name = name
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self._threads: List[threading.Thread] = []
+
+        for index in range(max(1, workers)):
+            thread = threading.Thread(
+                target=self._run, name=f"{name}-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+        atexit.register(self.shutdown)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> bool:
+        """Поставить задачу в очередь. False, если очередь заполнена или закрыта."""
+
+        with self._lock:
+            if self._closed:
+                self._counters["rejected"] += 1
+                return False
+            try:
+                self._queue.put_nowait((fn, args, kwargs))
+            except queue.Full:
+                self._counters["rejected"] += 1
+                return False
+            self._counters["submitted"] += 1
+        return True
+
+    def join(self) -> None:
+        """Дождаться выполнения всех поставленных задач."""
+
+        self._queue.join()
+
+    def shutdown(self, timeout: float = 30.0) -> None:
+        """Перестать принимать задачи и дождаться опустошения очереди."""
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики для мониторинга очереди."""
+
+        with self._lock:
+            stats = dict(self._counters)
+        stats["pending"] = self._queue.qsize()
+        stats["capacity"] = self._queue.maxsize
+        return stats
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                fn, args, kwargs = item
+                try:
+                    fn(*args, **kwargs)
+                except Exception as e:
+                    print(f"Ошибка фоновой задачи {self.name}: {e}")
+                    with self._lock:
+                        self._counters["failed"] += 1
+                else:
+                    with self._lock:
+                        self._counters["completed"] += 1
+            finally:
+                self._queue.task_done()
@@ -1,42 +1,110 @@
+import asyncio
+import contextvars
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from langgraph.graph import StateGraph, END
 from agents import prompts as prompt_defaults
 from agents.specialists import (
-    RouterAgent, DBTAgent, IFSAgent, TREAgent, MemoryAgent,
-    TherapyState
+    BaseAgent, RouterAgent, DBTAgent, IFSAgent, TREAgent, MemoryAgent,
+    SummaryAgent, TherapyState
 )
 from langchain.schema import HumanMessage, AIMessage
-from typing import Dict, List
+from langchain_core.messages import AIMessageChunk
+from langchain_core.runnables import RunnableLambda
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from agents.cache import shared_cache
+from agents.classifier import LocalRouterClassifier
+from agents.context import RollingSummary
+from config import (
+    LLM_CACHE_AGENTS, LLM_CACHE_MAX_ITEMS, LLM_CACHE_PATH, LLM_CACHE_TTL,
+    ROUTER_CLASSIFIER_PATH, ROUTER_CLASSIFIER_THRESHOLD, SPECULATIVE_ROUTING, SPECULATIVE_WORKERS,
+)
+from core import metrics
+from core.streaming import StreamEvent
+
+# Узлы, чьи токены показываются пользователю при потоковой выдаче
+SPECIALIST_NODES = ("dbt", "ifs", "tre")
 
 class TherapyGraph:
     """Граф обработки сообщений через агентов"""
     
-    def __init__(self, prompt_store=None):
+    def __init__(self, prompt_store=None, inline_memory: bool = True, speculative_routing: bool = None):
         self.prompt_store = prompt_store
+        # inline_memory=False: граф завершается на специалисте,
+        # инсайты извлекает вызывающая сторона (например, в фоне)
+        self.inline_memory = inline_memory
+        # speculative_routing: специалист стартует, как только роутер
+        # выдал поле "approach", не дожидаясь остального JSON
+        if speculative_routing is None:
+            speculative_routing = SPECULATIVE_ROUTING
+        self.speculative_routing = speculative_routing
+        self._executor = (
+            ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+            if speculative_routing else None
+        )
         self._default_prompts = {
             "router": prompt_defaults.ROUTER_PROMPT,
             "dbt": prompt_defaults.DBT_PROMPT,
             "ifs": prompt_defaults.IFS_PROMPT,
             "tre": prompt_defaults.TRE_PROMPT,
             "memory": prompt_defaults.MEMORY_PROMPT,
+            "summary": prompt_defaults.SUMMARY_PROMPT,
         }
+        # Версия снимка PromptStore, из которого взяты текущие промпты
+        self._prompts_version = 0
         self._active_prompts = self._collect_prompts()
+        # Граф может быть общим для нескольких бесед (см. TherapyOrchestrator.fork)
+        self._prompt_lock = threading.Lock()
 
         # Инициализация агентов
-        self.router = RouterAgent(self._active_prompts["router"])
+        self.router = RouterAgent(
+            self._active_prompts["router"],
+            classifier=LocalRouterClassifier.load_if_exists(ROUTER_CLASSIFIER_PATH),
+            threshold=ROUTER_CLASSIFIER_THRESHOLD,
+        )
         self.dbt_agent = DBTAgent(self._active_prompts["dbt"])
         self.ifs_agent = IFSAgent(self._active_prompts["ifs"])
         self.tre_agent = TREAgent(self._active_prompts["tre"])
         self.memory_agent = MemoryAgent(self._active_prompts["memory"])
+        self.summary_agent = SummaryAgent(self._active_prompts["summary"])
+        self.specialists = {
+            "DBT": self.dbt_agent,
+            "IFS": self.ifs_agent,
+            "TRE": self.tre_agent,
+        }
+        self.agents = {
+            "router": self.router,
+            "dbt": self.dbt_agent,
+            "ifs": self.ifs_agent,
+            "tre": self.tre_agent,
+            "memory": self.memory_agent,
+            "summary": self.summary_agent,
+        }
+
+        # Кеш ответов только для агентов, явно перечисленных в конфиге
+        self.cache = None
+        if LLM_CACHE_AGENTS:
+            self.cache = shared_cache(
+                LLM_CACHE_PATH, max_disk_items=LLM_CACHE_MAX_ITEMS, ttl_seconds=LLM_CACHE_TTL
+            )
+            for key in LLM_CACHE_AGENTS:
+                if key in self.agents:
+                    self.agents[key].enable_cache(self.cache)
         
         # Построение графа
         self.workflow = StateGraph(TherapyState)
         
-        # Добавляем узлы
-        self.workflow.add_node("router", self.router.route)
-        self.workflow.add_node("dbt", self.dbt_agent.respond)
-        self.workflow.add_node("ifs", self.ifs_agent.respond)
-        self.workflow.add_node("tre", self.tre_agent.respond)
-        self.workflow.add_node("memory", self.memory_agent.extract)
+        # Добавляем узлы (sync-реализация для invoke, async - для ainvoke);
+        # время каждого узла попадает в замеры текущего хода (core.metrics)
+        self.workflow.add_node("router", self._node("router", self.router.route, self.router.aroute))
+        self.workflow.add_node("dbt", self._node("dbt", self.dbt_agent.respond, self.dbt_agent.arespond))
+        self.workflow.add_node("ifs", self._node("ifs", self.ifs_agent.respond, self.ifs_agent.arespond))
+        self.workflow.add_node("tre", self._node("tre", self.tre_agent.respond, self.tre_agent.arespond))
+        if inline_memory:
+            self.workflow.add_node("memory", self._node("memory", self.memory_agent.extract, self.memory_agent.aextract))
         
         # Устанавливаем точку входа
         self.workflow.set_entry_point("router")
@@ -52,17 +120,30 @@ class TherapyGraph:
             }
         )
         
-        # Все специалисты ведут к памяти
-        self.workflow.add_edge("dbt", "memory")
-        self.workflow.add_edge("ifs", "memory")
-        self.workflow.add_edge("tre", "memory")
-        
-        # Память ведет к концу
-        self.workflow.add_edge("memory", END)
+        if inline_memory:
+            # Все специалисты ведут к памяти
+            self.workflow.add_edge("dbt", "memory")
+            self.workflow.add_edge("ifs", "memory")
+            self.workflow.add_edge("tre", "memory")
+            
+            # Память ведет к концу
+            self.workflow.add_edge("memory", END)
+        else:
+            self.workflow.add_edge("dbt", END)
+            self.workflow.add_edge("ifs", END)
+            self.workflow.add_edge("tre", END)
         
         # Компилируем граф
         self.app = self.workflow.compile()
 
+        if prompt_store:
+            # Фоновое обновление снимка промптов сразу доходит до агентов
+            prompt_store.subscribe(lambda snapshot: self.refresh_prompts())
+
+    @staticmethod
+    def _node(name: str, func, afunc) -> RunnableLambda:
+        return RunnableLambda(metrics.timed_node(name, func), afunc=metrics.atimed_node(name, afunc))
+
     def route_to_specialist(self, state: TherapyState) -> str:
         """Определяет, к какому специалисту направить"""
         return state["current_approach"]
@@ -70,41 +151,364 @@ class TherapyGraph:
     def refresh_prompts(self) -> None:
         """Reload prompts from the store and update agent system prompts."""
 
-        self._active_prompts = self._collect_prompts()
-        self.router.set_system_prompt(self._active_prompts["router"])
-        self.dbt_agent.set_system_prompt(self._active_prompts["dbt"])
-        self.ifs_agent.set_system_prompt(self._active_prompts["ifs"])
-        self.tre_agent.set_system_prompt(self._active_prompts["tre"])
-        self.memory_agent.set_system_prompt(self._active_prompts["memory"])
+        prompts = self._collect_prompts()
+        # Одновременные обновления из разных бесед не перемешиваются;
+        # запросы в полете дочитывают промпт, с которым начали
+        with self._prompt_lock:
+            self._active_prompts = prompts
+            for key, agent in self.agents.items():
+                if agent.system_prompt != prompts[key]:
+                    agent.set_system_prompt(prompts[key])
+
+    def llm_settings(self) -> Dict[str, Dict]:
+        """Модель и параметры, с которыми фактически работает каждый агент."""
+
+        return {
+            key: {
+                "model": getattr(agent.llm, "model", None),
+                "temperature": getattr(agent.llm, "temperature", None),
+                "max_tokens": getattr(agent.llm, "max_tokens", None),
+            }
+            for key, agent in self.agents.items()
+        }
+
+    def cache_stats(self) -> Dict:
+        """Счетчики попаданий/промахов кеша ответов (пусто, если кеш выключен)."""
+
+        return self.cache.stats() if self.cache else {}
 
-    def process_message(self, user_message: str, messages: List = None) -> Dict:
+    def parse_stats(self) -> Dict[str, Dict[str, int]]:
+        """Исходы разбора JSON-ответов роутера и агента памяти."""
+
+        return {
+            "router": self.router.parse_counter.snapshot(),
+            "memory": self.memory_agent.parse_counter.snapshot(),
+        }
+
+    def close(self) -> None:
+        """Остановить пул спекулятивной маршрутизации: идущие ходы
+        дорабатывают, еще не начатые задачи отменяются."""
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def fold_summary(self, summary: RollingSummary, messages: List) -> RollingSummary:
+        """Свернуть в сводку ходы, не влезающие в бюджет специалистов.
+
+        Каждый ход - отдельный вызов SummaryAgent поверх прежней сводки;
+        история целиком заново не пересказывается.
+        """
+
+        budget = self._summary_budget()
+        while True:
+            turn = summary.next_turn(messages, budget)
+            if turn is None:
+                return summary
+            with metrics.timed("summary"):
+                text = self.summary_agent.fold(summary.text, turn)
+            if text is None:
+                return summary
+            summary = summary.folded(text, len(turn))
+
+    async def afold_summary(self, summary: RollingSummary, messages: List) -> RollingSummary:
+        """Асинхронная версия fold_summary"""
+
+        budget = self._summary_budget()
+        while True:
+            turn = summary.next_turn(messages, budget)
+            if turn is None:
+                return summary
+            with metrics.timed("summary"):
+                text = await self.summary_agent.afold(summary.text, turn)
+            if text is None:
+                return summary
+            summary = summary.folded(text, len(turn))
+
+    def process_message(self, user_message: str, messages: List = None, summary: RollingSummary = None) -> Dict:
         """Обрабатывает сообщение пользователя через граф"""
         
+        self._check_prompts()
+        if self.speculative_routing:
+            return self._last_result(self._speculative_events(user_message, messages, summary))
+
+        # Запускаем граф
+        result = self.app.invoke(self._initial_state(user_message, messages, summary))
+        return self._finalize(result, user_message)
+
+    async def aprocess_message(
+        self, user_message: str, messages: List = None, summary: RollingSummary = None
+    ) -> Dict:
+        """Асинхронно обрабатывает сообщение пользователя через граф"""
+
+        self._check_prompts()
+        if self.speculative_routing:
+            result = None
+            async for kind, payload in self._aspeculative_events(user_message, messages, summary):
+                if kind == "result":
+                    result = payload
+            return result
+
+        result = await self.app.ainvoke(self._initial_state(user_message, messages, summary))
+        return self._finalize(result, user_message)
+
+    def stream_message(
+        self, user_message: str, messages: List = None, summary: RollingSummary = None
+    ) -> Iterator[StreamEvent]:
+        """Запускает граф, отдавая токены специалиста по мере генерации.
+
+        Выдает ("token", str) для каждого чанка и ("result", dict) в конце.
+        """
+
+        self._check_prompts()
+        if self.speculative_routing:
+            yield from self._speculative_events(user_message, messages, summary)
+            return
+
+        final = None
+        streamed = False
+        for mode, payload in self.app.stream(
+            self._initial_state(user_message, messages, summary),
+            stream_mode=["messages", "values"],
+        ):
+            if mode == "values":
+                final = payload
+                continue
+            token = self._specialist_token(payload)
+            if token:
+                streamed = True
+                yield "token", token
+
+        # Модель не стримила (например, ошибка) - отдаем ответ целиком
+        if not streamed and final.get("specialist_response"):
+            yield "token", final["specialist_response"]
+        yield "result", self._finalize(final, user_message)
+
+    async def astream_message(
+        self, user_message: str, messages: List = None, summary: RollingSummary = None
+    ) -> AsyncIterator[StreamEvent]:
+        """Асинхронная версия stream_message"""
+
+        self._check_prompts()
+        if self.speculative_routing:
+            async for event in self._aspeculative_events(user_message, messages, summary):
+                yield event
+            return
+
+        final = None
+        streamed = False
+        async for mode, payload in self.app.astream(
+            self._initial_state(user_message, messages, summary),
+            stream_mode=["messages", "values"],
+        ):
+            if mode == "values":
+                final = payload
+                continue
+            token = self._specialist_token(payload)
+            if token:
+                streamed = True
+                yield "token", token
+
+        if not streamed and final.get("specialist_response"):
+            yield "token", final["specialist_response"]
+        yield "result", self._finalize(final, user_message)
+
+    # ------------------------------------------------------------------
+    # Speculative routing
+    # ------------------------------------------------------------------
+    # Условный переход LangGraph срабатывает только после завершения узла
+    # роутера, поэтому здесь те же агенты запускаются вне скомпилированного
+    # графа: роутер стримится, и специалист стартует на первом же "approach".
+
+    def _speculative_events(
+        self, user_message: str, messages: List = None, summary: RollingSummary = None
+    ) -> Iterator[StreamEvent]:
+        state = self._initial_state(user_message, messages, summary)
+        context, summary_text = BaseAgent._state_context(state)
+        events: "queue.Queue" = queue.Queue()
+        # Потребитель бросил поток (закрыл генератор) - потоки пула
+        # перестают читать ответы LLM, а не дописывают их в пустоту
+        stop = threading.Event()
+
+        def run_router():
+            try:
+                with metrics.timed("router"):
+                    for update in self.router.stream_route(user_message, context, summary_text):
+                        if stop.is_set():
+                            break
+                        events.put(("route", update))
+            finally:
+                events.put(("router_done", None))
+
+        def run_specialist(approach: str):
+            chunks = []
+            try:
+                with metrics.timed(approach.lower()):
+                    for chunk in self.specialists[approach].stream(user_message, context, summary_text):
+                        if stop.is_set():
+                            break
+                        chunks.append(chunk)
+                        events.put(("token", chunk))
+            finally:
+                events.put(("specialist_done", "".join(chunks)))
+
+        # Потоки пула не наследуют contextvars - передаем замеры хода явно
+        futures = [self._executor.submit(contextvars.copy_context().run, run_router)]
+        specialist_started = router_done = specialist_done = False
+        try:
+            while not (router_done and specialist_done):
+                kind, payload = events.get()
+                if kind == "route":
+                    state.update(payload)
+                elif kind == "router_done":
+                    router_done = True
+                elif kind == "token":
+                    yield kind, payload
+                elif kind == "specialist_done":
+                    state["specialist_response"] = payload
+                    specialist_done = True
+
+                if not specialist_started and (router_done or state["current_approach"]):
+                    specialist_started = True
+                    futures.append(self._executor.submit(
+                        contextvars.copy_context().run, run_specialist, state["current_approach"] or "DBT"
+                    ))
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+
+        if self.inline_memory:
+            with metrics.timed("memory"):
+                state.update(self.memory_agent.extract(state))
+        yield "result", self._finalize(state, user_message)
+
+    async def _aspeculative_events(
+        self, user_message: str, messages: List = None, summary: RollingSummary = None
+    ) -> AsyncIterator[StreamEvent]:
+        state = self._initial_state(user_message, messages, summary)
+        context, summary_text = BaseAgent._state_context(state)
+        events: "asyncio.Queue" = asyncio.Queue()
+
+        async def run_router():
+            try:
+                with metrics.timed("router"):
+                    async for update in self.router.astream_route(user_message, context, summary_text):
+                        await events.put(("route", update))
+            finally:
+                await events.put(("router_done", None))
+
+        async def run_specialist(approach: str):
+            chunks = []
+            try:
+                with metrics.timed(approach.lower()):
+                    async for chunk in self.specialists[approach].astream(user_message, context, summary_text):
+                        chunks.append(chunk)
+                        await events.put(("token", chunk))
+            finally:
+                await events.put(("specialist_done", "".join(chunks)))
+
+        tasks = [asyncio.create_task(run_router())]
+        specialist_started = router_done = specialist_done = False
+        try:
+            while not (router_done and specialist_done):
+                kind, payload = await events.get()
+                if kind == "route":
+                    state.update(payload)
+                elif kind == "router_done":
+                    router_done = True
+                elif kind == "token":
+                    yield kind, payload
+                elif kind == "specialist_done":
+                    state["specialist_response"] = payload
+                    specialist_done = True
+
+                if not specialist_started and (router_done or state["current_approach"]):
+                    specialist_started = True
+                    tasks.append(asyncio.create_task(run_specialist(state["current_approach"] or "DBT")))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if self.inline_memory:
+            with metrics.timed("memory"):
+                state.update(await self.memory_agent.aextract(state))
+        yield "result", self._finalize(state, user_message)
+
+    @staticmethod
+    def _last_result(events: Iterator[StreamEvent]) -> Dict:
+        result = None
+        for kind, payload in events:
+            if kind == "result":
+                result = payload
+        return result
+
+    # ------------------------------------------------------------------
+    # Internal helpers
+    # ------------------------------------------------------------------
+    def _check_prompts(self) -> None:
+        # Дешевая проверка (сравнение времени или версии файла): если снимок
+        # устарел, хранилище обновит его и через подписку вызовет refresh_prompts.
+        # Версия, сменившаяся до подписки (фоновый прогрев при старте), никого
+        # не уведомит - ее догоняем по номеру примененного снимка
+        if self.prompt_store:
+            snapshot = self.prompt_store.snapshot()
+            if snapshot.version != self._prompts_version:
+                self.refresh_prompts()
+
+    def max_context_tokens(self) -> int:
+        """Наибольший бюджет контекста среди агентов."""
+
+        return max(agent.context_tokens for agent in self.agents.values())
+
+    def _summary_budget(self) -> int:
+        # Сворачиваем, только когда история перестает влезать целиком
+        # в бюджет хотя бы одного специалиста
+        return min(agent.context_tokens for agent in self.specialists.values())
+
+    @staticmethod
+    def _initial_state(user_message: str, messages: List = None, summary: Optional[RollingSummary] = None) -> Dict:
         # Подготавливаем начальное состояние
-        initial_state = {
+        summary = summary or RollingSummary()
+        return {
             "messages": messages or [],
+            "summary": summary.text,
+            "summary_covered": summary.covered,
             "user_message": user_message,
             "current_approach": None,
             "confidence": 0,
             "reasoning": "",
             "insights": {},
             "session_id": None,
-            "specialist_response": ""
+            "specialist_response": "",
+            "route_source": None,
         }
-        
-        # Запускаем граф
-        result = self.app.invoke(initial_state)
 
-        # Добавляем сообщения в историю
-        result["messages"].append(HumanMessage(content=user_message))
-        result["messages"].append(AIMessage(content=result["specialist_response"]))
+    @staticmethod
+    def _specialist_token(payload) -> str:
+        chunk, metadata = payload
+        # Роутер и память тоже стримят JSON - пропускаем их, как и готовые
+        # сообщения истории, которые граф отдает целиком
+        if metadata.get("langgraph_node") not in SPECIALIST_NODES:
+            return ""
+        if not isinstance(chunk, AIMessageChunk):
+            return ""
+        return BaseAgent._normalize_content(chunk.content)
+
+    @staticmethod
+    def _finalize(result: Dict, user_message: str) -> Dict:
+        # Добавляем сообщения в историю новым списком, не меняя переданный
+        result["messages"] = [
+            *result["messages"],
+            HumanMessage(content=user_message),
+            AIMessage(content=result["specialist_response"]),
+        ]
 
         return result
 
-    # ------------------------------------------------------------------
-    # Internal helpers
-    # ------------------------------------------------------------------
     def _collect_prompts(self) -> Dict[str, str]:
         if self.prompt_store:
+            # Версию запоминаем до чтения: снимок, пришедший между ними,
+            # просто вызовет еще одно обновление
+            self._prompts_version = self.prompt_store.snapshot().version
             return self.prompt_store.get_all(self._default_prompts)
         return dict(self._default_prompts)
@@ -0,0 +1,291 @@
+"""Замеры хода беседы: узлы графа, вызовы LLM и обращения к хранилищу.
+
+Агенты и хранилище общие для всех бесед процесса (см.
+TherapyOrchestrator.fork), поэтому замеры пишутся не в сами объекты,
+а в TurnMetrics текущего хода через contextvar. Оркестратор открывает
+ход, а в конце сохраняет записи в таблицу metrics по (session_id, turn).
+Вне открытого хода все функции модуля ничего не делают.
+"""
+
+import contextvars
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Виды записей: весь ход, узел графа, вызов LLM, ответ из кеша,
+# ожидание в очереди к LLM (agents/scheduler.py), хранилище
+KINDS = ("turn", "node", "llm", "cache", "queue", "storage")
+
+Usage = Tuple[Optional[int], Optional[int]]
+
+
+@dataclass
+class MetricRecord:
+    node: str
+    kind: str
+    duration_ms: float
+    model: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cost: Optional[float] = None
+
+
+class TurnMetrics:
+    """Записи одного хода; пополняется из нескольких потоков"""
+
+    def __init__(self):
+        self.records: List[MetricRecord] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: MetricRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def drain(self) -> List[MetricRecord]:
+        """Забрать накопленные записи."""
+
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+
+_current: "contextvars.ContextVar[Optional[TurnMetrics]]" = contextvars.ContextVar("turn_metrics", default=None)
+
+
+def current() -> Optional[TurnMetrics]:
+    return _current.get()
+
+
+@contextmanager
+def collect(metrics: TurnMetrics):
+    """Писать замеры этого контекста (и порожденных им задач) в metrics."""
+
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Генератор закрыли из другого контекста - там нашего значения нет
+            pass
+
+
+def collect_steps(metrics: Optional[TurnMetrics], iterable: Iterable) -> Iterator:
+    """Итерировать iterable, открывая ход metrics только на время каждого шага.
+
+    collect вокруг цикла с yield держал бы contextvar установленным, пока
+    генератор стоит на паузе, и в ход попадали бы замеры кода потребителя
+    (или другой беседы в том же потоке).
+    """
+
+    iterator = iter(iterable)
+    while True:
+        token = _current.set(metrics)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _current.reset(token)
+        yield item
+
+
+async def acollect_steps(metrics: Optional[TurnMetrics], iterable: AsyncIterable) -> AsyncIterator:
+    """Асинхронная версия collect_steps"""
+
+    iterator = iterable.__aiter__()
+    while True:
+        token = _current.set(metrics)
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            _current.reset(token)
+        yield item
+
+
+@contextmanager
+def timed(node: str, kind: str = "node"):
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(MetricRecord(node, kind, (time.perf_counter() - started) * 1000))
+
+
+def timed_node(node: str, func: Callable) -> Callable:
+    """Обертка узла графа с замером времени."""
+
+    @functools.wraps(func)
+    def wrapper(state):
+        with timed(node):
+            return func(state)
+
+    return wrapper
+
+
+def atimed_node(node: str, afunc: Callable) -> Callable:
+    @functools.wraps(afunc)
+    async def wrapper(state):
+        with timed(node):
+            return await afunc(state)
+
+    return wrapper
+
+
+def timed_storage(method: Callable) -> Callable:
+    """Декоратор метода MemoryStorage: запись storage.<имя метода>."""
+
+    node = f"storage.{method.__name__}"
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if _current.get() is None:
+            return method(*args, **kwargs)
+        with timed(node, "storage"):
+            return method(*args, **kwargs)
+
+    return wrapper
+
+
+def usage_from(response: Any) -> Usage:
+    """(prompt_tokens, completion_tokens) из ответа или чанка LangChain.
+
+    Сначала usage_metadata, затем token_usage/usage в response_metadata,
+    куда их кладет ChatLiteLLM; None, если провайдер их не вернул.
+    """
+
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    meta = getattr(response, "response_metadata", None) or {}
+    usage = meta.get("token_usage") or meta.get("usage")
+    if usage:
+        if not isinstance(usage, dict):
+            usage = getattr(usage, "__dict__", {})
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    return None, None
+
+
+def add_usage(total: Usage, chunk: Any) -> Usage:
+    """Сложить usage чанка потока с уже накопленным."""
+
+    prompt, completion = usage_from(chunk)
+    if prompt is None and completion is None:
+        return total
+    return (total[0] or 0) + (prompt or 0), (total[1] or 0) + (completion or 0)
+
+
+def llm_cost(model: Optional[str], usage: Usage) -> Optional[float]:
+    """Стоимость вызова по прайсу LiteLLM; None, если модели в нем нет."""
+
+    prompt, completion = usage
+    if not model or prompt is None:
+        return None
+    try:
+        # Импорт тяжелый (прайс моделей), а отчетам и хранилищу он не нужен
+        import litellm
+
+        prompt_cost, completion_cost = litellm.cost_per_token(
+            model=model, prompt_tokens=prompt, completion_tokens=completion or 0
+        )
+    except Exception:
+        return None
+    return prompt_cost + completion_cost
+
+
+def record_llm(node: str, model: Optional[str], started: float, usage: Usage = (None, None)) -> None:
+    """Записать вызов LLM, начатый в started (time.perf_counter())."""
+
+    metrics = _current.get()
+    if metrics is None:
+        return
+    metrics.add(MetricRecord(
+        node,
+        "llm",
+        (time.perf_counter() - started) * 1000,
+        model=model,
+        prompt_tokens=usage[0],
+        completion_tokens=usage[1],
+        cost=llm_cost(model, usage),
+    ))
+
+
+def record_cache_hit(node: str, started: float) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(MetricRecord(node, "cache", (time.perf_counter() - started) * 1000))
+
+
+def record_wait(node: str, duration_ms: float) -> None:
+    """Записать ожидание запроса node в очереди планировщика LLM."""
+
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(MetricRecord(node, "queue", duration_ms))
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Перцентиль q (0..100) с линейной интерполяцией."""
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low, high = math.floor(position), math.ceil(position)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def node_stats(records: Iterable[Dict]) -> List[Dict]:
+    """p50/p95 и среднее по каждому узлу из строк MemoryStorage.get_metrics."""
+
+    groups: Dict[Tuple[str, str], List[float]] = {}
+    for record in records:
+        groups.setdefault((record["kind"], record["node"]), []).append(record["duration_ms"])
+
+    order = {kind: index for index, kind in enumerate(KINDS)}
+    return [
+        {
+            "kind": kind,
+            "node": node,
+            "count": len(values),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "mean_ms": sum(values) / len(values),
+        }
+        for (kind, node), values in sorted(groups.items(), key=lambda item: (order.get(item[0][0], 99), item[0][1]))
+    ]
+
+
+__all__ = [
+    "KINDS",
+    "MetricRecord",
+    "TurnMetrics",
+    "Usage",
+    "acollect_steps",
+    "add_usage",
+    "atimed_node",
+    "collect",
+    "collect_steps",
+    "current",
+    "llm_cost",
+    "node_stats",
+    "percentile",
+    "record_cache_hit",
+    "record_llm",
+    "record_wait",
+    "timed",
+    "timed_node",
+    "timed_storage",
+    "usage_from",
+]
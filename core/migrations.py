@@ -0,0 +1,148 @@
+"""Версионированная схема MemoryStorage.
+
+Каждая миграция - (версия, описание, список SQL). Применяются по
+возрастанию версии при открытии хранилища; примененные версии записаны
+в таблице schema_version. Новые изменения схемы добавляются только
+новой миграцией в конец списка.
+"""
+
+import sqlite3
+from typing import List, Tuple
+
+Migration = Tuple[int, str, List[str]]
+
+MIGRATIONS: List[Migration] = [
+    (1, "Базовые таблицы sessions, messages, insights", [
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER,
+            role TEXT,
+            content TEXT,
+            approach TEXT,
+            confidence REAL,
+            reasoning TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS insights (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER,
+            insight TEXT,
+            type TEXT,  -- 'insight', 'pattern', 'trigger', 'resource'
+            approach TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+        """,
+    ]),
+    (2, "Индексы для выборок по сессии и пользователю", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_created ON messages(session_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_insights_session_created ON insights(session_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_user_created ON sessions(user_id, created_at)",
+    ]),
+    (3, "Индексы для постраничного чтения по id", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(session_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_insights_session_id ON insights(session_id, id)",
+    ]),
+    (4, "Скользящая сводка сессии", [
+        "ALTER TABLE sessions ADD COLUMN summary TEXT",
+        # id последнего сообщения, свернутого в summary
+        "ALTER TABLE sessions ADD COLUMN summary_until_id INTEGER",
+    ]),
+    (5, "Замеры времени, токенов и стоимости по ходам", [
+        """
+        CREATE TABLE IF NOT EXISTS metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER,
+            turn INTEGER,
+            node TEXT,
+            kind TEXT,  -- 'turn', 'node', 'llm', 'cache', 'storage'
+            duration_ms REAL,
+            model TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            cost REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_metrics_session_turn ON metrics(session_id, turn)",
+    ]),
+    (6, "Секретный токен для продолжения сессии по ссылке", [
+        # У старых сессий токена нет - по ссылке они не продолжаются
+        "ALTER TABLE sessions ADD COLUMN resume_token TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_resume_token ON sessions(resume_token)",
+    ]),
+    (7, "Источник решения роутера в ответах", [
+        # 'llm', 'classifier', 'partial' или 'default' (см. agents.base.ROUTE_*)
+        "ALTER TABLE messages ADD COLUMN route_source TEXT",
+        # Старые ответы размечаем по тексту reasoning, который ставил роутер
+        """
+        UPDATE messages SET route_source = CASE reasoning
+            WHEN 'Локальный классификатор' THEN 'classifier'
+            WHEN 'Использую DBT по умолчанию' THEN 'default'
+            ELSE 'llm'
+        END
+        WHERE role = 'assistant' AND approach IS NOT NULL
+        """,
+    ]),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы (0 для пустой базы)."""
+
+    row = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()
+    return row[0]
+
+
+def apply_migrations(conn: sqlite3.Connection, migrations: List[Migration] = MIGRATIONS) -> int:
+    """Применить недостающие миграции и вернуть итоговую версию.
+
+    Каждая миграция выполняется в BEGIN IMMEDIATE, а версия перепроверяется
+    внутри транзакции, поэтому одновременный запуск нескольких процессов
+    безопасен: миграцию применит только первый.
+    """
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+    for version, description, statements in migrations:
+        if version <= schema_version(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return schema_version(conn)
+
+
+__all__ = ["MIGRATIONS", "apply_migrations", "schema_version"]
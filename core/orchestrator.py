@@ -1,58 +1,376 @@
+import asyncio
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from agents.context import MESSAGE_OVERHEAD, RollingSummary, pack_context
+from core import metrics
+from core.background import BackgroundWorker
 from core.graph import TherapyGraph
+from core.router_regression import RouterRegression
 from core.storage import MemoryStorage
+from core.streaming import AsyncResponseStream, ResponseStream
 from langchain.schema import BaseMessage, HumanMessage, AIMessage
-from typing import List, Dict, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
 
+from config import (
+    BACKGROUND_MEMORY, CONTEXT_SUMMARY, LLM_CACHE_MAX_ITEMS, LLM_CACHE_PATH, LLM_CACHE_TTL,
+    MEMORY_QUEUE_SIZE, MEMORY_WORKERS, METRICS_ENABLED, ROUTER_GATE, ROUTER_GATE_MAX_SHIFT,
+    ROUTER_GATE_MIN_AGREEMENT, ROUTER_GATE_SAMPLES, ROUTER_GATE_WORKERS,
+    STORAGE_BATCH_SIZE, STORAGE_FLUSH_MS, STORAGE_QUEUE_SIZE, STORAGE_WRITE_BEHIND,
+)
 from services.prompt_store import PromptStore
 
 class TherapyOrchestrator:
     """Главный оркестратор системы"""
     
-    def __init__(self, use_memory: bool = True, prompt_store: Optional[PromptStore] = None):
+    def __init__(
+        self,
+        use_memory: bool = True,
+        prompt_store: Optional[PromptStore] = None,
+        background_memory: Optional[bool] = None,
+        storage: Optional[MemoryStorage] = None,
+        engine: Optional["TherapyOrchestrator"] = None,
+    ):
+        """engine - оркестратор, чьи граф, хранилище и очереди переиспользуются
+        (см. fork); остальные аргументы тогда не учитываются."""
+        if engine is not None:
+            self._share(engine)
+            self._reset_conversation()
+            return
+
+        if background_memory is None:
+            background_memory = BACKGROUND_MEMORY
+        # Без хранилища фоновые инсайты некуда сохранить - оставляем их в графе
+        background_memory = background_memory and use_memory
+
         self.prompt_store = prompt_store or PromptStore()
-        self.graph = TherapyGraph(prompt_store=self.prompt_store)
-        self.storage = MemoryStorage() if use_memory else None
+        self.graph = TherapyGraph(prompt_store=self.prompt_store, inline_memory=not background_memory)
+        # storage позволяет передать уже настроенное хранилище (другой путь
+        # к базе, обертка для замеров); иначе создается по настройкам из config
+        self.storage = None
+        if use_memory and storage is not None:
+            self.storage = storage
+        elif use_memory:
+            self.storage = MemoryStorage(
+                write_behind=STORAGE_WRITE_BEHIND,
+                batch_size=STORAGE_BATCH_SIZE,
+                flush_interval_ms=STORAGE_FLUSH_MS,
+                max_queue=STORAGE_QUEUE_SIZE,
+            )
+        self.memory_worker: Optional[BackgroundWorker] = None
+        if background_memory:
+            self.memory_worker = BackgroundWorker(
+                "memory", maxsize=MEMORY_QUEUE_SIZE, workers=MEMORY_WORKERS
+            )
+        # Сводка сворачивается вне хода, даже при встроенной памяти: ответ
+        # не ждет SummaryAgent, сводка отстает максимум на ход. При полной
+        # очереди ход сворачивает сам (см. _schedule_summary)
+        self.summary_worker: Optional[BackgroundWorker] = None
+        if CONTEXT_SUMMARY:
+            self.summary_worker = BackgroundWorker("summary", maxsize=MEMORY_QUEUE_SIZE)
+        # Регрессия роутера по сохраненным решениям - нужна база. Запускает
+        # ее только редактор промптов; кеш ответов открывается при первом
+        # прогоне, если кеш графа выключен
+        self.router_regression: Optional[RouterRegression] = None
+        if self.storage and ROUTER_GATE:
+            self.router_regression = RouterRegression(
+                self.storage,
+                cache=self.graph.cache,
+                cache_path=LLM_CACHE_PATH,
+                cache_options={"max_disk_items": LLM_CACHE_MAX_ITEMS, "ttl_seconds": LLM_CACHE_TTL},
+                samples=ROUTER_GATE_SAMPLES,
+                workers=ROUTER_GATE_WORKERS,
+                min_agreement=ROUTER_GATE_MIN_AGREEMENT,
+                max_shift=ROUTER_GATE_MAX_SHIFT,
+            )
+        # Граф, хранилище и очередь принадлежат этому экземпляру;
+        # у копий из fork() они общие, и close() их не трогает
+        self._owns_resources = True
+        self._reset_conversation()
+
+    def fork(self) -> "TherapyOrchestrator":
+        """Оркестратор для отдельной беседы на тех же графе, хранилище и очереди.
+
+        Тяжелые объекты (скомпилированный граф, клиенты LLM, соединения
+        с базой) создаются один раз на процесс, а у каждой беседы свои
+        только история, сводка и номер сессии.
+        """
+        return TherapyOrchestrator(engine=self)
+
+    def _share(self, engine: "TherapyOrchestrator") -> None:
+        # Общие ресурсы процесса; закрывает их только engine
+        self.prompt_store = engine.prompt_store
+        self.graph = engine.graph
+        self.storage = engine.storage
+        self.memory_worker = engine.memory_worker
+        self.summary_worker = engine.summary_worker
+        self.router_regression = engine.router_regression
+        self._owns_resources = False
+
+    def _reset_conversation(self) -> None:
         self.session_id: Optional[int] = None
         self.messages: List[BaseMessage] = []
+        # Сводка старых ходов; заменяется целиком, см. _fold_summary
+        self.summary = RollingSummary()
+        self._summary_lock = threading.Lock()
+        # id сообщения в базе, после которого начинается self.messages
+        self._history_base_id = 0
+        # Номер хода в сессии - ключ замеров в таблице metrics
+        self.turn = 0
         self.user_id = "default"
+        # Секрет для продолжения сессии по ссылке (см. resume_by_token)
+        self.resume_token: Optional[str] = None
     
     def start_session(self, user_id: str = "default") -> Optional[int]:
         """Начать новую сессию"""
         self.user_id = user_id
         self.messages = []
+        self.summary = RollingSummary()
+        self._history_base_id = 0
+        self.turn = 0
+        self.resume_token = secrets.token_urlsafe(24)
         
         if self.storage:
-            self.session_id = self.storage.create_session(user_id)
+            self.session_id = self.storage.create_session(user_id, self.resume_token)
         
         return self.session_id
+
+    def resume_session(self, session_id: int) -> Optional[int]:
+        """Продолжить сохраненную сессию.
+
+        Контекст восстанавливается одним запросом: сводка плюс хвост
+        несвернутых сообщений, который влезает в бюджет агентов. Вернет
+        None, если хранилище выключено или сессии нет. id не проверяет
+        владельца - для ссылок от пользователя есть resume_by_token.
+        """
+        if not self.storage:
+            return None
+
+        # Каждое сообщение стоит не меньше MESSAGE_OVERHEAD токенов,
+        # поэтому больше строк в бюджет заведомо не влезет. Со сводкой
+        # читаются все несвернутые: их еще нужно в нее свернуть
+        budget = self.graph.max_context_tokens()
+        limit = None if self.summary_worker else budget // MESSAGE_OVERHEAD + 1
+        context = self.storage.load_session_context(session_id, limit)
+        if context is None:
+            return None
+
+        self._hydrate(session_id, context, budget)
+        if not self._schedule_summary():
+            self._fold_summary()
+        return self.session_id
+
+    async def astart_session(self, user_id: str = "default") -> Optional[int]:
+        """Асинхронно начать новую сессию"""
+        self.user_id = user_id
+        self.messages = []
+        self.summary = RollingSummary()
+        self._history_base_id = 0
+        self.turn = 0
+        self.resume_token = secrets.token_urlsafe(24)
+
+        if self.storage:
+            self.session_id = await self.storage.acreate_session(user_id, self.resume_token)
+
+        return self.session_id
+
+    def resume_by_token(self, resume_token: str) -> Optional[int]:
+        """Продолжить сессию по секретному токену из ссылки.
+
+        Последовательный id сессии легко подобрать, поэтому снаружи
+        сессия открывается только по токену, выданному в start_session.
+        """
+        if not self.storage:
+            return None
+        session_id = self.storage.find_session_by_token(resume_token)
+        if session_id is None:
+            return None
+        return self.resume_session(session_id)
+
+    async def aresume_session(self, session_id: int) -> Optional[int]:
+        """Асинхронная версия resume_session"""
+        return await asyncio.to_thread(self.resume_session, session_id)
+
+    async def aresume_by_token(self, resume_token: str) -> Optional[int]:
+        """Асинхронная версия resume_by_token"""
+        return await asyncio.to_thread(self.resume_by_token, resume_token)
+
+    def _hydrate(self, session_id: int, context: Dict, budget: int) -> None:
+        rows = context["messages"]
+        history = [
+            HumanMessage(content=row["content"]) if row["role"] == "user" else AIMessage(content=row["content"])
+            for row in rows
+        ]
+        if self.summary_worker:
+            # Несвернутые сообщения остаются в истории, пока _fold_summary
+            # их не свернет; агенты сами берут из нее то, что влезает в бюджет
+            self.messages = history
+            self._history_base_id = context["summary_until_id"]
+        else:
+            self.messages = pack_context(history, budget)
+            # Без сводки сообщения, не влезшие в бюджет, в контекст уже не
+            # попадут: граница истории - перед первым оставленным
+            dropped = len(rows) - len(self.messages)
+            if rows and dropped < len(rows):
+                self._history_base_id = rows[dropped]["id"] - 1
+            else:
+                self._history_base_id = context["summary_until_id"]
+        self.summary = RollingSummary(context["summary"])
+        self.session_id = session_id
+        self.user_id = context["user_id"]
+        self.resume_token = context["resume_token"]
+        self.turn = self.storage.last_metrics_turn(session_id)
     
     def process_message(self, user_message: str) -> Dict:
         """Обработать сообщение через граф агентов"""
         
-        # Обрабатываем через граф
-        result = self.graph.process_message(user_message, self.messages)
-        
+        with self._measure_turn() as turn_metrics:
+            # Обрабатываем через граф
+            result = self.graph.process_message(user_message, self.messages, self.summary)
+            response = self._complete_turn(result)
+        self._save_metrics(self.session_id, self.turn, turn_metrics)
+        return response
+
+    async def aprocess_message(self, user_message: str) -> Dict:
+        """Асинхронно обработать сообщение через граф агентов"""
+
+        with self._measure_turn() as turn_metrics:
+            result = await self.graph.aprocess_message(user_message, self.messages, self.summary)
+            response = await self._acomplete_turn(result)
+        await asyncio.to_thread(self._save_metrics, self.session_id, self.turn, turn_metrics)
+        return response
+
+    def stream_message(self, user_message: str) -> ResponseStream:
+        """Обработать сообщение, отдавая ответ специалиста по чанкам.
+
+        Итерация по результату дает строки; после завершения в ``.result``
+        лежит тот же словарь, что возвращает process_message.
+        """
+
+        return ResponseStream(self._stream_events(user_message))
+
+    def astream_message(self, user_message: str) -> AsyncResponseStream:
+        """Асинхронная версия stream_message"""
+
+        return AsyncResponseStream(self._astream_events(user_message))
+
+    def _stream_events(self, user_message: str):
+        # Ход открыт только внутри шагов графа: между yield управление
+        # у потребителя, и его код в замеры хода попадать не должен.
+        # Итоговый результат отдаем после записи замеров хода
+        result = None
+        with self._measure_turn(collect=False) as turn_metrics:
+            events = self.graph.stream_message(user_message, self.messages, self.summary)
+            for kind, payload in metrics.collect_steps(turn_metrics, events):
+                if kind == "result":
+                    with metrics.collect(turn_metrics):
+                        result = self._complete_turn(payload)
+                else:
+                    yield kind, payload
+        self._save_metrics(self.session_id, self.turn, turn_metrics)
+        yield "result", result
+
+    async def _astream_events(self, user_message: str):
+        result = None
+        with self._measure_turn(collect=False) as turn_metrics:
+            events = self.graph.astream_message(user_message, self.messages, self.summary)
+            async for kind, payload in metrics.acollect_steps(turn_metrics, events):
+                if kind == "result":
+                    with metrics.collect(turn_metrics):
+                        result = await self._acomplete_turn(payload)
+                else:
+                    yield kind, payload
+        await asyncio.to_thread(self._save_metrics, self.session_id, self.turn, turn_metrics)
+        yield "result", result
+
+    @contextmanager
+    def _measure_turn(self, collect: bool = True):
+        """Открыть ход: замеры агентов, графа и хранилища копятся в TurnMetrics.
+
+        Время ответа пользователю - запись kind="turn"; фоновые задачи
+        хода пишут свои замеры отдельно (см. _measured). collect=False -
+        только время хода, contextvar выставляет вызывающий (стриминг).
+        """
+        self.turn += 1
+        if not METRICS_ENABLED:
+            yield None
+            return
+        turn_metrics = metrics.TurnMetrics()
+        started = time.perf_counter()
+        if collect:
+            with metrics.collect(turn_metrics):
+                yield turn_metrics
+        else:
+            yield turn_metrics
+        turn_metrics.add(metrics.MetricRecord("turn", "turn", (time.perf_counter() - started) * 1000))
+
+    def _save_metrics(self, session_id: Optional[int], turn: int, turn_metrics: Optional[metrics.TurnMetrics]) -> None:
+        if turn_metrics is None or not (self.storage and session_id):
+            return
+        try:
+            self.storage.save_metrics(session_id, turn, turn_metrics.drain())
+        except Exception as e:
+            # Замеры не должны ломать ответ пользователю
+            print(f"Ошибка записи метрик: {e}")
+
+    def _measured(self, session_id: Optional[int], turn: int, fn: Callable, *args) -> None:
+        """Выполнить фоновую задачу хода turn, сохранив ее замеры."""
+        if not METRICS_ENABLED:
+            fn(*args)
+            return
+        turn_metrics = metrics.TurnMetrics()
+        try:
+            with metrics.collect(turn_metrics):
+                fn(*args)
+        finally:
+            self._save_metrics(session_id, turn, turn_metrics)
+
+    def _complete_turn(self, result: Dict) -> Dict:
         # Обновляем историю сообщений
         self.messages = result["messages"]
         
         # Сохраняем в базу данных
         if self.storage and self.session_id:
-            self.storage.save_interaction(self.session_id, result)
+            if self.memory_worker is None:
+                self.storage.save_interaction(self.session_id, result)
+            else:
+                self.storage.save_messages(self.session_id, result)
+                if not self._schedule_insights(self.session_id, result):
+                    self._extract_insights(self.session_id, result)
+
+        if not self._schedule_summary():
+            self._fold_summary()
         
-        # Формируем ответ
-        return {
-            "response": result["specialist_response"],
-            "approach": result["current_approach"],
-            "confidence": result["confidence"],
-            "reasoning": result["reasoning"],
-            "insights": result.get("insights", {})
-        }
+        return self._format_response(result)
+
+    async def _acomplete_turn(self, result: Dict) -> Dict:
+        self.messages = result["messages"]
+
+        if self.storage and self.session_id:
+            if self.memory_worker is None:
+                await self.storage.asave_interaction(self.session_id, result)
+            else:
+                await self.storage.asave_messages(self.session_id, result)
+                if not self._schedule_insights(self.session_id, result):
+                    await asyncio.to_thread(self._extract_insights, self.session_id, result)
+
+        if not self._schedule_summary():
+            await asyncio.to_thread(self._fold_summary)
+
+        return self._format_response(result)
     
     def get_session_insights(self) -> List[Dict]:
         """Получить инсайты текущей сессии"""
         if self.storage and self.session_id:
             return self.storage.get_session_insights(self.session_id)
         return []
+
+    async def aget_session_insights(self) -> List[Dict]:
+        if self.storage and self.session_id:
+            return await self.storage.aget_session_insights(self.session_id)
+        return []
     
     def get_session_history(self) -> List[Dict]:
         """Получить историю текущей сессии"""
@@ -60,9 +378,112 @@ class TherapyOrchestrator:
             return self.storage.get_session_history(self.session_id)
         return []
 
+    async def aget_session_history(self) -> List[Dict]:
+        if self.storage and self.session_id:
+            return await self.storage.aget_session_history(self.session_id)
+        return []
+
+    def export_history(self, session_ids: Optional[Iterable[int]] = None, include_insights: bool = True) -> Iterator[str]:
+        """NDJSON-экспорт сессий (по умолчанию текущей) чанками"""
+        if not self.storage:
+            return iter(())
+        if session_ids is None:
+            session_ids = [self.session_id] if self.session_id else []
+        return self.storage.export_ndjson(session_ids, include_insights=include_insights)
+
     def refresh_prompts(self) -> None:
         """Reload prompts for all agents from the shared store."""
 
         if self.prompt_store:
             self.prompt_store.clear_cache()
         self.graph.refresh_prompts()
+
+    def metrics_report(self, session_id: Optional[int] = None, limit: int = 10000) -> Dict:
+        """p50/p95 по узлам и стоимость по последним limit замерам.
+
+        session_id=None - все сессии базы; возвращает {"nodes": [...],
+        "sessions": [...]} (пусто, если хранилище выключено).
+        """
+        if not self.storage:
+            return {"nodes": [], "sessions": []}
+        return {
+            "nodes": metrics.node_stats(self.storage.get_metrics(session_id, limit)),
+            "sessions": self.storage.session_costs(session_id),
+        }
+
+    def memory_queue_stats(self) -> Dict[str, int]:
+        """Счетчики фоновой очереди инсайтов (пусто, если режим выключен)."""
+
+        if self.memory_worker:
+            return self.memory_worker.stats()
+        return {}
+
+    def summary_queue_stats(self) -> Dict[str, int]:
+        """Счетчики фоновой очереди сводки (пусто, если сводка выключена).
+
+        rejected - сколько раз очередь была полна и ход сворачивал сводку сам.
+        """
+
+        if self.summary_worker:
+            return self.summary_worker.stats()
+        return {}
+
+    def close(self) -> None:
+        """Дождаться фоновых задач и закрыть соединения с базой."""
+
+        if not self._owns_resources:
+            return
+        if self.memory_worker:
+            self.memory_worker.shutdown()
+        if self.summary_worker:
+            self.summary_worker.shutdown()
+        self.graph.close()
+        if self.storage:
+            self.storage.close()
+
+    def _schedule_insights(self, session_id: int, result: Dict) -> bool:
+        # Передаем в фон только то, что нужно агенту памяти
+        state = {
+            "user_message": result["user_message"],
+            "current_approach": result["current_approach"],
+            "specialist_response": result["specialist_response"],
+        }
+        return self.memory_worker.submit(
+            self._measured, session_id, self.turn, self._extract_insights, session_id, state
+        )
+
+    def _extract_insights(self, session_id: int, state: Dict) -> None:
+        with metrics.timed("memory"):
+            update = self.graph.memory_agent.extract(state)
+        self.storage.save_insights(session_id, update["insights"], state["current_approach"])
+
+    def _schedule_summary(self) -> bool:
+        # False - очередь полна: вызывающий сворачивает сам, чтобы сводка
+        # не отставала без предела (как с инсайтами в _schedule_insights)
+        if self.summary_worker is None:
+            return True
+        return self.summary_worker.submit(self._measured, self.session_id, self.turn, self._fold_summary)
+
+    def _fold_summary(self) -> None:
+        # Под блокировкой: параллельные задачи фоновой очереди сворачивают
+        # ходы строго по очереди, вторая застанет уже обновленную сводку
+        with self._summary_lock:
+            base, messages = self.summary, self.messages
+            session_id, base_id = self.session_id, self._history_base_id
+            folded = self.graph.fold_summary(base, messages)
+            # Пока сворачивали, могла начаться новая сессия
+            if self.summary is base:
+                self.summary = folded
+            if folded is not base and self.storage and session_id:
+                self.storage.save_summary(session_id, folded.text, base_id, folded.covered)
+
+    @staticmethod
+    def _format_response(result: Dict) -> Dict:
+        # Формируем ответ
+        return {
+            "response": result["specialist_response"],
+            "approach": result["current_approach"],
+            "confidence": result["confidence"],
+            "reasoning": result["reasoning"],
+            "insights": result.get("insights", {})
+        }
@@ -0,0 +1,184 @@
+"""Регрессия роутера: прогон сохраненных сообщений через новый промпт.
+
+Сообщения пользователей и решения LLM-роутера берутся из таблицы messages
+(MemoryStorage.get_routing_examples: только route_source = 'llm', без
+решений локального классификатора и DBT по умолчанию), каждое уникальное
+сообщение маршрутизируется кандидатом параллельно и без истории беседы.
+Ответы кешируются (LLMResponseCache), поэтому повторная проверка того же
+промпта не тратит вызовы LLM. Сравнение - с сохраненными approach/confidence.
+
+Прогон запускает редактор промптов перед сохранением - один раз на правку,
+а не в каждом процессе, который потом получит новый промпт.
+"""
+
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from agents.base import APPROACHES
+from agents.cache import shared_cache
+from agents.llm import get_llm
+from agents.scheduler import BACKGROUND
+from agents.specialists import RouterAgent
+
+
+@dataclass
+class RegressionReport:
+    """Итог прогона промпта-кандидата по сохраненным решениям"""
+
+    prompt_hash: str
+    samples: int
+    agreement: float
+    # matrix[сохраненный подход][подход кандидата]
+    matrix: Dict[str, Dict[str, int]]
+    baseline_distribution: Dict[str, float]
+    candidate_distribution: Dict[str, float]
+    # Расстояние полной вариации между распределениями подходов (0..1)
+    distribution_shift: float
+    baseline_confidence: float
+    candidate_confidence: float
+    # Средний |Δ confidence| на сообщениях, где подход совпал
+    confidence_delta: float
+    errors: int
+    elapsed: float
+    passed: bool = True
+    reasons: List[str] = field(default_factory=list)
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def _distribution(approaches: List[str]) -> Dict[str, float]:
+    total = len(approaches) or 1
+    return {approach: approaches.count(approach) / total for approach in APPROACHES}
+
+
+class RouterRegression:
+    """Параллельный прогон промпта роутера по истории с кешем ответов"""
+
+    def __init__(
+        self,
+        storage,
+        cache=None,
+        cache_path: Optional[str] = None,
+        cache_options: Optional[Dict] = None,
+        samples: int = 200,
+        workers: int = 16,
+        min_agreement: float = 0.7,
+        max_shift: float = 0.2,
+    ):
+        self.storage = storage
+        # cache - уже открытый кеш (кеш графа); иначе кеш по cache_path
+        # открывается при первом прогоне, а не при создании оркестратора
+        self.cache = cache
+        self.cache_path = cache_path
+        self.cache_options = cache_options or {}
+        self.samples = samples
+        self.workers = workers
+        self.min_agreement = min_agreement
+        self.max_shift = max_shift
+        # Отчеты по хешу промпта: повторная проверка мгновенная
+        self._reports: Dict[str, RegressionReport] = {}
+        self._lock = threading.Lock()
+
+    def report(self, prompt: str) -> Optional[RegressionReport]:
+        with self._lock:
+            return self._reports.get(prompt_hash(prompt))
+
+    def reports(self) -> List[RegressionReport]:
+        with self._lock:
+            return list(self._reports.values())
+
+    def run(self, prompt: str) -> RegressionReport:
+        """Прогнать промпт по последним self.samples решениям роутера."""
+
+        cached = self.report(prompt)
+        if cached is not None:
+            return cached
+
+        started = time.perf_counter()
+        examples = [
+            example for example in self.storage.get_routing_examples(self.samples)
+            if example["approach"] in APPROACHES
+        ]
+        routes = self._route_all(prompt, {example["message"] for example in examples})
+
+        matrix = {label: {approach: 0 for approach in APPROACHES} for label in APPROACHES}
+        baseline, candidate, deltas = [], [], []
+        errors = 0
+        for example in examples:
+            route = routes.get(example["message"])
+            if route is None:
+                errors += 1
+                continue
+            matrix[example["approach"]][route["current_approach"]] += 1
+            baseline.append(example["approach"])
+            candidate.append(route["current_approach"])
+            if route["current_approach"] == example["approach"] and example["confidence"] is not None:
+                deltas.append(abs(route["confidence"] - example["confidence"]))
+
+        compared = len(baseline)
+        baseline_distribution = _distribution(baseline)
+        candidate_distribution = _distribution(candidate)
+        report = RegressionReport(
+            prompt_hash=prompt_hash(prompt),
+            samples=compared,
+            agreement=sum(matrix[label][label] for label in APPROACHES) / compared if compared else 1.0,
+            matrix=matrix,
+            baseline_distribution=baseline_distribution,
+            candidate_distribution=candidate_distribution,
+            distribution_shift=sum(
+                abs(baseline_distribution[approach] - candidate_distribution[approach]) for approach in APPROACHES
+            ) / 2,
+            baseline_confidence=self._mean(example["confidence"] for example in examples),
+            candidate_confidence=self._mean(route["confidence"] for route in routes.values() if route),
+            confidence_delta=self._mean(deltas),
+            errors=errors,
+            elapsed=time.perf_counter() - started,
+        )
+        self._judge(report)
+
+        with self._lock:
+            self._reports[report.prompt_hash] = report
+        return report
+
+    def _route_all(self, prompt: str, messages) -> Dict[str, Optional[Dict]]:
+        # Без локального классификатора: проверяем именно промпт
+        router = RouterAgent(prompt)
+        # Отдельное имя в кеше: смена промпта рабочего роутера вычищает
+        # записи "Router", но не ответы кандидатов
+        router.name = "Router regression"
+        # Офлайн-прогон не должен отнимать очередь у живых бесед
+        router.llm = get_llm("router", priority=BACKGROUND)
+        if self.cache is None and self.cache_path:
+            self.cache = shared_cache(self.cache_path, **self.cache_options)
+        if self.cache is not None:
+            router.enable_cache(self.cache)
+
+        def route(message: str) -> Optional[Dict]:
+            # Нераспознанный ответ - ошибка прогона, а не решение "DBT по умолчанию"
+            data = router._parse_or_repair(router.process(message))
+            return router._fill_route(data) if data is not None else None
+
+        messages = list(messages)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="router-regression") as executor:
+            return dict(zip(messages, executor.map(route, messages)))
+
+    def _judge(self, report: RegressionReport) -> None:
+        if report.samples and report.agreement < self.min_agreement:
+            report.reasons.append(f"согласие {report.agreement:.0%} < {self.min_agreement:.0%}")
+        if report.samples and report.distribution_shift > self.max_shift:
+            report.reasons.append(f"сдвиг распределения {report.distribution_shift:.2f} > {self.max_shift:.2f}")
+        report.passed = not report.reasons
+
+    @staticmethod
+    def _mean(values) -> float:
+        values = [value for value in values if isinstance(value, (int, float))]
+        return sum(values) / len(values) if values else 0.0
+
+
+__all__ = ["RegressionReport", "RouterRegression", "prompt_hash"]
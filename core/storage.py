@@ -1,132 +1,229 @@
+import asyncio
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import json
 
+from core.metrics import MetricRecord, timed_storage
+from core.migrations import apply_migrations
+from core.write_behind import WriteBehindBuffer
+
+# SQL вынесен в константы: sqlite3 кеширует подготовленные выражения
+# по тексту запроса, и одинаковый текст переиспользует их на соединении
+INSERT_SESSION = "INSERT INTO sessions (user_id, resume_token) VALUES (?, ?)"
+INSERT_MESSAGE = """INSERT INTO messages 
+            (session_id, role, content, approach, confidence, reasoning, route_source) 
+            VALUES (?, ?, ?, ?, ?, ?, ?)"""
+INSERT_INSIGHT = """INSERT INTO insights 
+                (session_id, insight, type, approach) 
+                VALUES (?, ?, ?, ?)"""
+INSERT_METRIC = """INSERT INTO metrics
+                (session_id, turn, node, kind, duration_ms, model, prompt_tokens, completion_tokens, cost)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+# Настройки соединения: WAL позволяет читать параллельно с записью,
+# synchronous=NORMAL в WAL безопасен и избавляет от fsync на каждый commit
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+
 class MemoryStorage:
     """SQLite хранилище для терапевтических сессий"""
     
-    def __init__(self, db_path: str = "therapy_sessions.db"):
+    def __init__(
+        self,
+        db_path: str = "therapy_sessions.db",
+        write_behind: bool = False,
+        batch_size: int = 200,
+        flush_interval_ms: int = 50,
+        max_queue: int = 10000,
+    ):
         self.db_path = db_path
+        # Одно соединение на поток; список нужен, чтобы закрыть все в close()
+        self._local = threading.local()
+        self._connections: List[Tuple[threading.Thread, sqlite3.Connection]] = []
+        self._pool_lock = threading.Lock()
+        self._closed = False
         self.init_db()
-    
-    def init_db(self):
-        """Инициализация таблиц базы данных"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         
-        # Таблица сессий
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        # write_behind=True: взаимодействия пишутся пачками в фоновом потоке
+        self._buffer: Optional[WriteBehindBuffer] = None
+        if write_behind:
+            self._buffer = WriteBehindBuffer(
+                self, max_batch=batch_size, flush_interval_ms=flush_interval_ms, max_queue=max_queue
             )
-        """)
-        
-        # Таблица сообщений
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER,
-                role TEXT,
-                content TEXT,
-                approach TEXT,
-                confidence REAL,
-                reasoning TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES sessions(id)
-            )
-        """)
+
+    # ------------------------------------------------------------------
+    # Соединения
+    # ------------------------------------------------------------------
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
         
-        # Таблица инсайтов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS insights (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER,
-                insight TEXT,
-                type TEXT,  -- 'insight', 'pattern', 'trigger', 'resource'
-                approach TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES sessions(id)
+        with self._pool_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("MemoryStorage закрыт")
+            self._prune_dead_threads()
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=30,
+                check_same_thread=False,
+                cached_statements=256,
             )
-        """)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._connections.append((threading.current_thread(), conn))
         
+        self._local.conn = conn
+        return conn
+
+    def _prune_dead_threads(self):
+        # Streamlit и пулы потоков создают новые потоки - закрываем
+        # соединения тех, что уже завершились
+        alive = []
+        for thread, conn in self._connections:
+            if thread.is_alive():
+                alive.append((thread, conn))
+            else:
+                conn.close()
+        self._connections = alive
+
+    @contextmanager
+    def _transaction(self):
+        """Курсор в транзакции записи: commit при успехе, rollback при ошибке"""
+        conn = self._connection()
+        self._begin(conn)
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.rollback()
+            raise
         conn.commit()
-        conn.close()
+
+    def _begin(self, conn: sqlite3.Connection) -> None:
+        # Все транзакции здесь пишут. BEGIN IMMEDIATE сразу берет блокировку
+        # записи и ждет ее в busy_timeout; отложенная транзакция при
+        # повышении до записи получила бы SQLITE_BUSY без ожидания
+        conn.execute("BEGIN IMMEDIATE")
+
+    def close(self):
+        """Дописать отложенные записи и закрыть все соединения пула"""
+        if self._buffer:
+            self._buffer.close()
+        with self._pool_lock:
+            self._closed = True
+            for _, conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
     
-    def create_session(self, user_id: str = "default") -> int:
-        """Создать новую сессию"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO sessions (user_id) VALUES (?)", (user_id,))
-        session_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return session_id
+    def init_db(self):
+        """Инициализация и миграция схемы базы данных"""
+        self.schema_version = apply_migrations(self._connection())
+    
+    @timed_storage
+    def create_session(self, user_id: str = "default", resume_token: Optional[str] = None) -> int:
+        """Создать новую сессию.
+
+        resume_token - секрет для продолжения сессии по ссылке; без него
+        сессию можно продолжить только по id на стороне сервера.
+        """
+        with self._transaction() as cursor:
+            cursor.execute(INSERT_SESSION, (user_id, resume_token))
+            return cursor.lastrowid
     
+    @timed_storage
     def save_interaction(self, session_id: int, state: Dict):
         """Сохранить полное взаимодействие"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Сохраняем сообщение пользователя
-        cursor.execute(
-            """INSERT INTO messages 
-            (session_id, role, content, approach, confidence, reasoning) 
-            VALUES (?, ?, ?, ?, ?, ?)""",
-            (session_id, "user", state["user_message"], None, None, None)
+        self._save_rows(
+            self._message_rows(session_id, state),
+            self._insight_rows(session_id, state.get("insights", {}), state["current_approach"]),
         )
-        
-        # Сохраняем ответ специалиста
-        cursor.execute(
-            """INSERT INTO messages 
-            (session_id, role, content, approach, confidence, reasoning) 
-            VALUES (?, ?, ?, ?, ?, ?)""",
+
+    @timed_storage
+    def save_messages(self, session_id: int, state: Dict):
+        """Сохранить только реплики пользователя и специалиста"""
+        self._save_rows(self._message_rows(session_id, state), [])
+
+    @timed_storage
+    def save_insights(self, session_id: int, insights: Dict, approach: Optional[str]):
+        """Сохранить инсайты, извлеченные агентом памяти"""
+        self._save_rows([], self._insight_rows(session_id, insights, approach))
+
+    def flush(self):
+        """Дождаться записи отложенных взаимодействий (в режиме write_behind)"""
+        if self._buffer:
+            self._buffer.flush()
+
+    def write_stats(self) -> Dict[str, int]:
+        """Счетчики буфера отложенной записи (пусто, если режим выключен)"""
+        return self._buffer.stats() if self._buffer else {}
+
+    def save_metrics(self, session_id: int, turn: int, records: List[MetricRecord]):
+        """Сохранить замеры хода (см. core.metrics)"""
+        rows = [
+            (session_id, turn, record.node, record.kind, record.duration_ms, record.model,
+             record.prompt_tokens, record.completion_tokens, record.cost)
+            for record in records
+        ]
+        if rows:
+            self._save_rows([], [], rows)
+
+    def _save_rows(self, message_rows: List[Tuple], insight_rows: List[Tuple], metric_rows: List[Tuple] = ()):
+        if self._buffer:
+            self._buffer.submit(message_rows, insight_rows, metric_rows)
+        else:
+            self._write_rows(message_rows, insight_rows, metric_rows)
+
+    def _write_rows(self, message_rows: List[Tuple], insight_rows: List[Tuple], metric_rows: List[Tuple] = ()):
+        # Одна транзакция на пачку, по одному executemany на таблицу
+        with self._transaction() as cursor:
+            if message_rows:
+                cursor.executemany(INSERT_MESSAGE, message_rows)
+            if insight_rows:
+                cursor.executemany(INSERT_INSIGHT, insight_rows)
+            if metric_rows:
+                cursor.executemany(INSERT_METRIC, metric_rows)
+
+    @staticmethod
+    def _message_rows(session_id: int, state: Dict) -> List[Tuple]:
+        return [
+            # Сообщение пользователя
+            (session_id, "user", state["user_message"], None, None, None, None),
+            # Ответ специалиста и откуда взято решение роутера
             (session_id, "assistant", state["specialist_response"],
-             state["current_approach"], state["confidence"], state["reasoning"])
-        )
-        
-        # Сохраняем инсайты
-        insights = state.get("insights", {})
-        
-        for insight in insights.get("insights", []):
-            cursor.execute(
-                """INSERT INTO insights 
-                (session_id, insight, type, approach) 
-                VALUES (?, ?, ?, ?)""",
-                (session_id, insight, "insight", state["current_approach"])
-            )
-        
-        for pattern in insights.get("patterns", []):
-            cursor.execute(
-                """INSERT INTO insights 
-                (session_id, insight, type, approach) 
-                VALUES (?, ?, ?, ?)""",
-                (session_id, pattern, "pattern", state["current_approach"])
-            )
-        
-        for trigger in insights.get("triggers", []):
-            cursor.execute(
-                """INSERT INTO insights 
-                (session_id, insight, type, approach) 
-                VALUES (?, ?, ?, ?)""",
-                (session_id, trigger, "trigger", state["current_approach"])
-            )
-        
-        conn.commit()
-        conn.close()
+             state["current_approach"], state["confidence"], state["reasoning"], state.get("route_source")),
+        ]
+
+    @staticmethod
+    def _insight_rows(session_id: int, insights: Dict, approach: Optional[str]) -> List[Tuple]:
+        insights = insights or {}
+        rows = []
+        for key, insight_type in (("insights", "insight"), ("patterns", "pattern"), ("triggers", "trigger")):
+            for insight in insights.get(key, []):
+                rows.append((session_id, insight, insight_type, approach))
+        return rows
     
+    @timed_storage
     def get_session_history(self, session_id: int) -> List[Dict]:
         """Получить историю сессии"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.flush()
+        cursor = self._connection().cursor()
         
         cursor.execute("""
             SELECT role, content, approach, confidence, reasoning, created_at
             FROM messages
             WHERE session_id = ?
-            ORDER BY created_at
+            ORDER BY created_at, id
         """, (session_id,))
         
         messages = []
@@ -140,19 +237,19 @@ class MemoryStorage:
                 "created_at": row[5]
             })
         
-        conn.close()
         return messages
     
+    @timed_storage
     def get_session_insights(self, session_id: int) -> List[Dict]:
         """Получить инсайты сессии"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.flush()
+        cursor = self._connection().cursor()
         
         cursor.execute("""
             SELECT insight, type, approach, created_at
             FROM insights
             WHERE session_id = ?
-            ORDER BY created_at DESC
+            ORDER BY created_at DESC, id DESC
         """, (session_id,))
         
         insights = []
@@ -164,5 +261,325 @@ class MemoryStorage:
                 "created_at": row[3]
             })
         
-        conn.close()
-        return insights
\ No newline at end of file
+        return insights
+
+    @timed_storage
+    def get_history_page(self, session_id: int, after_id: int = 0, limit: int = 500) -> List[Dict]:
+        """Страница истории: сообщения с id > after_id по возрастанию id.
+
+        Курсор следующей страницы - id последнего сообщения. В отличие от
+        OFFSET, стоимость не растет с номером страницы.
+        """
+        self.flush()
+        cursor = self._connection().cursor()
+        cursor.execute("""
+            SELECT id, role, content, approach, confidence, reasoning, created_at
+            FROM messages
+            WHERE session_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (session_id, after_id, limit))
+
+        return [
+            {
+                "id": row[0],
+                "role": row[1],
+                "content": row[2],
+                "approach": row[3],
+                "confidence": row[4],
+                "reasoning": row[5],
+                "created_at": row[6]
+            }
+            for row in cursor.fetchall()
+        ]
+
+    @timed_storage
+    def get_insights_page(self, session_id: int, after_id: int = 0, limit: int = 500) -> List[Dict]:
+        """Страница инсайтов с id > after_id по возрастанию id"""
+        self.flush()
+        cursor = self._connection().cursor()
+        cursor.execute("""
+            SELECT id, insight, type, approach, created_at
+            FROM insights
+            WHERE session_id = ? AND id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (session_id, after_id, limit))
+
+        return [
+            {
+                "id": row[0],
+                "insight": row[1],
+                "type": row[2],
+                "approach": row[3],
+                "created_at": row[4]
+            }
+            for row in cursor.fetchall()
+        ]
+
+    def iter_session_history(self, session_id: int, page_size: int = 500) -> Iterator[Dict]:
+        """Все сообщения сессии страницами по page_size, без загрузки целиком"""
+        for page in self._pages(self.get_history_page, session_id, page_size):
+            yield from page
+
+    def iter_session_insights(self, session_id: int, page_size: int = 500) -> Iterator[Dict]:
+        """Все инсайты сессии в порядке появления, страницами по page_size"""
+        for page in self._pages(self.get_insights_page, session_id, page_size):
+            yield from page
+
+    def iter_session_ids(self, user_id: Optional[str] = None, page_size: int = 500) -> Iterator[int]:
+        """id сессий (всех или одного пользователя) по возрастанию"""
+        after_id = 0
+        while True:
+            query = "SELECT id FROM sessions WHERE id > ?"
+            params: Tuple = (after_id,)
+            if user_id is not None:
+                query += " AND user_id = ?"
+                params += (user_id,)
+            rows = self._connection().execute(query + " ORDER BY id LIMIT ?", params + (page_size,)).fetchall()
+            for row in rows:
+                yield row[0]
+            if len(rows) < page_size:
+                return
+            after_id = rows[-1][0]
+
+    def export_ndjson(
+        self,
+        session_ids: Iterable[int],
+        include_insights: bool = True,
+        page_size: int = 500,
+    ) -> Iterator[str]:
+        """Экспорт сессий в NDJSON, по одному чанку на страницу.
+
+        Каждая строка - JSON-объект с полями session_id и kind
+        ("message" или "insight"). Память не зависит от размера экспорта,
+        первый чанк готов после первого запроса к базе.
+        """
+        for session_id in session_ids:
+            sources = [("message", self.get_history_page)]
+            if include_insights:
+                sources.append(("insight", self.get_insights_page))
+            for kind, reader in sources:
+                for page in self._pages(reader, session_id, page_size):
+                    yield "".join(
+                        json.dumps({"session_id": session_id, "kind": kind, **record}, ensure_ascii=False) + "\n"
+                        for record in page
+                    )
+
+    @staticmethod
+    def _pages(reader, session_id: int, page_size: int) -> Iterator[List[Dict]]:
+        # Каждая страница - отдельный короткий запрос: не держим открытое
+        # чтение между yield, чтобы не мешать записи и чекпоинтам WAL
+        after_id = 0
+        while True:
+            page = reader(session_id, after_id, page_size)
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            after_id = page[-1]["id"]
+
+    @timed_storage
+    def save_summary(self, session_id: int, summary: str, base_id: int, covered: int):
+        """Сохранить сводку, свернувшую covered сообщений после base_id.
+
+        Граница хранится как id последнего свернутого сообщения, чтобы
+        resume_session читал только хвост после нее.
+        """
+        if covered <= 0:
+            return
+        self.flush()
+        with self._transaction() as cursor:
+            cursor.execute("""
+                UPDATE sessions SET summary = ?, summary_until_id = (
+                    SELECT id FROM messages
+                    WHERE session_id = ? AND id > ?
+                    ORDER BY id
+                    LIMIT 1 OFFSET ?
+                )
+                WHERE id = ?
+            """, (summary, session_id, base_id, covered - 1, session_id))
+
+    @timed_storage
+    def load_session_context(self, session_id: int, limit: Optional[int]) -> Optional[Dict]:
+        """Сводка и до limit последних несвернутых сообщений одним запросом.
+
+        limit=None - все несвернутые. Возвращает None, если сессии нет;
+        сообщения - по возрастанию id.
+        """
+        self.flush()
+        cursor = self._connection().cursor()
+        cursor.execute("""
+            SELECT s.user_id, s.summary, s.summary_until_id, s.resume_token, m.id, m.role, m.content
+            FROM sessions s
+            LEFT JOIN messages m
+                ON m.session_id = s.id AND m.id > COALESCE(s.summary_until_id, 0)
+            WHERE s.id = ?
+            ORDER BY m.id DESC
+            LIMIT ?
+        """, (session_id, -1 if limit is None else limit))
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+
+        return {
+            "user_id": rows[0][0],
+            "summary": rows[0][1] or "",
+            "summary_until_id": rows[0][2] or 0,
+            "resume_token": rows[0][3],
+            "messages": [
+                {"id": row[4], "role": row[5], "content": row[6]}
+                for row in reversed(rows)
+                if row[4] is not None
+            ],
+        }
+
+    @timed_storage
+    def find_session_by_token(self, resume_token: str) -> Optional[int]:
+        """id сессии с этим токеном продолжения или None"""
+        if not resume_token:
+            return None
+        cursor = self._connection().cursor()
+        cursor.execute("SELECT id FROM sessions WHERE resume_token = ?", (resume_token,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    @timed_storage
+    def get_routing_examples(self, limit: Optional[int] = None) -> List[Dict]:
+        """Пары «сообщение пользователя -> решение LLM-роутера» по всем сессиям.
+
+        Только ходы с route_source = 'llm': решения локального классификатора,
+        DBT по умолчанию и подход из недоразобранного потока - не разметка.
+        """
+        self.flush()
+        cursor = self._connection().cursor()
+        
+        query = """
+            SELECT u.content, a.approach, a.confidence, a.reasoning
+            FROM messages u
+            JOIN messages a ON a.id = (
+                SELECT MIN(id) FROM messages
+                WHERE session_id = u.session_id AND id > u.id AND role = 'assistant'
+            )
+            WHERE u.role = 'user' AND a.approach IS NOT NULL AND a.route_source = 'llm'
+            ORDER BY u.id DESC
+        """
+        params = ()
+        if limit:
+            query += " LIMIT ?"
+            params = (limit,)
+        cursor.execute(query, params)
+        
+        examples = []
+        for row in cursor.fetchall():
+            examples.append({
+                "message": row[0],
+                "approach": row[1],
+                "confidence": row[2],
+                "reasoning": row[3]
+            })
+        
+        return examples
+
+    def get_metrics(self, session_id: Optional[int] = None, limit: int = 10000) -> List[Dict]:
+        """Последние limit замеров (всех сессий или одной), новые первыми"""
+        self.flush()
+        query = """
+            SELECT session_id, turn, node, kind, duration_ms, model, prompt_tokens, completion_tokens, cost
+            FROM metrics
+        """
+        params: Tuple = ()
+        if session_id is not None:
+            query += " WHERE session_id = ?"
+            params = (session_id,)
+        rows = self._connection().execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,)).fetchall()
+
+        return [
+            {
+                "session_id": row[0],
+                "turn": row[1],
+                "node": row[2],
+                "kind": row[3],
+                "duration_ms": row[4],
+                "model": row[5],
+                "prompt_tokens": row[6],
+                "completion_tokens": row[7],
+                "cost": row[8]
+            }
+            for row in rows
+        ]
+
+    def session_costs(self, session_id: Optional[int] = None, limit: int = 20) -> List[Dict]:
+        """Ходы, токены, стоимость и суммарное время по сессиям (последние первыми)"""
+        self.flush()
+        query = """
+            SELECT session_id,
+                   COUNT(DISTINCT turn),
+                   SUM(prompt_tokens),
+                   SUM(completion_tokens),
+                   SUM(cost),
+                   SUM(CASE WHEN kind = 'turn' THEN duration_ms END)
+            FROM metrics
+        """
+        params: Tuple = ()
+        if session_id is not None:
+            query += " WHERE session_id = ?"
+            params = (session_id,)
+        query += " GROUP BY session_id ORDER BY session_id DESC LIMIT ?"
+        rows = self._connection().execute(query, params + (limit,)).fetchall()
+
+        return [
+            {
+                "session_id": row[0],
+                "turns": row[1],
+                "prompt_tokens": row[2] or 0,
+                "completion_tokens": row[3] or 0,
+                "cost": row[4] or 0.0,
+                "turn_ms": row[5] or 0.0
+            }
+            for row in rows
+        ]
+
+    def last_metrics_turn(self, session_id: int) -> int:
+        """Номер последнего хода сессии с замерами (0, если их нет)"""
+        self.flush()
+        row = self._connection().execute(
+            "SELECT COALESCE(MAX(turn), 0) FROM metrics WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0]
+
+    @timed_storage
+    def count_user_messages(self, session_id: int) -> int:
+        """Сколько сообщений пользователя сохранено в сессии (= завершенных ходов)"""
+        self.flush()
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ? AND role = 'user'", (session_id,)
+        ).fetchone()
+        return row[0]
+
+    # ------------------------------------------------------------------
+    # Async API: sqlite3 блокирующий, поэтому выносим вызовы в поток
+    # ------------------------------------------------------------------
+    async def acreate_session(self, user_id: str = "default", resume_token: Optional[str] = None) -> int:
+        return await asyncio.to_thread(self.create_session, user_id, resume_token)
+
+    async def asave_interaction(self, session_id: int, state: Dict):
+        await asyncio.to_thread(self.save_interaction, session_id, state)
+
+    async def asave_messages(self, session_id: int, state: Dict):
+        await asyncio.to_thread(self.save_messages, session_id, state)
+
+    async def asave_metrics(self, session_id: int, turn: int, records: List[MetricRecord]):
+        await asyncio.to_thread(self.save_metrics, session_id, turn, records)
+
+    async def aget_session_history(self, session_id: int) -> List[Dict]:
+        return await asyncio.to_thread(self.get_session_history, session_id)
+
+    async def aget_session_insights(self, session_id: int) -> List[Dict]:
+        return await asyncio.to_thread(self.get_session_insights, session_id)
+
+    async def aget_history_page(self, session_id: int, after_id: int = 0, limit: int = 500) -> List[Dict]:
+        return await asyncio.to_thread(self.get_history_page, session_id, after_id, limit)
+
+    async def aget_insights_page(self, session_id: int, after_id: int = 0, limit: int = 500) -> List[Dict]:
+        return await asyncio.to_thread(self.get_insights_page, session_id, after_id, limit)
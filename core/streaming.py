@@ -0,0 +1,36 @@
+"""Обертки для потоковой выдачи ответа специалиста."""
+
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+# Событие потока: ("token", str) для чанков текста и ("result", dict) в конце
+StreamEvent = Tuple[str, Any]
+
+
+class ResponseStream:
+    """Итератор чанков ответа; итоговые метаданные доступны в result после завершения"""
+
+    def __init__(self, events: Iterator[StreamEvent]):
+        self._events = events
+        self.result: Optional[Dict] = None
+
+    def __iter__(self) -> Iterator[str]:
+        for kind, payload in self._events:
+            if kind == "token":
+                yield payload
+            elif kind == "result":
+                self.result = payload
+
+
+class AsyncResponseStream:
+    """Асинхронный аналог ResponseStream"""
+
+    def __init__(self, events: AsyncIterator[StreamEvent]):
+        self._events = events
+        self.result: Optional[Dict] = None
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async for kind, payload in self._events:
+            if kind == "token":
+                yield payload
+            elif kind == "result":
+                self.result = payload
@@ -0,0 +1,180 @@
+"""Отложенная запись взаимодействий пачками (group commit)."""
+
+import atexit
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+_STOP = object()
+
+# Строки одного взаимодействия: (сообщения, инсайты, замеры)
+Record = Tuple[List[Tuple], List[Tuple], List[Tuple]]
+
+
+class WriteBehindBuffer:
+    """Копит строки сообщений, инсайтов и замеров и пишет их пачками в одной транзакции.
+
+    Пачка сбрасывается, когда набралось max_batch записей или прошло
+    flush_interval_ms с первой записи в ней. Переполненная очередь
+    блокирует отправителя (backpressure), close() дописывает все остатки,
+    а после close() записи идут в базу сразу, в потоке отправителя.
+    Неудачная пачка повторяется, затем пишется по одной записи; записи,
+    которые так и не удалось записать, остаются в буфере и повторяются
+    при каждом flush() и при close().
+    """
+
+    # Повторы пачки целиком (с паузой 50 мс, 100 мс, ...) до записи по одной
+    RETRIES = 3
+
+    def __init__(self, storage, max_batch: int = 200, flush_interval_ms: int = 50, max_queue: int = 10000):
+        self.storage = storage
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        # _lock упорядочивает постановку в очередь и закрытие: после _STOP
+        # в очередь ничего не попадает. Счетчики - под отдельным замком,
+        # чтобы поток записи не ждал отправителя, заблокированного на put
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        self._failed: List[Record] = []
+        self._counters = {"records": 0, "batches": 0, "retries": 0, "blocked": 0}
+
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, message_rows: List[Tuple], insight_rows: List[Tuple], metric_rows: List[Tuple] = ()) -> None:
+        """Поставить в очередь строки одного взаимодействия."""
+
+        record = (message_rows, insight_rows, metric_rows)
+        with self._lock:
+            if not self._closed:
+                try:
+                    self._queue.put_nowait(record)
+                except queue.Full:
+                    with self._stats_lock:
+                        self._counters["blocked"] += 1
+                    self._queue.put(record)
+                return
+        # Поток записи остановлен - пишем сразу, ошибка достанется вызывающему
+        self.storage._write_rows(*self._rows([record]))
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Дождаться записи всего, что уже поставлено в очередь."""
+
+        with self._lock:
+            done = None
+            if not self._closed:
+                done = threading.Event()
+                self._queue.put(done)
+        if done is None:
+            # close() уже поставил _STOP: ждем, пока он допишет очередь
+            self._thread.join(timeout)
+            return
+        done.wait(timeout)
+
+    def close(self) -> None:
+        """Дописать очередь и остановить поток записи."""
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+        if self._failed:
+            print(f"Отложенная запись: {len(self._failed)} записей так и не записаны в базу")
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            stats = dict(self._counters)
+            stats["failed"] = len(self._failed)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch: List[Record] = []
+            waiters: List[threading.Event] = []
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+
+            # Собираем пачку до max_batch записей или до дедлайна
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+            if waiters or stop:
+                self._retry_failed()
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                # Все, что успели положить до _STOP, уже записано
+                return
+
+    @staticmethod
+    def _rows(batch: List[Record]) -> Record:
+        message_rows = [row for messages, _, _ in batch for row in messages]
+        insight_rows = [row for _, insights, _ in batch for row in insights]
+        metric_rows = [row for _, _, metrics in batch for row in metrics]
+        return message_rows, insight_rows, metric_rows
+
+    def _write(self, batch: List[Record]) -> None:
+        for attempt in range(self.RETRIES + 1):
+            try:
+                self.storage._write_rows(*self._rows(batch))
+            except Exception as e:
+                error = e
+                if attempt < self.RETRIES:
+                    with self._stats_lock:
+                        self._counters["retries"] += 1
+                    time.sleep(0.05 * 2 ** attempt)
+                continue
+            with self._stats_lock:
+                self._counters["records"] += len(batch)
+                self._counters["batches"] += 1
+            return
+
+        # Пачка не записалась - по одной, чтобы одна плохая запись не держала остальные
+        print(f"Ошибка отложенной записи ({len(batch)} записей): {error}")
+        for record in batch:
+            if not self._write_one(record):
+                with self._stats_lock:
+                    self._failed.append(record)
+
+    def _write_one(self, record: Record) -> bool:
+        try:
+            self.storage._write_rows(*self._rows([record]))
+        except Exception:
+            return False
+        with self._stats_lock:
+            self._counters["records"] += 1
+            self._counters["batches"] += 1
+        return True
+
+    def _retry_failed(self) -> None:
+        with self._stats_lock:
+            failed, self._failed = self._failed, []
+        still_failed = [record for record in failed if not self._write_one(record)]
+        if still_failed:
+            with self._stats_lock:
+                self._failed = still_failed + self._failed
@@ -1,5 +1,6 @@
 from core.orchestrator import TherapyOrchestrator
 from rich.console import Console
+from rich.live import Live
 from rich.panel import Panel
 from rich.table import Table
 from rich import print as rprint
@@ -22,6 +23,7 @@ def main():
         
         if user_input.lower() in ['выход', 'exit', 'quit']:
             console.print("\n[yellow]👋 Сессия завершена. Берегите себя![/yellow]")
+            orchestrator.close()
             break
         
         if user_input.lower() in ['память', 'memory']:
@@ -44,24 +46,30 @@ def main():
                 console.print("[dim]Пока нет инсайтов[/dim]")
             continue
         
-        # Обработка сообщения
-        with console.status("[yellow]Обработка...[/yellow]"):
-            result = orchestrator.process_message(user_input)
-        
-        # Показываем метаинформацию
-        approach_colors = {
-            "DBT": "blue",
-            "IFS": "magenta",
-            "TRE": "green"
-        }
-        color = approach_colors.get(result['approach'], 'white')
-        
-        panel = Panel(
-            result['response'],
-            title=f"[{color}]{result['approach']}[/{color}] Специалист",
-            subtitle=f"[dim]{result['reasoning']} (уверенность: {result['confidence']:.0%})[/dim]"
-        )
-        console.print(panel)
+        # Обработка сообщения: ответ специалиста выводится по мере генерации
+        stream = orchestrator.stream_message(user_input)
+        text = ""
+        with Live(Panel("[yellow]Обработка...[/yellow]"), console=console, refresh_per_second=12) as live:
+            for chunk in stream:
+                text += chunk
+                live.update(Panel(text, title="Специалист"))
+            
+            result = stream.result
+            
+            # Показываем метаинформацию
+            approach_colors = {
+                "DBT": "blue",
+                "IFS": "magenta",
+                "TRE": "green"
+            }
+            color = approach_colors.get(result['approach'], 'white')
+            
+            panel = Panel(
+                result['response'],
+                title=f"[{color}]{result['approach']}[/{color}] Специалист",
+                subtitle=f"[dim]{result['reasoning']} (уверенность: {result['confidence']:.0%})[/dim]"
+            )
+            live.update(panel)
         
         # Показываем инсайты если есть
         if result.get('insights') and result['insights'].get('insights'):
@@ -0,0 +1,370 @@
+"""Storage backends for prompts: Google Sheets and a local SQLite file."""
+
+from __future__ import annotations
+
+import abc
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+try:  # Streamlit is optional outside the web app
+    import streamlit as st
+    from streamlit_gsheets import GSheetsConnection
+
+    try:  # runtime helper appeared in newer Streamlit releases
+        from streamlit import runtime  # type: ignore
+    except Exception:  # Older Streamlit versions simply omit the module
+        runtime = None  # type: ignore
+
+    _STREAMLIT_AVAILABLE = True
+except Exception:  # pragma: no cover - fallback when Streamlit is unavailable
+    st = None  # type: ignore
+    runtime = None  # type: ignore
+    GSheetsConnection = None  # type: ignore
+    _STREAMLIT_AVAILABLE = False
+
+try:
+    import pandas as pd
+except ImportError:  # pragma: no cover - pandas ships with Streamlit but guard just in case
+    pd = None  # type: ignore
+
+
+DEFAULT_WORKSHEET = "Prompts"
+COLUMNS = ["key", "prompt", "updated_at", "updated_by"]
+
+
+def _current_timestamp() -> str:
+    """Return an ISO timestamp in UTC."""
+
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+@dataclass
+class PromptRecord:
+    """Simple structure describing a stored prompt."""
+
+    key: str
+    prompt: str
+    updated_at: Optional[str] = None
+    updated_by: Optional[str] = None
+
+
+@dataclass
+class PromptUpdateResult:
+    """Outcome of a batched prompt update."""
+
+    saved: bool
+    conflicts: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+# write() returns the outcome plus the backend's prompts as of that write
+# (None if they could not be read), so the caller can refresh without re-reading
+WriteOutcome = Tuple[PromptUpdateResult, Optional[Dict[str, PromptRecord]]]
+
+
+class PromptBackend(abc.ABC):
+    """Where prompts live. Subclasses implement read/write.
+
+    ``local`` backends are cheap to read and expose a change token through
+    ``version()``, so PromptStore reloads them synchronously when the token
+    moves. Remote backends return ``None`` and are refreshed in the background.
+    """
+
+    name = "prompts"
+    local = False
+
+    def available(self) -> bool:
+        return True
+
+    @abc.abstractmethod
+    def read(self) -> Dict[str, PromptRecord]:
+        """Current prompts by key."""
+
+    @abc.abstractmethod
+    def write(
+        self,
+        prompts: Dict[str, str],
+        updated_by: Optional[str] = None,
+        expected_updated_at: Optional[Dict[str, Optional[str]]] = None,
+    ) -> WriteOutcome:
+        """Store prompts unless another editor changed them since expected_updated_at."""
+
+    def version(self) -> Optional[int]:
+        return None
+
+    @staticmethod
+    def find_conflicts(
+        current: Dict[str, PromptRecord],
+        prompts: Dict[str, str],
+        expected_updated_at: Optional[Dict[str, Optional[str]]],
+    ) -> List[str]:
+        """Keys whose stored updated_at differs from what the editor saw."""
+
+        if expected_updated_at is None:
+            return []
+        return [
+            key for key in prompts
+            if key in expected_updated_at
+            and (current[key].updated_at if key in current else None) != expected_updated_at[key]
+        ]
+
+
+class GoogleSheetsBackend(PromptBackend):
+    """Prompts in a shared Google Sheet (requires a Streamlit runtime)."""
+
+    name = "Google Sheets"
+
+    def __init__(self, worksheet: Optional[str] = None):
+        self.worksheet = worksheet or DEFAULT_WORKSHEET
+        self.enabled = False
+        self.last_error: Optional[str] = None
+
+        if not _STREAMLIT_AVAILABLE or pd is None:
+            return
+
+        if runtime is not None:
+            try:
+                if not runtime.exists():  # type: ignore[union-attr]
+                    return
+            except Exception:
+                pass
+
+        try:
+            connection_settings = {}
+            try:
+                connection_settings = st.secrets.get("connections", {}).get("gsheets", {})  # type: ignore[arg-type]
+            except Exception:
+                connection_settings = {}
+
+            worksheet_secret = connection_settings.get("worksheet") if isinstance(connection_settings, dict) else None
+            if worksheet_secret:
+                self.worksheet = str(worksheet_secret)
+
+            # Attempt a lightweight access to verify configuration.
+            try:
+                _ = connection_settings.get("spreadsheet")
+            except Exception:
+                pass
+
+            self.enabled = True
+        except Exception as exc:  # pragma: no cover - defensive guard
+            self.last_error = str(exc)
+            self.enabled = False
+
+    def available(self) -> bool:
+        return self.enabled
+
+    def read(self) -> Dict[str, PromptRecord]:
+        return self._parse_table(self._read_table())
+
+    def write(
+        self,
+        prompts: Dict[str, str],
+        updated_by: Optional[str] = None,
+        expected_updated_at: Optional[Dict[str, Optional[str]]] = None,
+    ) -> WriteOutcome:
+        try:
+            table = self._read_table()
+        except Exception as exc:
+            return PromptUpdateResult(saved=False, error=str(exc)), None
+
+        if table is None or table.empty:
+            table = pd.DataFrame(columns=COLUMNS)
+
+        for column in COLUMNS:
+            if column not in table.columns:
+                table[column] = ""
+
+        current = self._parse_table(table)
+        conflicts = self.find_conflicts(current, prompts, expected_updated_at)
+        if conflicts:
+            return PromptUpdateResult(saved=False, conflicts=conflicts), current
+
+        keys = table["key"].astype(str)
+        timestamp = _current_timestamp()
+        new_rows = []
+
+        for key, prompt in prompts.items():
+            mask = keys == str(key)
+            if mask.any():
+                table.loc[mask, "prompt"] = prompt
+                table.loc[mask, "updated_at"] = timestamp
+                if updated_by is not None:
+                    table.loc[mask, "updated_by"] = updated_by
+            else:
+                new_rows.append({
+                    "key": key,
+                    "prompt": prompt,
+                    "updated_at": timestamp,
+                    "updated_by": updated_by or "",
+                })
+
+        if new_rows:
+            table = pd.concat([table, pd.DataFrame(new_rows)], ignore_index=True)
+
+        try:
+            conn = st.connection("gsheets", type=GSheetsConnection)
+            if self.worksheet:
+                conn.update(worksheet=self.worksheet, data=table)
+            else:
+                conn.update(data=table)
+        except Exception as exc:
+            return PromptUpdateResult(saved=False, error=str(exc)), current
+
+        # The table we just wrote is the freshest view; no need to re-read it
+        return PromptUpdateResult(saved=True), self._parse_table(table)
+
+    def _read_table(self) -> "pd.DataFrame":  # type: ignore # pragma: no cover - executed inside Streamlit
+        conn = st.connection("gsheets", type=GSheetsConnection)
+        read_kwargs = {"ttl": 0}
+        if self.worksheet:
+            return conn.read(worksheet=self.worksheet, **read_kwargs)
+        return conn.read(**read_kwargs)
+
+    @staticmethod
+    def _parse_table(table) -> Dict[str, PromptRecord]:
+        if table is None or table.empty:
+            return {}
+
+        prompts: Dict[str, PromptRecord] = {}
+        for row in table.to_dict("records"):
+            key = str(row.get("key", "")).strip()
+            if not key:
+                continue
+            prompts[key] = PromptRecord(
+                key=key,
+                prompt=str(row.get("prompt", "")),
+                updated_at=str(row.get("updated_at", "")) or None,
+                updated_by=str(row.get("updated_by", "")) or None,
+            )
+        return prompts
+
+
+class SQLitePromptBackend(PromptBackend):
+    """Prompts in a local SQLite file.
+
+    Every write bumps ``PRAGMA user_version`` in the same transaction, so
+    other processes notice changes by reading one header field.
+    """
+
+    name = "SQLite"
+    local = True
+
+    def __init__(self, path: str = "prompts.db"):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS prompts (
+                    key TEXT PRIMARY KEY,
+                    prompt TEXT NOT NULL,
+                    updated_at TEXT,
+                    updated_by TEXT
+                )
+            """)
+
+    @classmethod
+    def if_exists(cls, path: str) -> Optional["SQLitePromptBackend"]:
+        """Open the file only if some process already created it."""
+
+        return cls(path) if os.path.exists(path) else None
+
+    def read(self) -> Dict[str, PromptRecord]:
+        rows = self._connection().execute(
+            "SELECT key, prompt, updated_at, updated_by FROM prompts"
+        ).fetchall()
+        return {row[0]: PromptRecord(*row) for row in rows}
+
+    def version(self) -> int:
+        return self._connection().execute("PRAGMA user_version").fetchone()[0]
+
+    def write(
+        self,
+        prompts: Dict[str, str],
+        updated_by: Optional[str] = None,
+        expected_updated_at: Optional[Dict[str, Optional[str]]] = None,
+    ) -> WriteOutcome:
+        timestamp = _current_timestamp()
+
+        def apply(conn: sqlite3.Connection, current: Dict[str, PromptRecord]) -> List[str]:
+            conflicts = self.find_conflicts(current, prompts, expected_updated_at)
+            if conflicts:
+                return conflicts
+            conn.executemany(
+                """INSERT INTO prompts (key, prompt, updated_at, updated_by) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    prompt = excluded.prompt,
+                    updated_at = excluded.updated_at,
+                    updated_by = COALESCE(?, prompts.updated_by)""",
+                [(key, prompt, timestamp, updated_by or "", updated_by) for key, prompt in prompts.items()],
+            )
+            return []
+
+        try:
+            conflicts, records = self._write(apply)
+        except sqlite3.Error as exc:
+            return PromptUpdateResult(saved=False, error=str(exc)), None
+        return PromptUpdateResult(saved=not conflicts, conflicts=conflicts), records
+
+    def replace_all(self, records: Dict[str, PromptRecord]) -> bool:
+        """Mirror another backend: make the table equal to ``records``.
+
+        Returns True if anything changed (and the version was bumped).
+        """
+
+        def apply(conn: sqlite3.Connection, current: Dict[str, PromptRecord]) -> List[str]:
+            conn.execute("DELETE FROM prompts")
+            conn.executemany(
+                "INSERT INTO prompts (key, prompt, updated_at, updated_by) VALUES (?, ?, ?, ?)",
+                [(r.key, r.prompt, r.updated_at, r.updated_by) for r in records.values()],
+            )
+            return []
+
+        if self.read() == records:
+            return False
+        self._write(apply)
+        return True
+
+    def _write(self, apply) -> Tuple[List[str], Dict[str, PromptRecord]]:
+        # BEGIN IMMEDIATE takes the write lock before the conflict check,
+        # so check-then-write is atomic across processes
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = self.read()
+            conflicts = apply(conn, current)
+            if conflicts:
+                conn.rollback()
+                return conflicts, current
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            conn.execute(f"PRAGMA user_version = {int(version) + 1}")
+            records = self.read()
+            conn.commit()
+            return [], records
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: transactions are opened explicitly in _write
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+
+__all__ = [
+    "COLUMNS",
+    "DEFAULT_WORKSHEET",
+    "GoogleSheetsBackend",
+    "PromptBackend",
+    "PromptRecord",
+    "PromptUpdateResult",
+    "SQLitePromptBackend",
+]
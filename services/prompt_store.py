@@ -1,147 +1,157 @@
-"""Helpers for loading and persisting prompts in Google Sheets."""
+"""Helpers for loading and persisting prompts (Google Sheets or a local file)."""
 
 from __future__ import annotations
 
-from dataclasses import dataclass
-from datetime import datetime, timezone
-from typing import Dict, Optional
-
-try:  # Streamlit is optional outside the web app
-    import streamlit as st
-    from streamlit_gsheets import GSheetsConnection
-
-    try:  # runtime helper appeared in newer Streamlit releases
-        from streamlit import runtime  # type: ignore
-    except Exception:  # Older Streamlit versions simply omit the module
-        runtime = None  # type: ignore
-
-    _STREAMLIT_AVAILABLE = True
-except Exception:  # pragma: no cover - fallback when Streamlit is unavailable
-    st = None  # type: ignore
-    runtime = None  # type: ignore
-    GSheetsConnection = None  # type: ignore
-    _STREAMLIT_AVAILABLE = False
-
-try:
-    import pandas as pd
-except ImportError:  # pragma: no cover - pandas ships with Streamlit but guard just in case
-    pd = None  # type: ignore
-
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from config import (
+    PROMPT_BACKEND, PROMPT_BREAKER_COOLDOWN, PROMPT_BREAKER_FAILURES, PROMPT_CHECK_SECONDS,
+    PROMPT_DB_PATH, PROMPT_LOCAL_MIRROR, PROMPT_READ_TIMEOUT, PROMPT_REFRESH_SECONDS,
+    PROMPT_SLOW_SECONDS,
+)
+from services.prompt_backends import (
+    DEFAULT_WORKSHEET, GoogleSheetsBackend, PromptBackend, PromptRecord,
+    PromptUpdateResult, SQLitePromptBackend,
+)
 
 PROMPT_KEYS = ["router", "dbt", "ifs", "tre", "memory"]
-DEFAULT_WORKSHEET = "Prompts"
-
-
-def _current_timestamp() -> str:
-    """Return an ISO timestamp in UTC."""
 
-    return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
+@dataclass(frozen=True)
+class PromptSnapshot:
+    """Immutable parsed view of the prompt table.
 
-if _STREAMLIT_AVAILABLE:
+    ``version`` increases whenever the content hash changes, so callers can
+    cheaply tell whether prompts moved since they last looked.
+    """
 
-    @st.cache_data(ttl=300, show_spinner=False)
-    def _fetch_prompt_table(worksheet: Optional[str]) -> "pd.DataFrame":  # type: ignore # pragma: no cover - executed inside Streamlit
-        """Fetch the prompt table from Google Sheets."""
+    records: Dict[str, PromptRecord] = field(default_factory=dict)
+    version: int = 0
+    content_hash: str = ""
+    loaded_at: float = 0.0
 
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        read_kwargs = {"ttl": 0}
-        if worksheet:
-            return conn.read(worksheet=worksheet, **read_kwargs)
-        return conn.read(**read_kwargs)
+    @staticmethod
+    def hash_records(records: Dict[str, PromptRecord]) -> str:
+        payload = json.dumps({key: record.prompt for key, record in records.items()}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
 
-else:  # pragma: no cover - executed outside Streamlit runtime
 
-    def _fetch_prompt_table(worksheet: Optional[str]):
-        raise RuntimeError("Streamlit runtime is not available")
+def default_backends(worksheet: Optional[str] = None):
+    """Pick the primary backend and optional local mirror from config.
 
+    PROMPT_BACKEND=local reads and writes PROMPT_DB_PATH only. With the
+    default "sheets", Google Sheets is primary when a Streamlit runtime is
+    configured and every snapshot is mirrored one-way into PROMPT_DB_PATH;
+    processes without Streamlit (CLI, workers) read that mirror instead.
+    """
 
-@dataclass
-class PromptRecord:
-    """Simple structure describing a stored prompt."""
+    if PROMPT_BACKEND == "local":
+        return SQLitePromptBackend(PROMPT_DB_PATH), None
 
-    key: str
-    prompt: str
-    updated_at: Optional[str] = None
-    updated_by: Optional[str] = None
+    sheets = GoogleSheetsBackend(worksheet)
+    if sheets.available():
+        return sheets, SQLitePromptBackend(PROMPT_DB_PATH) if PROMPT_LOCAL_MIRROR else None
+    local = SQLitePromptBackend.if_exists(PROMPT_DB_PATH)
+    return (local or sheets), None
 
 
 class PromptStore:
-    """Loads and saves prompts to a shared Google Sheet when available."""
+    """Loads and saves prompts through a pluggable backend.
+
+    Reads never touch the backend on the request path: they return the
+    in-process snapshot. Local backends are re-read when their version
+    token changes (checked at most every ``check_seconds``); remote ones are
+    refreshed on a background thread once stale (stale-while-revalidate).
+    Repeated or slow failures open a circuit breaker that pauses refreshes
+    for a cooldown period while the last good snapshot keeps being served.
+    A remote read that has not returned within ``read_timeout`` counts as a
+    failure and is abandoned; its late result is discarded.
+    """
+
+    def __init__(
+        self,
+        worksheet: Optional[str] = None,
+        backend: Optional[PromptBackend] = None,
+        mirror: Optional[SQLitePromptBackend] = None,
+        refresh_seconds: float = PROMPT_REFRESH_SECONDS,
+        check_seconds: float = PROMPT_CHECK_SECONDS,
+        breaker_failures: int = PROMPT_BREAKER_FAILURES,
+        breaker_cooldown: float = PROMPT_BREAKER_COOLDOWN,
+        slow_seconds: float = PROMPT_SLOW_SECONDS,
+        read_timeout: float = PROMPT_READ_TIMEOUT,
+    ):
+        if backend is None:
+            backend, mirror = default_backends(worksheet)
+        self.backend = backend
+        self.mirror = mirror
+        self.worksheet = getattr(backend, "worksheet", worksheet or DEFAULT_WORKSHEET)
+        self.enabled = backend.available()
+        self.last_error: Optional[str] = getattr(backend, "last_error", None)
+        self.refresh_seconds = refresh_seconds
+        self.check_seconds = check_seconds
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.slow_seconds = slow_seconds
+        self.read_timeout = read_timeout
+
+        self._snapshot = PromptSnapshot()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        # Each remote read gets a generation; abandoned reads cannot
+        # install their result or clear the flag of a newer one
+        self._refresh_generation = 0
+        self._refresh_started = 0.0
+        self._failures = 0
+        self._breaker_open_until = 0.0
+        self._backend_version: Optional[int] = None
+        self._checked_at = 0.0
+        self._listeners: List[Callable[[PromptSnapshot], None]] = []
 
-    def __init__(self, worksheet: Optional[str] = None):
-        self.worksheet = worksheet or DEFAULT_WORKSHEET
-        self.enabled = False
-        self.last_error: Optional[str] = None
-
-        if not _STREAMLIT_AVAILABLE or pd is None:
+        if not self.enabled:
             return
-
-        if runtime is not None:
-            try:
-                if not runtime.exists():  # type: ignore[union-attr]
-                    return
-            except Exception:
-                pass
-
-        try:
-            connection_settings = {}
-            try:
-                connection_settings = st.secrets.get("connections", {}).get("gsheets", {})  # type: ignore[arg-type]
-            except Exception:
-                connection_settings = {}
-
-            worksheet_secret = connection_settings.get("worksheet") if isinstance(connection_settings, dict) else None
-            if worksheet_secret:
-                self.worksheet = str(worksheet_secret)
-
-            # Attempt a lightweight access to verify configuration.
-            try:
-                _ = connection_settings.get("spreadsheet")
-            except Exception:
-                pass
-
-            self.enabled = True
-        except Exception as exc:  # pragma: no cover - defensive guard
-            self.last_error = str(exc)
-            self.enabled = False
+        if backend.local:
+            # A local read costs microseconds; load before the first request
+            self._reload_local(force=True)
+        else:
+            # Warm the snapshot without blocking the caller
+            self._start_refresh()
 
     # ------------------------------------------------------------------
     # Loading
     # ------------------------------------------------------------------
-    def load_all(self) -> Dict[str, PromptRecord]:
-        """Return prompts stored remotely keyed by agent."""
+    def snapshot(self) -> PromptSnapshot:
+        """Return the current snapshot, refreshing it if it is out of date."""
 
         if not self.enabled:
-            return {}
+            return self._snapshot
+        now = time.monotonic()
+        if self.backend.local:
+            if now - self._checked_at >= self.check_seconds:
+                self._reload_local()
+        elif now - self._snapshot.loaded_at >= self.refresh_seconds:
+            self._start_refresh()
+        return self._snapshot
 
-        try:
-            table = _fetch_prompt_table(self.worksheet)
-        except Exception as exc:  # pragma: no cover - logging via last_error
-            self.last_error = str(exc)
-            self.enabled = False
-            return {}
+    def load_all(self) -> Dict[str, PromptRecord]:
+        """Return prompts stored in the backend keyed by agent."""
 
-        if table is None or table.empty:
+        if not self.enabled:
             return {}
+        return self.snapshot().records
 
-        prompts: Dict[str, PromptRecord] = {}
-
-        for _, row in table.iterrows():
-            key = str(row.get("key", "")).strip()
-            if not key:
-                continue
-            prompts[key] = PromptRecord(
-                key=key,
-                prompt=str(row.get("prompt", "")),
-                updated_at=str(row.get("updated_at", "")) or None,
-                updated_by=str(row.get("updated_by", "")) or None,
-            )
+    def subscribe(self, callback: Callable[[PromptSnapshot], None]) -> None:
+        """Call ``callback(snapshot)`` whenever a refresh changes the prompts."""
 
-        return prompts
+        with self._lock:
+            self._listeners.append(callback)
 
     def get_all(self, defaults: Dict[str, str]) -> Dict[str, str]:
-        """Return defaults overlaid with remote overrides."""
+        """Return defaults overlaid with stored overrides."""
 
         merged = dict(defaults)
         overrides = self.load_all()
@@ -162,80 +172,177 @@ class PromptStore:
     # Saving
     # ------------------------------------------------------------------
     def update_prompt(self, key: str, prompt: str, updated_by: Optional[str] = None) -> bool:
-        """Persist a prompt back to Google Sheets."""
-
-        if not self.enabled or pd is None:
-            return False
+        """Persist a prompt back to the backend."""
+
+        return self.update_prompts({key: prompt}, updated_by=updated_by).saved
+
+    def update_prompts(
+        self,
+        prompts: Dict[str, str],
+        updated_by: Optional[str] = None,
+        expected_updated_at: Optional[Dict[str, Optional[str]]] = None,
+    ) -> PromptUpdateResult:
+        """Persist several prompts with one backend read and one write.
+
+        ``expected_updated_at`` maps keys to the ``updated_at`` the caller saw
+        when it started editing (``None`` for prompts that were not stored).
+        If any edited row changed since then, nothing is written and the
+        conflicting keys are returned so the editor can reload. The SQLite
+        backend checks and writes in one transaction; Sheets has no
+        compare-and-swap, so there the race window is only narrowed to the
+        time between its read and write.
+        """
 
-        try:
-            conn = st.connection("gsheets", type=GSheetsConnection)
-            read_kwargs = {"ttl": 0}
-            if self.worksheet:
-                table = conn.read(worksheet=self.worksheet, **read_kwargs)
-            else:
-                table = conn.read(**read_kwargs)
-        except Exception as exc:
-            self.last_error = str(exc)
-            self.enabled = False
-            return False
-
-        if table is None or table.empty:
-            table = pd.DataFrame(columns=["key", "prompt", "updated_at", "updated_by"])
-
-        for column in ["key", "prompt", "updated_at", "updated_by"]:
-            if column not in table.columns:
-                table[column] = ""
-
-        mask = table["key"].astype(str) == str(key)
-        timestamp = _current_timestamp()
-
-        if mask.any():
-            table.loc[mask, "prompt"] = prompt
-            table.loc[mask, "updated_at"] = timestamp
-            if updated_by is not None:
-                table.loc[mask, "updated_by"] = updated_by
-        else:
-            new_row = {
-                "key": key,
-                "prompt": prompt,
-                "updated_at": timestamp,
-                "updated_by": updated_by or "",
-            }
-            table = pd.concat([table, pd.DataFrame([new_row])], ignore_index=True)
-
-        try:
-            if self.worksheet:
-                conn.update(worksheet=self.worksheet, data=table)
-            else:
-                conn.update(data=table)
-        except Exception as exc:
-            self.last_error = str(exc)
-            return False
-
-        self.last_error = None
-        self.clear_cache()
-        return True
+        if not self.enabled:
+            return PromptUpdateResult(saved=False)
+        if not prompts:
+            return PromptUpdateResult(saved=True)
+
+        result, records = self.backend.write(prompts, updated_by, expected_updated_at)
+        if result.error and records is None:
+            self._record_failure(result.error)
+            return result
+
+        self.last_error = result.error
+        if records is not None:
+            # Installing the backend's view notifies subscribers
+            # (e.g. TherapyGraph) exactly once; on conflict it shows the winner
+            self._install(records)
+        return result
 
     # ------------------------------------------------------------------
     # Cache helpers
     # ------------------------------------------------------------------
     def clear_cache(self) -> None:
-        """Invalidate any cached prompt data."""
+        """Mark the snapshot stale and revalidate it."""
 
-        if _STREAMLIT_AVAILABLE:
-            try:
-                _fetch_prompt_table.clear()  # type: ignore[attr-defined]
-            except Exception:
-                pass
+        if not self.enabled:
+            return
+        if self.backend.local:
+            self._reload_local(force=True)
+        else:
+            self._start_refresh(force=True)
 
     def status(self) -> str:
         """Return a human-readable status string for the UI."""
 
         if self.enabled:
-            return "Connected"
+            label = f"{self.backend.name}, v{self._snapshot.version}"
+            if time.monotonic() < self._breaker_open_until:
+                return f"{label} (backend unavailable, serving cached prompts)"
+            if self.mirror is not None:
+                return f"{label}, mirrored to {self.mirror.path}"
+            return label
         if self.last_error:
             return f"Disabled ({self.last_error})"
         return "Disabled"
 
+    # ------------------------------------------------------------------
+    # Refresh
+    # ------------------------------------------------------------------
+    def _reload_local(self, force: bool = False) -> None:
+        self._checked_at = time.monotonic()
+        try:
+            version = self.backend.version()
+            if not force and version == self._backend_version:
+                return
+            records = self.backend.read()
+        except Exception as exc:
+            self._record_failure(str(exc))
+            return
+        self._backend_version = version
+        self._install(records)
+
+    def _start_refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        hung = None
+        with self._lock:
+            if self._refreshing:
+                if now - self._refresh_started < self.read_timeout:
+                    return
+                # The read never returned: give up on it and count a failure
+                hung = now - self._refresh_started
+                self._refreshing = False
+                self._refresh_generation += 1
+        if hung is not None:
+            self._record_failure(f"read timed out ({hung:.1f}s)")
+        with self._lock:
+            if self._refreshing:
+                return
+            # Breaker open: keep serving the last snapshot until the cooldown ends
+            if now < self._breaker_open_until and not force:
+                return
+            self._refreshing = True
+            self._refresh_generation += 1
+            self._refresh_started = now
+            generation = self._refresh_generation
+        threading.Thread(target=self._refresh, args=(generation,), name="prompt-refresh", daemon=True).start()
+
+    def _refresh(self, generation: int) -> None:
+        started = time.monotonic()
+        try:
+            records = self.backend.read()
+        except Exception as exc:  # pragma: no cover - network failures
+            with self._lock:
+                current = generation == self._refresh_generation
+            if current:
+                self._record_failure(str(exc))
+            return
+        finally:
+            with self._lock:
+                if generation == self._refresh_generation:
+                    self._refreshing = False
+
+        with self._lock:
+            if generation != self._refresh_generation:
+                # Abandoned after read_timeout; a newer read owns the snapshot
+                return
+        self._install(records)
+        if time.monotonic() - started > self.slow_seconds:
+            # Data is still fresh, but a slow backend counts toward the breaker
+            self._record_failure(f"slow response ({time.monotonic() - started:.1f}s)")
+        else:
+            with self._lock:
+                self._failures = 0
+            self.last_error = None
+
+    def _record_failure(self, error: str) -> None:
+        self.last_error = error
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.breaker_failures:
+                self._breaker_open_until = time.monotonic() + self.breaker_cooldown
+                self._failures = 0
+
+    def _install(self, records: Dict[str, PromptRecord]) -> None:
+        content_hash = PromptSnapshot.hash_records(records)
+        with self._lock:
+            current = self._snapshot
+            changed = content_hash != current.content_hash
+            version = current.version + 1 if changed else current.version
+            self._snapshot = PromptSnapshot(records, version, content_hash, time.monotonic())
+            listeners = list(self._listeners) if changed else []
+
+        if changed and self.mirror is not None:
+            # One-way sync: the local file follows the primary backend
+            try:
+                self.mirror.replace_all(records)
+            except Exception as exc:  # pragma: no cover - disk errors must not block prompts
+                print(f"Prompt mirror update failed: {exc}")
 
-__all__ = ["PromptStore", "PROMPT_KEYS", "DEFAULT_WORKSHEET"]
+        for callback in listeners:
+            try:
+                callback(self._snapshot)
+            except Exception as exc:  # pragma: no cover - listener bugs must not stop refreshes
+                print(f"Prompt listener failed: {exc}")
+
+
+__all__ = [
+    "DEFAULT_WORKSHEET",
+    "PROMPT_KEYS",
+    "PromptRecord",
+    "PromptSnapshot",
+    "PromptStore",
+    "PromptUpdateResult",
+    "default_backends",
+]
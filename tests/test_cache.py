@@ -0,0 +1,139 @@
+"""Кеш ответов LLM: agents.cache.LLMResponseCache."""
+
+import pytest
+from langchain.schema import HumanMessage, SystemMessage
+
+from agents import cache as cache_module
+from agents.cache import LLMResponseCache
+
+MESSAGES = [SystemMessage(content="Ты роутер"), HumanMessage(content="Мне тревожно")]
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = LLMResponseCache(str(tmp_path / "llm_cache.db"), ttl_seconds=60)
+    yield cache
+    cache.close()
+
+
+def reopen(cache: LLMResponseCache) -> LLMResponseCache:
+    cache.close()
+    return LLMResponseCache(cache.db_path, ttl_seconds=cache.ttl_seconds)
+
+
+def test_key_is_stable():
+    assert LLMResponseCache.make_key(MESSAGES, "gpt", 0.2) == LLMResponseCache.make_key(list(MESSAGES), "gpt", 0.2)
+
+
+@pytest.mark.parametrize(
+    "changed",
+    [
+        ([SystemMessage(content="Ты роутер"), HumanMessage(content="Мне грустно")], "gpt", 0.2, None, None),
+        ([HumanMessage(content="Ты роутер"), HumanMessage(content="Мне тревожно")], "gpt", 0.2, None, None),
+        (MESSAGES, "claude", 0.2, None, None),
+        (MESSAGES, "gpt", 0.7, None, None),
+        (MESSAGES, "gpt", 0.2, 256, None),
+        (MESSAGES, "gpt", 0.2, None, {"response_format": {"type": "json_object"}}),
+    ],
+)
+def test_key_depends_on_request(changed):
+    assert LLMResponseCache.make_key(*changed) != LLMResponseCache.make_key(MESSAGES, "gpt", 0.2)
+
+
+def test_empty_options_match_no_options():
+    assert LLMResponseCache.make_key(MESSAGES, "gpt", 0.2, None, {}) == LLMResponseCache.make_key(MESSAGES, "gpt", 0.2)
+
+
+def test_memory_and_disk_hits(cache):
+    cache.set("k", "ответ", "router", "p1")
+    assert cache.get("k") == "ответ"
+
+    cache = reopen(cache)
+    try:
+        assert cache.get("k") == "ответ"
+        assert cache.get("k") == "ответ"
+        stats = cache.stats()
+        assert (stats["disk_hits"], stats["memory_hits"]) == (1, 1)
+    finally:
+        cache.close()
+
+
+def test_miss(cache):
+    assert cache.get("нет") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_expires_in_memory(cache, clock):
+    cache.set("k", "ответ", "router", "p1")
+    clock.now += 60
+    assert cache.get("k") == "ответ"
+    clock.now += 1
+    assert cache.get("k") is None
+
+
+def test_ttl_expires_on_disk(cache, clock):
+    cache.set("k", "ответ", "router", "p1")
+    cache = reopen(cache)
+    try:
+        clock.now += 61
+        assert cache.get("k") is None
+        assert cache._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] == 0
+    finally:
+        cache.close()
+
+
+def test_invalidate_keeps_current_prompt(cache):
+    cache.set("old", "1", "router", "p1")
+    cache.set("new", "2", "router", "p2")
+    cache.set("other", "3", "memory", "p1")
+    cache.invalidate("router", keep_prompt_hash="p2")
+
+    assert cache.get("old") is None
+    assert cache.get("new") == "2"
+    assert cache.get("other") == "3"
+    cache = reopen(cache)
+    try:
+        assert cache.get("old") is None
+        assert cache.get("new") == "2"
+    finally:
+        cache.close()
+
+
+def test_memory_lru_eviction(tmp_path, clock):
+    cache = LLMResponseCache(str(tmp_path / "lru.db"), max_memory_items=2)
+    try:
+        for key in ("a", "b", "c"):
+            cache.set(key, key, "router", "p")
+        assert list(cache._memory) == ["b", "c"]
+        # Вытесненная из памяти запись читается с диска
+        assert cache.get("a") == "a"
+        assert cache.stats()["disk_hits"] == 1
+    finally:
+        cache.close()
+
+
+def test_disk_trim_keeps_recent(tmp_path, clock):
+    cache = LLMResponseCache(str(tmp_path / "trim.db"), max_disk_items=10)
+    try:
+        for index in range(100):
+            clock.now += 1
+            cache.set(f"k{index}", "x", "router", "p")
+        keys = {row[0] for row in cache._conn.execute("SELECT key FROM llm_cache")}
+        assert keys == {f"k{index}" for index in range(90, 100)}
+    finally:
+        cache.close()
@@ -0,0 +1,141 @@
+"""Миграции схемы на существующей базе: core.migrations и MemoryStorage."""
+
+import sqlite3
+
+import pytest
+
+from core import migrations
+from core.storage import MemoryStorage
+
+LATEST = migrations.MIGRATIONS[-1][0]
+
+
+def columns(conn: sqlite3.Connection, table: str):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def indexes(conn: sqlite3.Connection):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def fill_legacy(conn: sqlite3.Connection) -> None:
+    """Данные в том виде, в каком их писала версия 1."""
+
+    conn.execute("INSERT INTO sessions (user_id) VALUES ('u1')")
+    conn.executemany(
+        "INSERT INTO messages (session_id, role, content, approach, confidence, reasoning) VALUES (1, ?, ?, ?, ?, ?)",
+        [
+            ("user", "мне тревожно", None, None, None),
+            ("assistant", "ответ", "IFS", 0.8, "Части спорят"),
+            ("user", "снова", None, None, None),
+            ("assistant", "ответ", "TRE", None, "Локальный классификатор"),
+            ("user", "и снова", None, None, None),
+            ("assistant", "ответ", "DBT", 0.5, "Использую DBT по умолчанию"),
+        ],
+    )
+    conn.execute("INSERT INTO insights (session_id, insight, type, approach) VALUES (1, 'избегание', 'pattern', 'IFS')")
+    conn.commit()
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """База до версионирования схемы: таблицы есть, schema_version нет."""
+
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    for statement in migrations.MIGRATIONS[0][2]:
+        conn.execute(statement)
+    fill_legacy(conn)
+    conn.close()
+    return path
+
+
+def open_storage(path: str) -> MemoryStorage:
+    storage = MemoryStorage(path)
+    assert storage.schema_version == LATEST
+    return storage
+
+
+def test_versions_are_sequential():
+    assert [migration[0] for migration in migrations.MIGRATIONS] == list(range(1, LATEST + 1))
+
+
+def test_unversioned_database_is_upgraded(legacy_db):
+    storage = open_storage(legacy_db)
+    try:
+        conn = storage._connection()
+        assert {"summary", "summary_until_id", "resume_token"} <= columns(conn, "sessions")
+        assert "route_source" in columns(conn, "messages")
+        assert {
+            "idx_messages_session_id",
+            "idx_insights_session_id",
+            "idx_metrics_session_turn",
+            "idx_sessions_resume_token",
+        } <= indexes(conn)
+        applied = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+        assert applied == list(range(1, LATEST + 1))
+
+        # Данные старой схемы на месте и читаются новым кодом
+        history = storage.get_session_history(1)
+        assert [message["content"] for message in history][:2] == ["мне тревожно", "ответ"]
+        assert storage.get_session_insights(1)[0]["insight"] == "избегание"
+        assert storage.find_session_by_token("") is None
+    finally:
+        storage.close()
+
+
+@pytest.mark.parametrize("applied", range(1, LATEST))
+def test_upgrade_from_each_version(tmp_path, applied):
+    path = str(tmp_path / f"v{applied}.db")
+    conn = sqlite3.connect(path)
+    assert migrations.apply_migrations(conn, migrations.MIGRATIONS[:applied]) == applied
+    fill_legacy(conn)
+    conn.close()
+
+    storage = open_storage(path)
+    try:
+        assert len(storage.get_session_history(1)) == 6
+        session_id = storage.create_session("u2", resume_token="token")
+        assert storage.find_session_by_token("token") == session_id
+    finally:
+        storage.close()
+
+
+def test_route_source_backfill(legacy_db):
+    storage = open_storage(legacy_db)
+    try:
+        rows = storage._connection().execute(
+            "SELECT role, approach, route_source FROM messages ORDER BY id"
+        ).fetchall()
+        assert [row[2] for row in rows if row[0] == "user"] == [None, None, None]
+        assert [(row[1], row[2]) for row in rows if row[0] == "assistant"] == [
+            ("IFS", "llm"), ("TRE", "classifier"), ("DBT", "default"),
+        ]
+        # В эталон регрессии роутера идут только решения LLM
+        assert [example["approach"] for example in storage.get_routing_examples()] == ["IFS"]
+    finally:
+        storage.close()
+
+
+def test_reopen_is_noop(legacy_db):
+    open_storage(legacy_db).close()
+    storage = open_storage(legacy_db)
+    try:
+        count = storage._connection().execute("SELECT COUNT(*) FROM schema_version").fetchone()[0]
+        assert count == LATEST
+    finally:
+        storage.close()
+
+
+def test_failed_migration_rolls_back(tmp_path):
+    path = str(tmp_path / "broken.db")
+    conn = sqlite3.connect(path)
+    broken = migrations.MIGRATIONS[:1] + [(2, "сломанная", [
+        "CREATE INDEX idx_broken ON messages(session_id)",
+        "ALTER TABLE nowhere ADD COLUMN x TEXT",
+    ])]
+    with pytest.raises(sqlite3.OperationalError):
+        migrations.apply_migrations(conn, broken)
+    assert migrations.schema_version(conn) == 1
+    assert "idx_broken" not in indexes(conn)
+    conn.close()
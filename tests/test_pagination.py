@@ -0,0 +1,118 @@
+"""Постраничное чтение по id и NDJSON-экспорт: MemoryStorage."""
+
+import json
+
+import pytest
+
+from core.storage import MemoryStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = MemoryStorage(str(tmp_path / "sessions.db"))
+    yield storage
+    storage.close()
+
+
+def add_turns(storage: MemoryStorage, session_id: int, turns: int, insights: int = 0) -> None:
+    for index in range(turns):
+        storage.save_interaction(session_id, {
+            "user_message": f"вопрос {index}",
+            "specialist_response": f"ответ {index}",
+            "current_approach": "DBT",
+            "confidence": 0.5,
+            "reasoning": "",
+            "insights": {"insights": [f"инсайт {index}"] if index < insights else []},
+        })
+
+
+def contents(messages):
+    return [message["content"] for message in messages]
+
+
+@pytest.mark.parametrize("turns, page_size", [(0, 3), (1, 2), (2, 2), (2, 4), (3, 2), (5, 1), (5, 500)])
+def test_pages_cover_history_exactly_once(storage, turns, page_size):
+    session_id = storage.create_session("u")
+    add_turns(storage, session_id, turns)
+    pages = list(storage._pages(storage.get_history_page, session_id, page_size))
+
+    assert all(0 < len(page) <= page_size for page in pages)
+    messages = [message for page in pages for message in page]
+    ids = [message["id"] for message in messages]
+    assert ids == sorted(set(ids))
+    assert contents(messages) == contents(storage.get_session_history(session_id))
+    assert len(messages) == 2 * turns
+
+
+def test_page_after_cursor(storage):
+    session_id = storage.create_session("u")
+    add_turns(storage, session_id, 3)
+    first = storage.get_history_page(session_id, limit=4)
+    assert contents(first) == ["вопрос 0", "ответ 0", "вопрос 1", "ответ 1"]
+
+    rest = storage.get_history_page(session_id, after_id=first[-1]["id"], limit=4)
+    assert contents(rest) == ["вопрос 2", "ответ 2"]
+    assert storage.get_history_page(session_id, after_id=rest[-1]["id"], limit=4) == []
+
+
+def test_cursor_from_other_session_does_not_leak(storage):
+    first = storage.create_session("u")
+    second = storage.create_session("u")
+    add_turns(storage, first, 2)
+    add_turns(storage, second, 2)
+    add_turns(storage, first, 1)
+
+    history = list(storage.iter_session_history(first, page_size=1))
+    assert contents(history) == ["вопрос 0", "ответ 0", "вопрос 1", "ответ 1", "вопрос 0", "ответ 0"]
+    assert {message["id"] for message in history}.isdisjoint(
+        message["id"] for message in storage.iter_session_history(second)
+    )
+
+
+def test_rows_added_between_pages_are_read_once(storage):
+    session_id = storage.create_session("u")
+    add_turns(storage, session_id, 2)
+    history = storage.iter_session_history(session_id, page_size=2)
+    assert contents([next(history), next(history)]) == ["вопрос 0", "ответ 0"]
+    # Новый ход после выдачи первой страницы попадает в хвост ровно один раз
+    add_turns(storage, session_id, 1)
+    assert contents(history) == ["вопрос 1", "ответ 1", "вопрос 0", "ответ 0"]
+
+
+def test_insight_pages(storage):
+    session_id = storage.create_session("u")
+    add_turns(storage, session_id, 5, insights=5)
+    insights = list(storage.iter_session_insights(session_id, page_size=2))
+    assert [insight["insight"] for insight in insights] == [f"инсайт {index}" for index in range(5)]
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 3, 500])
+def test_session_ids_by_user(storage, page_size):
+    created = [storage.create_session(user) for user in ("a", "b", "a", "a", "b")]
+    assert list(storage.iter_session_ids(page_size=page_size)) == created
+    assert list(storage.iter_session_ids("a", page_size=page_size)) == [created[0], created[2], created[3]]
+    assert list(storage.iter_session_ids("нет", page_size=page_size)) == []
+
+
+def test_export_ndjson(storage):
+    first = storage.create_session("u")
+    second = storage.create_session("u")
+    add_turns(storage, first, 2, insights=1)
+    add_turns(storage, second, 1)
+
+    chunks = list(storage.export_ndjson([first, second], page_size=3))
+    # По чанку на страницу: 3 + 1 сообщение и 1 инсайт первой сессии, 2 сообщения второй
+    assert len(chunks) == 4
+    records = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+    assert [(record["session_id"], record["kind"]) for record in records] == (
+        [(first, "message")] * 4 + [(first, "insight")] + [(second, "message")] * 2
+    )
+    assert records[4]["insight"] == "инсайт 0"
+
+    without_insights = "".join(storage.export_ndjson([first], include_insights=False))
+    assert all(json.loads(line)["kind"] == "message" for line in without_insights.splitlines())
+
+
+def test_export_of_empty_session(storage):
+    session_id = storage.create_session("u")
+    assert list(storage.export_ndjson([session_id])) == []
@@ -0,0 +1,73 @@
+"""Разбор JSON-ответов агентов: agents.parsing."""
+
+import pytest
+
+from agents.parsing import IncrementalJSONFields, extract_json
+
+
+def test_plain_object():
+    assert extract_json('{"approach": "CBT", "confidence": 0.8}') == ({"approach": "CBT", "confidence": 0.8}, False)
+
+
+def test_object_inside_code_fence():
+    text = 'Вот ответ:\n```json\n{"a": {"b": [1, 2]}}\n```\nГотово.'
+    assert extract_json(text) == ({"a": {"b": [1, 2]}}, False)
+
+
+def test_first_of_several_objects():
+    assert extract_json('{"a": 1} {"b": 2}') == ({"a": 1}, False)
+
+
+def test_braces_in_prose_before_object():
+    assert extract_json('Формат {как в примере}, ответ: {"a": 1}') == ({"a": 1}, False)
+
+
+def test_mismatched_bracket_then_object():
+    assert extract_json('{] затем {"a": 1}') == ({"a": 1}, False)
+
+
+def test_broken_outer_object_does_not_return_inner():
+    assert extract_json('{"a": [1, 2, {"approach": "IFS"} ,, }') == (None, False)
+
+
+def test_invalid_balanced_outer_object_does_not_return_inner():
+    assert extract_json('{"a": {"approach": "IFS"}, oops}') == (None, False)
+
+
+def test_object_after_invalid_balanced_candidate():
+    assert extract_json('{"a": {"b": 1}, oops} {"c": 2}') == ({"c": 2}, False)
+
+
+def test_braces_inside_strings_are_ignored():
+    assert extract_json('{"text": "скобки } и { в строке"}') == ({"text": "скобки } и { в строке"}, False)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"a": "обор', {"a": "обор"}),
+        ('{"a": 1, "b": [1, 2', {"a": 1, "b": [1, 2]}),
+        ('{"a": 1, "b": ', {"a": 1}),
+        ('{"a": "x\\', {"a": "x"}),
+    ],
+)
+def test_truncated_object_is_completed(text, expected):
+    assert extract_json(text) == (expected, True)
+
+
+@pytest.mark.parametrize("text", ["", "нет json", "} без начала", "[1, 2]"])
+def test_no_object(text):
+    assert extract_json(text) == (None, False)
+
+
+def test_long_text_of_open_braces():
+    # Каждый символ просматривается один раз: без квадратичного перебора
+    assert extract_json("{" * 200_000) == (None, False)
+
+
+def test_incremental_fields():
+    fields = IncrementalJSONFields(["approach", "confidence"])
+    assert fields.feed('{"approach": "DB') == {}
+    assert fields.feed('T", "confidence": 0.7') == {"approach": "DBT"}
+    assert fields.feed(', "reasoning": "') == {"confidence": 0.7}
+    assert fields.values == {"approach": "DBT", "confidence": 0.7}
@@ -0,0 +1,25 @@
+"""Разбор решения роутера: RouterAgent._validate и _route_update."""
+
+import pytest
+
+from agents.specialists import RouterAgent
+
+# _validate не обращается к LLM: экземпляр без __init__ не создает клиента
+ROUTER = RouterAgent.__new__(RouterAgent)
+
+
+@pytest.mark.parametrize("raw", ["IFS", "ifs", " Ifs ", "IFS\n"])
+def test_stream_and_final_parse_agree(raw):
+    assert RouterAgent._route_update({"approach": raw})["current_approach"] == "IFS"
+    assert ROUTER._validate({"approach": raw, "confidence": "0.6"}) == {"approach": "IFS", "confidence": 0.6}
+
+
+@pytest.mark.parametrize("raw", ["", None, "EMDR", 3])
+def test_unknown_approach_is_ignored(raw):
+    assert "current_approach" not in RouterAgent._route_update({"approach": raw})
+    assert ROUTER._validate({"approach": raw}) is None
+
+
+def test_partial_fields():
+    update = RouterAgent._route_update({"approach": "dbt", "confidence": 0.4, "reasoning": "кратко"})
+    assert update == {"current_approach": "DBT", "confidence": 0.4, "reasoning": "кратко"}
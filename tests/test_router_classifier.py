@@ -0,0 +1,89 @@
+"""Локальный классификатор роутера и его обучающие данные."""
+
+import json
+
+import pytest
+
+from agents.base import APPROACHES, ROUTE_CLASSIFIER, ROUTE_DEFAULT, ROUTE_LLM, ROUTE_PARTIAL
+from agents.classifier import LocalRouterClassifier, prompt_hash, prompt_seed_examples, train_classifier
+from agents.prompts import ROUTER_PROMPT
+from core.storage import MemoryStorage
+
+EXAMPLES = [
+    ("Меня накрывают эмоции, не могу успокоиться", "DBT"),
+    ("Сильная злость, хочется сорваться", "DBT"),
+    ("Часть меня хочет уйти, а другая часть держится", "IFS"),
+    ("Внутренний критик не дает покоя", "IFS"),
+    ("Тело зажато, плечи напряжены после стресса", "TRE"),
+    ("Дрожь в теле и напряжение в мышцах", "TRE"),
+]
+
+
+@pytest.fixture(scope="module")
+def model():
+    return train_classifier(EXAMPLES * 3)
+
+
+def test_seed_examples_cover_all_approaches():
+    seeds = prompt_seed_examples(ROUTER_PROMPT)
+    assert {label for _, label in seeds} == set(APPROACHES)
+    assert all(text.strip() for text, _ in seeds)
+
+
+def test_fits_training_examples(model):
+    for text, label in EXAMPLES:
+        assert model.predict(text)[0] == label
+    probs = model.predict_proba("Внутренний критик снова ругает")
+    assert set(probs) == set(APPROACHES)
+    assert sum(probs.values()) == pytest.approx(1.0)
+
+
+def test_model_is_bound_to_router_prompt(model):
+    assert model.matches(ROUTER_PROMPT)
+    assert not model.matches(ROUTER_PROMPT + "\nНовое правило.")
+
+
+def test_save_and_load_roundtrip(model, tmp_path):
+    path = str(tmp_path / "router.json")
+    model.save(path)
+    loaded = LocalRouterClassifier.load(path)
+    assert loaded.prompt_hash == model.prompt_hash
+    for text, _ in EXAMPLES:
+        assert loaded.predict_proba(text) == pytest.approx(model.predict_proba(text))
+
+
+def test_model_without_prompt_hash_belongs_to_default_prompt(model, tmp_path):
+    path = tmp_path / "old.json"
+    model.save(str(path))
+    payload = json.loads(path.read_text(encoding="utf-8"))
+    del payload["prompt_hash"]
+    path.write_text(json.dumps(payload), encoding="utf-8")
+    assert LocalRouterClassifier.load(str(path)).prompt_hash == prompt_hash(ROUTER_PROMPT)
+
+
+def test_load_if_exists(tmp_path):
+    assert LocalRouterClassifier.load_if_exists(None) is None
+    assert LocalRouterClassifier.load_if_exists(str(tmp_path / "missing.json")) is None
+    broken = tmp_path / "broken.json"
+    broken.write_text("{", encoding="utf-8")
+    assert LocalRouterClassifier.load_if_exists(str(broken)) is None
+
+
+def test_routing_examples_are_llm_decisions_only(tmp_path):
+    storage = MemoryStorage(str(tmp_path / "sessions.db"))
+    try:
+        session_id = storage.create_session("u")
+        for index, source in enumerate((ROUTE_LLM, ROUTE_CLASSIFIER, ROUTE_DEFAULT, ROUTE_PARTIAL, ROUTE_LLM)):
+            storage.save_messages(session_id, {
+                "user_message": f"сообщение {index}",
+                "specialist_response": "ответ",
+                "current_approach": "IFS",
+                "confidence": 0.9,
+                "reasoning": source,
+                "route_source": source,
+            })
+        examples = storage.get_routing_examples()
+        assert [example["message"] for example in examples] == ["сообщение 4", "сообщение 0"]
+        assert [example["message"] for example in storage.get_routing_examples(limit=1)] == ["сообщение 4"]
+    finally:
+        storage.close()
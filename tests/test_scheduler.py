@@ -0,0 +1,192 @@
+"""Планировщик запросов к LLM: agents.scheduler.LLMScheduler."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from agents import scheduler as scheduler_module
+from agents.scheduler import BACKGROUND, INTERACTIVE, ROUTING, LLMOverloaded, LLMScheduler
+
+NO_USAGE = (None, None)
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code: int, retry_after: float = None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = type("Response", (), {"headers": headers})()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Повторы не ждут по-настоящему; задержки запоминаются
+    delays = []
+    monkeypatch.setattr(scheduler_module.time, "sleep", delays.append)
+    return delays
+
+
+@pytest.fixture
+def max_jitter(monkeypatch):
+    monkeypatch.setattr(scheduler_module.random, "uniform", lambda low, high: high)
+
+
+def _raise_next(errors):
+    if errors:
+        raise errors.pop(0)
+    return "ok"
+
+
+def wait_until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "условие не выполнилось"
+        time.sleep(0.005)
+
+
+def run_queued(scheduler: LLMScheduler, requests):
+    """Поставить запросы в очередь за занятым слотом и вернуть порядок допуска."""
+
+    order = []
+
+    def run(provider, priority):
+        scheduler.acquire(provider, priority, 0, "test")
+        order.append((provider, priority))
+        scheduler.release(provider, 0, NO_USAGE)
+
+    scheduler.acquire("holder", INTERACTIVE, 0, "test")
+    threads = [threading.Thread(target=run, args=request) for request in requests]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: scheduler.stats()["waiting"] == len(requests))
+    scheduler.release("holder", 0, NO_USAGE)
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_priority_order_within_provider():
+    scheduler = LLMScheduler(max_concurrency=1)
+    order = run_queued(scheduler, [("openai", BACKGROUND), ("openai", ROUTING), ("openai", INTERACTIVE)])
+    assert order == [("openai", INTERACTIVE), ("openai", ROUTING), ("openai", BACKGROUND)]
+
+
+def test_free_slot_goes_to_higher_priority_provider():
+    scheduler = LLMScheduler(max_concurrency=1)
+    order = run_queued(scheduler, [("anthropic", BACKGROUND), ("openai", INTERACTIVE)])
+    assert order == [("openai", INTERACTIVE), ("anthropic", BACKGROUND)]
+
+
+def test_stats_by_priority():
+    scheduler = LLMScheduler(max_concurrency=1)
+    scheduler.acquire("openai", INTERACTIVE, 0, "test")
+    thread = threading.Thread(target=lambda: scheduler.acquire("openai", BACKGROUND, 0, "test"))
+    thread.start()
+    wait_until(lambda: scheduler.stats()["waiting"] == 1)
+    stats = scheduler.stats()
+    assert stats["in_flight"] == 1
+    assert stats["by_priority"] == {"interactive": 0, "routing": 0, "background": 1}
+    scheduler.release("openai", 0, NO_USAGE)
+    thread.join(5)
+    assert scheduler.stats()["admitted"] == 2
+
+
+def test_queue_timeout_raises_overloaded():
+    scheduler = LLMScheduler(max_concurrency=1, queue_timeout=0.05)
+    scheduler.acquire("openai", INTERACTIVE, 0, "test")
+    with pytest.raises(LLMOverloaded):
+        scheduler.acquire("openai", BACKGROUND, 0, "test")
+    stats = scheduler.stats()
+    assert (stats["overloaded"], stats["waiting"]) == (1, 0)
+
+
+def test_retries_transient_errors(sleeps, max_jitter):
+    scheduler = LLMScheduler(max_retries=3, backoff_base=0.5, backoff_max=20.0)
+    errors = [ProviderError(503), ProviderError(429)]
+    assert scheduler.call("dbt", "gpt-4o", [], lambda: _raise_next(errors)) == "ok"
+    assert sleeps == [0.5, 1.0]
+    stats = scheduler.stats()
+    assert (stats["retries"], stats["failed"], stats["in_flight"]) == (2, 0, 0)
+
+
+def test_backoff_doubles_up_to_the_cap(sleeps, max_jitter):
+    scheduler = LLMScheduler(max_retries=5, backoff_base=1.0, backoff_max=4.0)
+    errors = [ProviderError(429)] * 4
+    scheduler.call("dbt", "gpt-4o", [], lambda: _raise_next(errors))
+    assert sleeps == [1.0, 2.0, 4.0, 4.0]
+
+
+def test_retry_after_beats_small_jitter(sleeps, monkeypatch):
+    monkeypatch.setattr(scheduler_module.random, "uniform", lambda low, high: low)
+    scheduler = LLMScheduler(max_retries=1)
+    errors = [ProviderError(429, retry_after=2.0)]
+    assert scheduler.call("dbt", "gpt-4o", [], lambda: _raise_next(errors)) == "ok"
+    assert sleeps == [2.0]
+
+
+def test_gives_up_after_max_retries(sleeps):
+    scheduler = LLMScheduler(max_retries=2)
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        raise ProviderError(500)
+
+    with pytest.raises(ProviderError):
+        scheduler.call("dbt", "gpt-4o", [], call)
+    assert len(attempts) == 3
+    stats = scheduler.stats()
+    assert (stats["retries"], stats["failed"], stats["in_flight"]) == (2, 1, 0)
+
+
+@pytest.mark.parametrize("error", [ProviderError(400), ValueError("плохой ответ")])
+def test_does_not_retry_permanent_errors(sleeps, error):
+    scheduler = LLMScheduler(max_retries=3)
+
+    def call():
+        raise error
+
+    with pytest.raises(type(error)):
+        scheduler.call("dbt", "gpt-4o", [], call)
+    assert sleeps == []
+    assert scheduler.stats()["failed"] == 1
+
+
+def test_stream_retries_only_before_first_chunk(sleeps):
+    scheduler = LLMScheduler(max_retries=3)
+    attempts = []
+
+    def broken_stream():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ProviderError(503)
+        yield "первый"
+        raise ProviderError(503)
+
+    chunks = []
+    with pytest.raises(ProviderError):
+        for chunk in scheduler.stream("dbt", "gpt-4o", [], broken_stream):
+            chunks.append(chunk)
+    assert chunks == ["первый"]
+    assert len(attempts) == 2
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_async_call_retries(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(scheduler_module.asyncio, "sleep", fake_sleep)
+    scheduler = LLMScheduler(max_retries=2)
+    errors = [ProviderError(502)]
+
+    async def call():
+        return _raise_next(errors)
+
+    assert asyncio.run(scheduler.acall("router", "gpt-4o", [], call)) == "ok"
+    assert len(delays) == 1
+    assert scheduler.stats()["retries"] == 1
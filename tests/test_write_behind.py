@@ -0,0 +1,176 @@
+"""Отложенная запись пачками: core.write_behind.WriteBehindBuffer."""
+
+import threading
+import time
+
+import pytest
+
+from core import write_behind as write_behind_module
+from core.storage import MemoryStorage
+from core.write_behind import WriteBehindBuffer
+
+
+class FakeStorage:
+    """Запоминает пачки; строки с "bad" не пишутся, пока poisoned."""
+
+    def __init__(self, failures: int = 0):
+        self.batches = []
+        self.failures = failures
+        self.poisoned = True
+        self.gate = None
+        self.writing = threading.Event()
+
+    def _write_rows(self, message_rows, insight_rows, metric_rows=()):
+        self.writing.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        if self.poisoned and any("bad" in row for row in message_rows):
+            raise ValueError("плохая строка")
+        self.batches.append(list(message_rows))
+
+    @property
+    def rows(self):
+        return [row for batch in self.batches for row in batch]
+
+
+@pytest.fixture(autouse=True)
+def no_retry_pause(monkeypatch):
+    monkeypatch.setattr(write_behind_module.time, "sleep", lambda seconds: None)
+
+
+@pytest.fixture
+def buffers():
+    created = []
+
+    def make(storage, **kwargs):
+        buffer = WriteBehindBuffer(storage, **kwargs)
+        created.append(buffer)
+        return buffer
+
+    yield make
+    for buffer in created:
+        buffer.close()
+
+
+def wait_until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "условие не выполнилось"
+        time.sleep(0.005)
+
+
+def test_flush_writes_everything_submitted(buffers):
+    storage = FakeStorage()
+    buffer = buffers(storage, flush_interval_ms=10_000)
+    for index in range(5):
+        buffer.submit([(index,)], [])
+    buffer.flush(5)
+    assert storage.rows == [(index,) for index in range(5)]
+    assert buffer.stats()["records"] == 5
+
+
+def test_batches_are_limited_by_max_batch(buffers):
+    storage = FakeStorage()
+    buffer = buffers(storage, max_batch=2, flush_interval_ms=10_000)
+    for index in range(5):
+        buffer.submit([(index,)], [])
+    buffer.flush(5)
+    assert [len(batch) for batch in storage.batches] == [2, 2, 1]
+    assert buffer.stats()["batches"] == 3
+
+
+def test_interval_flushes_without_explicit_flush(buffers):
+    storage = FakeStorage()
+    buffers(storage, flush_interval_ms=10).submit([("a",)], [])
+    wait_until(lambda: storage.rows == [("a",)])
+
+
+def test_transient_errors_are_retried(buffers):
+    storage = FakeStorage(failures=2)
+    buffer = buffers(storage, flush_interval_ms=10_000)
+    buffer.submit([("a",)], [])
+    buffer.submit([("b",)], [])
+    buffer.flush(5)
+    assert storage.batches == [[("a",), ("b",)]]
+    stats = buffer.stats()
+    assert (stats["retries"], stats["records"], stats["failed"]) == (2, 2, 0)
+
+
+def test_bad_record_does_not_block_the_batch(buffers):
+    storage = FakeStorage()
+    buffer = buffers(storage, flush_interval_ms=10_000)
+    for row in ("a", "bad", "c"):
+        buffer.submit([(row,)], [])
+    buffer.flush(5)
+    assert storage.rows == [("a",), ("c",)]
+    stats = buffer.stats()
+    assert (stats["retries"], stats["failed"]) == (WriteBehindBuffer.RETRIES, 1)
+
+    # Неудачные записи повторяются при следующем flush()
+    storage.poisoned = False
+    buffer.flush(5)
+    assert storage.rows == [("a",), ("c",), ("bad",)]
+    assert buffer.stats()["failed"] == 0
+
+
+def test_close_retries_failed_records(buffers):
+    storage = FakeStorage()
+    buffer = buffers(storage, flush_interval_ms=10_000)
+    buffer.submit([("bad",)], [])
+    buffer.flush(5)
+    storage.poisoned = False
+    buffer.close()
+    assert storage.rows == [("bad",)]
+
+
+def test_full_queue_blocks_sender(buffers):
+    storage = FakeStorage()
+    storage.gate = threading.Event()
+    buffer = buffers(storage, flush_interval_ms=0, max_queue=1)
+    buffer.submit([("a",)], [])
+    assert storage.writing.wait(5)
+    buffer.submit([("b",)], [])
+
+    sender = threading.Thread(target=buffer.submit, args=([("c",)], []))
+    sender.start()
+    wait_until(lambda: buffer.stats()["blocked"] == 1)
+    assert sender.is_alive()
+
+    storage.gate.set()
+    sender.join(5)
+    buffer.flush(5)
+    assert storage.rows == [("a",), ("b",), ("c",)]
+
+
+def test_submit_after_close_writes_directly(buffers):
+    storage = FakeStorage()
+    buffer = buffers(storage)
+    buffer.close()
+    buffer.submit([("late",)], [])
+    assert storage.rows == [("late",)]
+    with pytest.raises(ValueError):
+        buffer.submit([("bad",)], [])
+
+
+def test_storage_reads_see_buffered_writes(tmp_path):
+    storage = MemoryStorage(str(tmp_path / "sessions.db"), write_behind=True, flush_interval_ms=10_000)
+    try:
+        session_id = storage.create_session("u")
+        for index in range(3):
+            storage.save_messages(session_id, {
+                "user_message": f"вопрос {index}",
+                "specialist_response": f"ответ {index}",
+                "current_approach": "DBT",
+                "confidence": 0.5,
+                "reasoning": "",
+            })
+        # Чтение истории само дожидается буфера
+        history = storage.get_session_history(session_id)
+        assert [message["content"] for message in history][-2:] == ["вопрос 2", "ответ 2"]
+        assert len(history) == 6
+        assert storage.write_stats()["records"] == 3
+    finally:
+        storage.close()
@@ -0,0 +1,313 @@
+"""Пакетная обработка бесед из JSONL без интерактивного ввода.
+
+    python -m tools.batch conversations.jsonl --out results.jsonl --concurrency 16 --max-llm-calls 8
+
+Входная строка: {"id": "c1", "user_id": "u1", "messages": ["...", "..."]}
+(сообщения - строки или {"role": "user", "content": "..."}; id по
+умолчанию - номер строки). Беседы идут параллельно (--concurrency), а
+число одновременных запросов к LLM во всем процессе ограничено
+--max-llm-calls. Ходы внутри беседы последовательны: каждый видит историю.
+
+В выходной JSONL пишется строка на каждый ход: ответ, решение роутера
+и инсайты; те же данные сохраняются в MemoryStorage (--db). Номер сессии
+каждой беседы записывается в <out>.sessions сразу после start_session.
+При повторном запуске прерванные беседы продолжаются через resume_session,
+а число готовых ходов берется из базы (сохраненные сообщения пользователя).
+Ход, сохраненный в базу, но не дописанный в файл перед сбоем, повторно не
+выполняется: его строка восстанавливается из базы с "recovered": true
+(без инсайтов - они не привязаны к ходу).
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from rich.console import Console
+from rich.progress import Progress
+
+from agents.llm import set_llm_concurrency
+from config import DATABASE_PATH
+from core.orchestrator import TherapyOrchestrator
+from core.storage import MemoryStorage
+
+console = Console()
+
+
+def load_conversations(path: str) -> List[Dict]:
+    conversations = []
+    with open(path, encoding="utf-8") as handle:
+        for number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            messages = [
+                message if isinstance(message, str) else message["content"]
+                for message in record["messages"]
+                if isinstance(message, str) or message.get("role", "user") == "user"
+            ]
+            conversations.append({
+                "id": str(record.get("id", number)),
+                "user_id": record.get("user_id", "batch"),
+                "messages": messages,
+            })
+    return conversations
+
+
+def load_sessions(path: str) -> Dict[str, int]:
+    """id беседы -> session_id из файла сессий (последняя запись главнее)."""
+
+    sessions: Dict[str, int] = {}
+    if not os.path.exists(path):
+        return sessions
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Оборванная запись при сбое: сессия найдется по выходному файлу
+                continue
+            sessions[record["id"]] = record["session_id"]
+    return sessions
+
+
+def recovered_turns(storage: MemoryStorage, conversation_id: str, session_id: int, after: int) -> List[Dict]:
+    """Строки ходов после after, которые есть в базе, но не попали в файл."""
+
+    records = []
+    turn = 0
+    user_message = None
+    for message in storage.get_session_history(session_id):
+        if message["role"] == "user":
+            turn += 1
+            user_message = message["content"]
+        elif turn > after:
+            records.append({
+                "id": conversation_id,
+                "turn": turn,
+                "session_id": session_id,
+                "user_message": user_message,
+                "response": message["content"],
+                "approach": message["approach"],
+                "confidence": message["confidence"],
+                "reasoning": message["reasoning"],
+                "insights": {},
+                "recovered": True,
+            })
+    return records
+
+
+def load_checkpoint(path: str) -> Dict[str, Tuple[Optional[int], int]]:
+    """id беседы -> (session_id, сколько ходов уже записано в файл).
+
+    Оборванная последняя строка (сбой во время записи) отбрасывается,
+    и файл обрезается до последней целой строки.
+    """
+
+    progress: Dict[str, Tuple[Optional[int], int]] = {}
+    if not os.path.exists(path):
+        return progress
+
+    valid_bytes = 0
+    with open(path, "rb") as handle:
+        for raw in handle:
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                break
+            valid_bytes += len(raw)
+            _, done = progress.get(record["id"], (None, 0))
+            progress[record["id"]] = (record.get("session_id"), max(done, record["turn"]))
+    if valid_bytes < os.path.getsize(path):
+        with open(path, "r+b") as handle:
+            handle.truncate(valid_bytes)
+    return progress
+
+
+def drop_conversations(path: str, ids: set) -> None:
+    """Убрать из выходного файла ходы бесед, которые начнутся заново."""
+
+    if not ids:
+        return
+    kept = path + ".tmp"
+    with open(path, encoding="utf-8") as source, open(kept, "w", encoding="utf-8") as target:
+        for line in source:
+            if json.loads(line)["id"] not in ids:
+                target.write(line)
+    os.replace(kept, path)
+
+
+class BatchRunner:
+    def __init__(self, engine: TherapyOrchestrator, out_path: str, total_turns: int, progress: Progress):
+        self.engine = engine
+        self.out = open(out_path, "a", encoding="utf-8")
+        self.sessions = open(out_path + ".sessions", "a", encoding="utf-8")
+        self.progress = progress
+        self.task = progress.add_task("Обработка", total=total_turns)
+        self.stop = threading.Event()
+        self.started = time.perf_counter()
+        self.turns = self.finished = self.failed = 0
+        self._lock = threading.Lock()
+
+    def run(self, conversation: Dict, checkpoint: Tuple[Optional[int], int]) -> None:
+        orchestrator = self.engine.fork()
+        session_id, done = checkpoint
+        turn = done
+        try:
+            if session_id is not None:
+                if orchestrator.resume_session(session_id) is None:
+                    raise RuntimeError(f"сессия {session_id} не найдена")
+            else:
+                orchestrator.start_session(conversation["user_id"])
+                # Сессию запоминаем до первого хода: если строки ходов не
+                # успеют записаться, беседа продолжится в ней же
+                self._write_session(conversation["id"], orchestrator.session_id)
+
+            for turn, message in enumerate(conversation["messages"][done:], done + 1):
+                if self.stop.is_set():
+                    return
+                result = orchestrator.process_message(message)
+                self._write({
+                    "id": conversation["id"],
+                    "turn": turn,
+                    "session_id": orchestrator.session_id,
+                    "user_message": message,
+                    **result,
+                })
+        except Exception as e:
+            console.print(f"[red]Беседа {conversation['id']}: ошибка на ходе {turn}: {e}[/red]")
+            with self._lock:
+                self.failed += 1
+            return
+        with self._lock:
+            self.finished += 1
+
+    def _write_session(self, conversation_id: str, session_id: Optional[int]) -> None:
+        line = json.dumps({"id": conversation_id, "session_id": session_id}) + "\n"
+        with self._lock:
+            self.sessions.write(line)
+            self.sessions.flush()
+
+    def write_recovered(self, records: List[Dict]) -> None:
+        """Дописать ходы, восстановленные из базы (прогресс не двигают)."""
+
+        with self._lock:
+            for record in records:
+                self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.out.flush()
+
+    def _write(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            # Строка целиком и сразу на диск: файл - это чекпоинт
+            self.out.write(line)
+            self.out.flush()
+            self.turns += 1
+            rate = self.turns / (time.perf_counter() - self.started)
+            description = f"{self.finished} бесед готово, {rate:.1f} ходов/с"
+        self.progress.update(self.task, advance=1, description=description)
+
+    def close(self) -> None:
+        self.out.close()
+        self.sessions.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL с беседами")
+    parser.add_argument("--out", help="выходной JSONL (по умолчанию <input>.out.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=8, help="бесед одновременно")
+    parser.add_argument("--max-llm-calls", type=int, default=8, help="одновременных запросов к LLM")
+    parser.add_argument("--db", default=DATABASE_PATH, help="база MemoryStorage")
+    parser.add_argument("--limit", type=int, help="обработать только первые N бесед")
+    args = parser.parse_args()
+
+    out_path = args.out or os.path.splitext(args.input)[0] + ".out.jsonl"
+    conversations = load_conversations(args.input)[: args.limit]
+    written = load_checkpoint(out_path)
+    sessions = load_sessions(out_path + ".sessions")
+    for conversation_id, (session_id, _) in written.items():
+        if session_id is not None:
+            sessions.setdefault(conversation_id, session_id)
+
+    # Прерванные беседы продолжаем с сохраненной сессии; если ее нет
+    # (другая база), начинаем беседу заново
+    set_llm_concurrency(args.max_llm_calls)
+    storage = MemoryStorage(args.db)
+    engine = TherapyOrchestrator(use_memory=True, background_memory=False, storage=storage)
+    restart = {
+        conversation_id
+        for conversation_id, session_id in sessions.items()
+        if storage.load_session_context(session_id, 1) is None
+    } | {conversation_id for conversation_id in written if conversation_id not in sessions}
+    drop_conversations(out_path, restart)
+    for conversation_id in restart:
+        sessions.pop(conversation_id, None)
+        written.pop(conversation_id, None)
+
+    # Готовые ходы считаем по базе: файл мог не успеть получить последние строки
+    checkpoint = {
+        conversation_id: (session_id, storage.count_user_messages(session_id))
+        for conversation_id, session_id in sessions.items()
+    }
+    recovered = [
+        record
+        for conversation_id, (session_id, done) in checkpoint.items()
+        if done > written.get(conversation_id, (None, 0))[1]
+        for record in recovered_turns(
+            storage, conversation_id, session_id, written.get(conversation_id, (None, 0))[1]
+        )
+    ]
+
+    pending = [
+        conversation for conversation in conversations
+        if checkpoint.get(conversation["id"], (None, 0))[1] < len(conversation["messages"])
+    ]
+    skipped = len(conversations) - len(pending)
+    total_turns = sum(
+        len(conversation["messages"]) - checkpoint.get(conversation["id"], (None, 0))[1]
+        for conversation in pending
+    )
+    console.print(
+        f"Бесед: {len(conversations)}, готово ранее: {skipped}, к обработке: {len(pending)} "
+        f"({total_turns} ходов), параллельно {args.concurrency}, запросов к LLM до {args.max_llm_calls}"
+    )
+    if recovered:
+        console.print(f"Восстановлено из базы ходов без строки в файле: {len(recovered)}")
+
+    interrupted = False
+    with Progress(console=console) as progress:
+        runner = BatchRunner(engine, out_path, total_turns, progress)
+        runner.write_recovered(recovered)
+        executor = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="batch")
+        futures = [
+            executor.submit(runner.run, conversation, checkpoint.get(conversation["id"], (None, 0)))
+            for conversation in pending
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            # Текущие ходы дописываются, новые не начинаются
+            interrupted = True
+            runner.stop.set()
+            for future in futures:
+                future.cancel()
+        executor.shutdown(wait=True)
+        runner.close()
+
+    elapsed = time.perf_counter() - runner.started
+    console.print(
+        f"Ходов: {runner.turns} за {elapsed:.1f} с ({runner.turns / elapsed if elapsed else 0:.1f} ходов/с), "
+        f"бесед завершено: {runner.finished}, с ошибкой: {runner.failed}. Результаты: {out_path}"
+    )
+    if interrupted or runner.failed:
+        console.print("[yellow]Повторный запуск с теми же параметрами продолжит с места остановки[/yellow]")
+    engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Выгрузка сессий в NDJSON без загрузки истории в память.
+
+    python -m tools.export_history --db therapy_sessions.db --out history.ndjson [--session 42] [--user u1]
+
+Строки пишутся в файл по мере чтения страниц из базы (MemoryStorage.export_ndjson),
+поэтому память не зависит от размера выгрузки. Без --session и --user
+выгружаются все сессии; --out - по умолчанию стандартный вывод.
+"""
+
+import argparse
+import sys
+
+from config import DATABASE_PATH
+from core.storage import MemoryStorage
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DATABASE_PATH, help="путь к SQLite базе сессий")
+    parser.add_argument("--out", help="файл NDJSON (по умолчанию - стандартный вывод)")
+    parser.add_argument("--session", type=int, action="append", help="только эта сессия (можно несколько)")
+    parser.add_argument("--user", help="только сессии пользователя")
+    parser.add_argument("--no-insights", action="store_true", help="без инсайтов")
+    args = parser.parse_args()
+
+    storage = MemoryStorage(args.db)
+    session_ids = args.session or storage.iter_session_ids(args.user)
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        for chunk in storage.export_ndjson(session_ids, include_insights=not args.no_insights):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Отчет по замерам ходов из таблицы metrics.
+
+    python -m tools.metrics_report --db therapy_sessions.db [--session 42] [--limit 10000]
+
+Показывает p50/p95 времени по узлам графа, вызовам LLM и хранилища, а также
+токены и стоимость по сессиям. Стоимость считается по прайсу LiteLLM
+в момент вызова; для моделей без цены она пустая.
+"""
+
+import argparse
+
+from rich.console import Console
+from rich.table import Table
+
+from core.metrics import node_stats
+from core.storage import MemoryStorage
+
+console = Console()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="therapy_sessions.db", help="путь к SQLite базе сессий")
+    parser.add_argument("--session", type=int, default=None, help="только одна сессия")
+    parser.add_argument("--limit", type=int, default=10000, help="сколько последних замеров учитывать")
+    parser.add_argument("--sessions", type=int, default=20, help="сколько сессий показать в таблице стоимости")
+    args = parser.parse_args()
+
+    storage = MemoryStorage(args.db)
+    records = storage.get_metrics(args.session, args.limit)
+    if not records:
+        console.print("[dim]Замеров нет: включите METRICS_ENABLED и проведите хотя бы один ход[/dim]")
+        storage.close()
+        return
+
+    table = Table(title=f"Время по узлам (последние {len(records)} замеров)")
+    table.add_column("Вид")
+    table.add_column("Узел")
+    table.add_column("N", justify="right")
+    table.add_column("p50, мс", justify="right")
+    table.add_column("p95, мс", justify="right")
+    table.add_column("Среднее, мс", justify="right")
+    for row in node_stats(records):
+        table.add_row(
+            row["kind"], row["node"], str(row["count"]),
+            f"{row['p50_ms']:.1f}", f"{row['p95_ms']:.1f}", f"{row['mean_ms']:.1f}",
+        )
+    console.print(table)
+
+    table = Table(title="Стоимость по сессиям")
+    table.add_column("Сессия", justify="right")
+    table.add_column("Ходов", justify="right")
+    table.add_column("Prompt", justify="right")
+    table.add_column("Completion", justify="right")
+    table.add_column("$", justify="right")
+    table.add_column("$ / ход", justify="right")
+    for row in storage.session_costs(args.session, args.sessions):
+        per_turn = row["cost"] / row["turns"] if row["turns"] else 0.0
+        table.add_row(
+            str(row["session_id"]), str(row["turns"]),
+            str(row["prompt_tokens"]), str(row["completion_tokens"]),
+            f"{row['cost']:.4f}", f"{per_turn:.4f}",
+        )
+    console.print(table)
+    storage.close()
+
+
+if __name__ == "__main__":
+    main()
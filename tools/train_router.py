@@ -0,0 +1,148 @@
+"""Обучение локального классификатора роутера на истории сессий.
+
+    python -m tools.train_router --db therapy_sessions.db --out router_classifier.json
+
+Метки - решения LLM-роутера из таблицы messages (route_source = 'llm').
+Ходы, которые маршрутизировал сам классификатор, и DBT по умолчанию после
+неразобранного ответа в обучение не попадают, поэтому точность на
+отложенной выборке - это согласие с LLM-роутером, а не с самим собой.
+"""
+
+import argparse
+import random
+from typing import Dict, List, Sequence, Tuple
+
+from rich.console import Console
+from rich.table import Table
+
+from agents.base import APPROACHES, ROUTE_LLM
+from agents.classifier import LocalRouterClassifier, train_classifier
+from agents.prompts import ROUTER_PROMPT
+from config import ROUTER_CLASSIFIER_PATH, ROUTER_CLASSIFIER_THRESHOLD
+from core.storage import MemoryStorage
+from services.prompt_store import PromptStore
+
+console = Console()
+
+THRESHOLDS = (0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95)
+
+
+def coverage_report(
+    model: LocalRouterClassifier, samples: Sequence[Tuple[str, str]]
+) -> List[Dict]:
+    """Доля сообщений, решенных локально, и согласие с LLM на каждом пороге."""
+
+    predictions = [(model.predict(text), label) for text, label in samples]
+    rows = []
+    for threshold in THRESHOLDS:
+        covered = [(approach, label) for (approach, confidence), label in predictions if confidence >= threshold]
+        correct = sum(1 for approach, label in covered if approach == label)
+        rows.append({
+            "threshold": threshold,
+            "coverage": len(covered) / len(predictions) if predictions else 0.0,
+            "accuracy": correct / len(covered) if covered else 0.0,
+        })
+    return rows
+
+
+def confusion(model: LocalRouterClassifier, samples: Sequence[Tuple[str, str]]) -> Dict[str, Dict[str, int]]:
+    matrix = {label: {approach: 0 for approach in APPROACHES} for label in APPROACHES}
+    for text, label in samples:
+        approach, _ = model.predict(text)
+        if label in matrix:
+            matrix[label][approach] += 1
+    return matrix
+
+
+def live_agreement(
+    model: LocalRouterClassifier, samples: Sequence[Tuple[str, str]], threshold: float, prompt: str = ROUTER_PROMPT
+) -> None:
+    """Сравнить с текущим LLM-роутером на небольшой выборке (тратит вызовы LLM)."""
+
+    from agents.specialists import RouterAgent
+
+    router = RouterAgent(prompt)
+    agree = covered = 0
+    for text, _ in samples:
+        approach, confidence = model.predict(text)
+        if confidence < threshold:
+            continue
+        state = router.route({"user_message": text, "messages": []})
+        # DBT по умолчанию после неразобранного ответа - не решение LLM
+        if state["route_source"] != ROUTE_LLM:
+            continue
+        covered += 1
+        agree += state["current_approach"] == approach
+    if covered:
+        console.print(f"Согласие с текущим LLM-роутером: {agree}/{covered} ({agree / covered:.0%})")
+    else:
+        console.print("[dim]Нет сообщений выше порога для живой проверки[/dim]")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="therapy_sessions.db", help="путь к SQLite базе сессий")
+    parser.add_argument("--out", default=ROUTER_CLASSIFIER_PATH, help="куда сохранить модель")
+    parser.add_argument("--holdout", type=float, default=0.2, help="доля отложенной выборки")
+    parser.add_argument("--threshold", type=float, default=ROUTER_CLASSIFIER_THRESHOLD)
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--limit", type=int, default=None, help="взять только N последних сообщений")
+    parser.add_argument("--live", type=int, default=0, help="проверить N сообщений против текущего LLM-роутера")
+    parser.add_argument("--prompt-file", help="промпт роутера (по умолчанию - текущий из хранилища промптов)")
+    args = parser.parse_args()
+
+    # Модель привязана к промпту: роутер с другим промптом ее не использует
+    if args.prompt_file:
+        with open(args.prompt_file, encoding="utf-8") as handle:
+            prompt = handle.read()
+    else:
+        prompt = PromptStore().get_all({"router": ROUTER_PROMPT})["router"]
+
+    storage = MemoryStorage(args.db)
+    examples = [
+        (row["message"], row["approach"])
+        for row in storage.get_routing_examples(args.limit)
+        if row["approach"] in APPROACHES
+    ]
+    console.print(f"Решений LLM-роутера в истории: {len(examples)}")
+
+    random.Random(7).shuffle(examples)
+    split = int(len(examples) * (1 - args.holdout))
+    train, holdout = examples[:split], examples[split:]
+
+    if holdout:
+        model = train_classifier(train, prompt=prompt, epochs=args.epochs)
+
+        table = Table(title="Согласие с LLM-роутером на отложенной выборке")
+        table.add_column("Порог", justify="right")
+        table.add_column("Покрытие", justify="right")
+        table.add_column("Точность", justify="right")
+        for row in coverage_report(model, holdout):
+            style = "bold" if row["threshold"] == args.threshold else None
+            table.add_row(
+                f"{row['threshold']:.2f}", f"{row['coverage']:.0%}", f"{row['accuracy']:.0%}", style=style
+            )
+        console.print(table)
+
+        matrix = confusion(model, holdout)
+        table = Table(title="Матрица ошибок (строки - LLM, столбцы - классификатор)")
+        table.add_column("")
+        for approach in APPROACHES:
+            table.add_column(approach, justify="right")
+        for label in APPROACHES:
+            table.add_row(label, *(str(matrix[label][approach]) for approach in APPROACHES))
+        console.print(table)
+
+        if args.live:
+            live_agreement(model, holdout[: args.live], args.threshold, prompt)
+    else:
+        console.print("[yellow]Отложенная выборка пуста - отчет о точности пропущен[/yellow]")
+
+    # Итоговая модель обучается на всех данных
+    model = train_classifier(examples, prompt=prompt, epochs=args.epochs)
+    model.save(args.out)
+    console.print(f"[green]✓ Модель сохранена: {args.out}[/green]")
+
+
+if __name__ == "__main__":
+    main()